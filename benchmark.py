@@ -0,0 +1,292 @@
+import argparse
+import os
+import json
+import time
+import shutil
+import logging
+import platform
+import tempfile
+import tracemalloc
+import numpy as np
+import cv2
+from src.LoggingManager import configure_logging
+from src.MovementType import MovementType
+from src.evolver import Evolver
+from src.simulator import simulate, iter_frames, open_video_writer, Instruction, VIDEO_FILE
+from src.AnnotationStore import AnnotationStore
+from src.BackgroundIterator import StaticBackgroundIterator, VideoBackgroundIterator
+from src.FrameWriter import FrameWriter
+from src.ShardWriter import ShardWriter
+from create_video import add_writer_arguments, writer_options_from_args
+
+STAGES = ['evolve', 'aggregate', 'write', 'simulate']
+BACKGROUNDS = ['color', 'image', 'video']
+SEGMENT_COMMANDS = [MovementType.trap, MovementType.urm, MovementType.uarm]
+
+
+def parse_resolutions(resolutions_arg: str) -> list:
+    """Parse "224x224,640x480" as [(224, 224), (640, 480)]."""
+    resolutions = []
+    for r in resolutions_arg.split(','):
+        w, h = r.lower().split('x')
+        resolutions.append((int(w), int(h)))
+    return resolutions
+
+
+def parse_ints(ints_arg: str) -> list:
+    return [int(v) for v in ints_arg.split(',')]
+
+
+def make_instructions(width: int, height: int, num_objects: int, duration: int, seed: int = 0) -> list:
+    """Objects crossing the frame along random routes of one second segments.
+
+    Patches are circles sized on the frame, so the composition cost scales with
+    the resolution as in real sequences.
+    """
+    rng = np.random.RandomState(seed)
+    size = max(8, min(width, height) // 8)
+    patch = np.zeros((size, size, 3), dtype=np.uint8)
+    cv2.circle(patch, (size // 2, size // 2), size // 2 - 1, (0, 0, 255), -1)
+    instructions = []
+    for i in range(num_objects):
+        points = rng.randint(0, [width, height], size=(duration + 1, 2))
+        route = [[int(x), int(y), SEGMENT_COMMANDS[(i + k) % len(SEGMENT_COMMANDS)], 1000]
+                 for k, (x, y) in enumerate(points[1:])]
+        instructions.append(Instruction(i % 10, patch, int(points[0, 0]), int(points[0, 1]), route))
+    return instructions
+
+
+def make_background_frame(width: int, height: int, shift: int = 0) -> np.ndarray:
+    """Smooth gradient frame, shift moves it to fake a video."""
+    x = (np.arange(width) + shift) % 256
+    y = np.arange(height) % 256
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    frame[:, :, 0] = x[None, :]
+    frame[:, :, 1] = y[:, None]
+    frame[:, :, 2] = 128
+    return frame
+
+
+def write_background_video(path: str, width: int, height: int, num_frames: int, fps: int) -> None:
+    out = open_video_writer(path, (width, height), fps)
+    for i in range(num_frames):
+        out.write(make_background_frame(width, height, 4 * i))
+    out.release()
+
+
+class Case:
+    """One point of the benchmark matrix.
+
+    Attributes:
+        width(int)
+        height(int)
+        num_objects(int)
+        fps(int)
+        background(str): one of BACKGROUNDS
+        duration(int): seconds of the sequence
+        work_dir(str): directory for the outputs and the background video
+    """
+
+    def __init__(self, width: int, height: int, num_objects: int, fps: int, background: str, duration: int,
+                 work_dir: str) -> None:
+        self.width = width
+        self.height = height
+        self.num_objects = num_objects
+        self.fps = fps
+        self.background = background
+        self.duration = duration
+        self.work_dir = work_dir
+        self.instructions = make_instructions(width, height, num_objects, duration)
+        self.num_frames = duration * fps
+        self.video_path = os.path.join(work_dir, "bg_{}x{}_{}.mp4".format(width, height, fps))
+        if background == 'video' and not os.path.exists(self.video_path):
+            write_background_video(self.video_path, width, height, self.num_frames, fps)
+
+    @property
+    def name(self) -> str:
+        return "{}x{}-o{}-f{}-{}".format(self.width, self.height, self.num_objects, self.fps, self.background)
+
+    def make_background(self):
+        if self.background == 'color':
+            return StaticBackgroundIterator.from_color(self.width, self.height, (40, 40, 40))
+        if self.background == 'image':
+            return StaticBackgroundIterator(make_background_frame(self.width, self.height))
+        return VideoBackgroundIterator(self.video_path, self.width, self.height)
+
+    def make_levels(self) -> list:
+        levels = []
+        for instruction in self.instructions:
+            evolver = Evolver(self.width, self.height, instruction.origin_x, instruction.origin_y, instruction.patch, self.fps)
+            track, _ = evolver.compute_evolutions(instruction.route)
+            levels.append((instruction.patch, instruction.mask, track))
+        return levels
+
+
+def run_evolve(case: Case, levels: list, writer_options: dict) -> None:
+    case.make_levels()
+
+
+def run_aggregate(case: Case, levels: list, writer_options: dict) -> None:
+    background = case.make_background()
+    for _ in iter_frames(levels, background):
+        pass
+    background.close()
+
+
+def run_write(case: Case, levels: list, writer_options: dict) -> None:
+    """Write the frames of the case, cycling over a few composed ones to leave composition out."""
+    background = case.make_background()
+    background.reserve(8)
+    frames = []
+    for frame in iter_frames(levels, background):
+        frames.append(frame)
+        if len(frames) == 8:
+            break
+    background.close()
+    store = AnnotationStore.from_tracks([(0, track) for _, _, track in levels], case.width, case.height)
+    out_dir = tempfile.mkdtemp(dir=case.work_dir)
+    options = dict(writer_options)
+    output_format = options.pop("output_format", "files")
+    if output_format == "video":
+        video = open_video_writer(os.path.join(out_dir, VIDEO_FILE), (case.width, case.height), case.fps)
+        for i in range(case.num_frames):
+            video.write(frames[i % len(frames)])
+        video.release()
+    else:
+        writer_class = ShardWriter if output_format == "shards" else FrameWriter
+        with writer_class(out_dir, **options) as writer:
+            for i in range(case.num_frames):
+                writer.write(i, frames[i % len(frames)], store.yolo_lines(i))
+    shutil.rmtree(out_dir)
+
+
+def run_simulate(case: Case, levels: list, writer_options: dict) -> None:
+    out_dir = tempfile.mkdtemp(dir=case.work_dir)
+    background = case.make_background()
+    simulate(case.width, case.height, background, case.instructions, out_dir, fps=case.fps, progress=False,
+             writer_options=writer_options)
+    background.close()
+    shutil.rmtree(out_dir)
+
+
+STAGE_RUNNERS = {'evolve': run_evolve, 'aggregate': run_aggregate, 'write': run_write, 'simulate': run_simulate}
+
+
+def measure(run, case: Case, levels: list, writer_options: dict, repeat: int, memory: bool) -> dict:
+    """Time the best of repeat runs of a stage, then trace its peak memory in one more run.
+
+    Returns:
+        result(dict): seconds, fps (frames/s of the case) and peak_mb (None without memory)
+    """
+    seconds = float('inf')
+    for _ in range(repeat):
+        # trap segments draw their cruise speed
+        np.random.seed(0)
+        start = time.perf_counter()
+        run(case, levels, writer_options)
+        seconds = min(seconds, time.perf_counter() - start)
+    peak_mb = None
+    if memory:
+        np.random.seed(0)
+        tracemalloc.start()
+        run(case, levels, writer_options)
+        peak_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    return {"seconds": seconds, "fps": case.num_frames / seconds, "peak_mb": peak_mb}
+
+
+def run_benchmarks(cases: list, stages: list, writer_options: dict, repeat: int = 3, memory: bool = True) -> dict:
+    """Measure each stage of each case.
+
+    Returns:
+        results(dict): "meta" of the machine and "cases", each with its parameters and "stages" results
+    """
+    results = {"meta": {"python": platform.python_version(), "numpy": np.__version__, "opencv": cv2.__version__,
+                        "machine": platform.machine(), "cpus": os.cpu_count(), "writer_options": writer_options},
+               "cases": []}
+    for case in cases:
+        np.random.seed(0)
+        levels = case.make_levels()
+        entry = {"name": case.name, "width": case.width, "height": case.height, "objects": case.num_objects,
+                 "fps": case.fps, "background": case.background, "frames": case.num_frames, "stages": {}}
+        for stage in stages:
+            entry["stages"][stage] = measure(STAGE_RUNNERS[stage], case, levels, writer_options, repeat, memory)
+            logging.info("{:<28} {:<10} {:10.1f} frames/s {:>10}".format(
+                case.name, stage, entry["stages"][stage]["fps"],
+                "" if not memory else "{:.1f} MB".format(entry["stages"][stage]["peak_mb"])))
+        results["cases"].append(entry)
+    return results
+
+
+def compare_results(results: dict, baseline: dict, threshold: float) -> list:
+    """Find the stages slower than the baseline by more than threshold.
+
+    Cases or stages missing in one of the two are not compared.
+
+    Args:
+        results(dict): run_benchmarks results
+        baseline(dict): run_benchmarks results of the reference run
+        threshold(float): allowed relative throughput drop (e.g. 0.1 for 10%)
+
+    Returns:
+        regressions(list): (case name, stage, baseline fps, fps) of each regression
+    """
+    baseline_cases = {case["name"]: case for case in baseline["cases"]}
+    regressions = []
+    for case in results["cases"]:
+        if case["name"] not in baseline_cases:
+            continue
+        baseline_stages = baseline_cases[case["name"]]["stages"]
+        for stage, result in case["stages"].items():
+            if stage not in baseline_stages:
+                continue
+            baseline_fps = baseline_stages[stage]["fps"]
+            if result["fps"] < baseline_fps * (1 - threshold):
+                regressions.append((case["name"], stage, baseline_fps, result["fps"]))
+    return regressions
+
+
+if __name__ == '__main__':
+    configure_logging(log_lvl=logging.INFO, log_console=True)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-R", "--resolutions", type=str, default="224x224,640x480,1280x720,1920x1080", help="Frame sizes to benchmark (e.g. '640x480,1280x720')")
+    parser.add_argument("-NO", "--objects", type=str, default="1,8", help="Numbers of objects per sequence (e.g. '1,8,32')")
+    parser.add_argument("-F", "--fps", type=str, default="30", help="Sequence fps values (e.g. '15,30')")
+    parser.add_argument("-B", "--backgrounds", type=str, default=",".join(BACKGROUNDS), help="Background types in {}".format(BACKGROUNDS))
+    parser.add_argument("-D", "--duration", type=int, default=4, help="Duration of each sequence (seconds)")
+    parser.add_argument("-S", "--stages", type=str, default=",".join(STAGES), help="Stages to measure in {}".format(STAGES))
+    parser.add_argument("-RP", "--repeat", type=int, default=3, help="Timed runs of each stage, the best one is kept")
+    parser.add_argument("-NM", "--no-memory", action="store_true", help="Skip the traced run measuring the peak memory of each stage")
+    parser.add_argument("-O", "--output", type=str, default="benchmark_results.json", help="Output json of the results")
+    parser.add_argument("-BL", "--baseline", type=str, default=None, help="Results json of a reference run to compare with (e.g. a previous --output)")
+    parser.add_argument("-T", "--threshold", type=float, default=0.1, help="Allowed frames/s drop against the baseline before failing (e.g. 0.1 for 10%%)")
+    add_writer_arguments(parser)
+    args = parser.parse_args()
+
+    stages = args.stages.split(',')
+    backgrounds = args.backgrounds.split(',')
+    for value, allowed in [(s, STAGES) for s in stages] + [(b, BACKGROUNDS) for b in backgrounds]:
+        if value not in allowed:
+            logging.error("Unknown '{}', use {}".format(value, allowed))
+            exit(2)
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        cases = [Case(w, h, n, fps, bg, args.duration, work_dir)
+                 for w, h in parse_resolutions(args.resolutions) for n in parse_ints(args.objects)
+                 for fps in parse_ints(args.fps) for bg in backgrounds]
+        results = run_benchmarks(cases, stages, writer_options_from_args(args), args.repeat, not args.no_memory)
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+    logging.info("Written {}".format(args.output))
+
+    if baseline is not None:
+        regressions = compare_results(results, baseline, args.threshold)
+        for name, stage, baseline_fps, fps in regressions:
+            logging.error("{} {}: {:.1f} frames/s, baseline {:.1f} frames/s".format(name, stage, fps, baseline_fps))
+        if len(regressions) > 0:
+            exit(1)
+        logging.info("No regression over {:.0f}% against {}".format(args.threshold * 100, args.baseline))
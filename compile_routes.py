@@ -0,0 +1,55 @@
+import argparse
+import os
+import logging
+from create_video import parse_instructions
+from src.RouteLibrary import RouteLibrary
+from src.LoggingManager import configure_logging
+
+
+def find_routes(paths: list) -> dict:
+    """Route .txt files by route name (file name without extension) of files and directories in paths."""
+    routes = {}
+    for path in paths:
+        if os.path.isdir(path):
+            files = sorted(os.path.join(path, fn) for fn in os.listdir(path) if fn.endswith(".txt"))
+        else:
+            files = [path]
+        for fn in files:
+            routes[os.path.splitext(os.path.basename(fn))[0]] = fn
+    return routes
+
+
+def compile_routes(paths: list, library: RouteLibrary = None) -> RouteLibrary:
+    """Compile route files, added to (or replacing same name routes of) library if given."""
+    routes = {}
+    if library is not None:
+        routes = {name: library.get(name) for name in library.names.tolist()}
+    for name, fn in find_routes(paths).items():
+        routes[name] = parse_instructions(fn)
+    return RouteLibrary.from_routes(routes)
+
+
+if __name__ == '__main__':
+    configure_logging(log_lvl=logging.INFO, log_console=True)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-R", "--routes", type=str, default=None, help="Comma separated route .txt files or directories to compile, routes are named after the file (e.g. 'routes,extra/zigzag.txt')")
+    parser.add_argument("-L", "--library", type=str, default=None, help="Existing route library to add the routes to, or to export")
+    parser.add_argument("-O", "--output", type=str, default=None, help="Output route library .npz (default --library)")
+    parser.add_argument("-E", "--export-dir", type=str, default=None, help="Write the routes of --library as .txt files in this directory")
+    args = parser.parse_args()
+
+    library = RouteLibrary.load(args.library) if args.library is not None else None
+    if args.export_dir is not None:
+        if library is None:
+            logging.error("--export-dir needs --library")
+            exit(1)
+        paths = library.export_text(args.export_dir)
+        logging.info("Exported {} routes to {}".format(len(paths), args.export_dir))
+        exit(0)
+    output = args.output if args.output is not None else args.library
+    if args.routes is None or output is None:
+        logging.error("Give --routes and --output (or --library) to compile routes")
+        exit(1)
+    library = compile_routes(args.routes.split(','), library)
+    library.save(output)
+    logging.info("Compiled {} routes in {}".format(len(library), output))
@@ -1,8 +1,14 @@
 import logging
 import random
 import argparse
+import numpy as np
+from typing import Tuple
+from src.MovementType import MovementType
+from src.RouteLibrary import RouteLibrary, format_route, STEP_DTYPE, MOVEMENT_CODES
 
 commands_base = ["const", "acc", "trap", "pause"]
+# MovementType of each route command, see create_video.txt_to_MovementType
+command_types = {"const": MovementType.urm, "acc": MovementType.uarm, "trap": MovementType.trap}
 
 
 def generate_number_with_sum(n: int, total: int, min_value: int = 1):
@@ -34,8 +40,8 @@ def routes_generator(num_instructions: int,
                      duration: int,
                      frame_size: tuple,
                      min_pause: int = 100,
-                     commands: list = None) -> list:
-    """Generate instruction list.
+                     commands: list = None) -> Tuple[int, int, list]:
+    """Generate a random route.
 
     Args:
         num_instructions(int):
@@ -45,15 +51,16 @@ def routes_generator(num_instructions: int,
         commands(list): list of commands
 
     Returns:
-        list of instructions
+        origin_x(int), origin_y(int), route(list) as create_video.parse_instructions returns them,
+        a pause is a const step to the current position
     """
     if commands is None:
         commands = commands_base
-    instructions = []
+    route = []
 
     # make origin
     origin = [random.randint(0, frame_size[1]), random.randint(0, frame_size[0])]
-    instructions.append(f'{origin[1]}, {origin[0]} \n')
+    last = (origin[1], origin[0])
 
     # times [ms]
     timeframe = generate_number_with_sum(num_instructions, duration, min_pause)
@@ -63,19 +70,93 @@ def routes_generator(num_instructions: int,
     for i in timeframe:
         # generate command
         if cmd == "pause":
-            cmd = random.choice(tuple(set(commands) - {"pause"}))
+            cmd = random.choice(sorted(set(commands) - {"pause"}))
         else:
             cmd = random.choice(commands)
 
         # generate destination
-        dst = ()
         if cmd != "pause":
             dst = (random.randint(0, frame_size[1]), random.randint(0, frame_size[0]))
-            instruction = f'{dst[1]}, {dst[0]}, {cmd}, {i} \n'
+            last = (dst[1], dst[0])
+            route.append([last[0], last[1], command_types[cmd], int(i)])
         else:
-            instruction = f'{cmd}, {i} \n'
-        instructions.append(instruction)
-    return instructions
+            route.append([last[0], last[1], MovementType.urm, int(i)])
+    return origin[1], origin[0], route
+
+
+def routes_batch_generator(num_routes: int,
+                           num_instructions,
+                           duration: int,
+                           frame_size: tuple,
+                           min_pause=100,
+                           commands: list = None,
+                           seed=None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Generate many random routes at once, with the rules of routes_generator.
+
+    Durations are split as generate_number_with_sum does, a pause never follows a
+    pause nor starts a route, and destinations are uniform in the frame. Every draw
+    is made for all routes and steps at once from a numpy Generator.
+
+    Args:
+        num_routes(int)
+        num_instructions(int or ndarray): instructions of every route, or of each route
+        duration(int): [ms] of every route
+        frame_size(tuple): (w,h)
+        min_pause(int or ndarray): min duration of the instructions of every route, or of each route
+        commands(list): list of commands
+        seed(int or np.random.Generator): seed of the generator, routes are the same for the same seed
+
+    Returns:
+        origins(ndarray): (num_routes, 2) origin (x, y) of each route
+        steps(ndarray): (num_routes, K) STEP_DTYPE steps, K the max of num_instructions, a pause is
+            a const step to the current position
+        counts(ndarray): (num_routes,) number of steps of each route, the following ones are padding
+    """
+    rng = np.random.default_rng(seed)
+    commands = commands_base if commands is None else commands
+    moves = sorted(set(commands) - {"pause"})
+    if len(moves) == 0:
+        raise ValueError("commands must contain a command other than pause")
+    # MOVEMENT_CODES index of each command, a pause is a const step
+    command_codes = np.array([MOVEMENT_CODES.index(command_types.get(c, MovementType.urm).value) for c in commands], dtype=np.int8)
+    move_codes = np.array([MOVEMENT_CODES.index(command_types[c].value) for c in moves], dtype=np.int8)
+    command_pause = np.array([c == "pause" for c in commands])
+    w, h = frame_size
+
+    # duration partition, a single step when it is not possible (see generate_number_with_sum)
+    counts = np.broadcast_to(np.asarray(num_instructions, dtype=np.int64), (num_routes,))
+    min_pause = np.broadcast_to(np.asarray(min_pause, dtype=np.int64), (num_routes,))
+    counts = np.where((counts <= 1) | (duration <= 1) | (duration < counts * min_pause), 1, counts)
+    k = int(counts.max()) if num_routes > 0 else 0
+    index = np.arange(k)
+    high = duration // counts
+    times = rng.integers(np.minimum(min_pause, high)[:, None], high[:, None] + 1, size=(num_routes, k))
+    times[index >= counts[:, None] - 1] = 0
+    times[np.arange(num_routes), counts - 1] = duration - times.sum(axis=1)
+
+    # commands, the pauses following a pause are drawn again among the other commands. In a
+    # run of drawn pauses every other one is replaced, a route starts after a virtual pause
+    drawn = rng.integers(len(commands), size=(num_routes, k))
+    redrawn = rng.integers(len(moves), size=(num_routes, k))
+    pause = command_pause[drawn]
+    last_move = np.maximum.accumulate(np.where(pause, -2, index), axis=1)
+    replace = pause & ((index - last_move) % 2 == 0)
+    types = np.where(replace, move_codes[redrawn], command_codes[drawn])
+    pause &= ~replace
+
+    # destinations, a pause stays at the last destination (or origin)
+    origins = np.stack([rng.integers(0, w + 1, size=num_routes), rng.integers(0, h + 1, size=num_routes)], axis=1)
+    dest = np.stack([rng.integers(0, w + 1, size=(num_routes, k)), rng.integers(0, h + 1, size=(num_routes, k))], axis=2)
+    last_move = np.maximum.accumulate(np.where(pause, -1, index), axis=1)
+    dest = np.where((last_move >= 0)[:, :, None],
+                    np.take_along_axis(dest, np.maximum(last_move, 0)[:, :, None], axis=1), origins[:, None, :])
+
+    steps = np.zeros((num_routes, k), dtype=STEP_DTYPE)
+    steps['dest'] = dest
+    steps['type'] = types
+    steps['time'] = times
+    steps['scale'] = steps['angle'] = np.nan
+    return origins, steps, counts
 
 
 if __name__ == '__main__':
@@ -85,12 +166,26 @@ if __name__ == '__main__':
     parser.add_argument("-d", "--duration", type=int, default=100, help="video duration in [ms]")
     parser.add_argument("-W", "--width", default=640, type=int, help="width of frame")
     parser.add_argument("-H", "--height", default=480, type=int, help="height of frame")
+    parser.add_argument("-N", "--num-routes", type=int, default=1, help="number of routes, named <name>_<i> when more than one")
+    parser.add_argument("-L", "--library", type=str, default=None, help="write the routes in this route library .npz instead of .txt files in routes")
+    parser.add_argument("-S", "--seed", type=int, default=None, help="seed of the routes")
 
     # parsing
     args = parser.parse_args()
-    generated_instructions = routes_generator(args.instructions, args.duration, (args.width, args.height))
-
-    # save file
     DIR_ROUTES = "routes"
-    with open(f"{DIR_ROUTES}/{args.name}.txt", 'w+') as outfile:
-        outfile.writelines(generated_instructions)
+    if args.num_routes == 1 and args.library is None:
+        if args.seed is not None: random.seed(args.seed)
+        generated_instructions = routes_generator(args.instructions, args.duration, (args.width, args.height))
+
+        # save file
+        with open(f"{DIR_ROUTES}/{args.name}.txt", 'w+') as outfile:
+            outfile.writelines(format_route(*generated_instructions))
+    else:
+        origins, steps, counts = routes_batch_generator(args.num_routes, args.instructions, args.duration,
+                                                        (args.width, args.height), seed=args.seed)
+        digits = len(str(args.num_routes - 1))
+        library = RouteLibrary.from_batch([f"{args.name}_{i:0{digits}d}" for i in range(args.num_routes)], origins, steps, counts)
+        if args.library is not None:
+            library.save(args.library)
+        else:
+            library.export_text(DIR_ROUTES)
@@ -1,5 +1,6 @@
 import json
 import random
+import numpy as np
 import os
 import argparse
 
@@ -7,14 +8,19 @@ import argparse
 def json_generator(num_objects: int,
                    ratios: list = None,
                    routes: list = None,
-                   patches: list = None) -> list:
+                   patches: list = None,
+                   rng: np.random.Generator = None) -> list:
     """Generator sequences for json file.
 
+    Each object takes a different route.
+
     Args:
         patches:
         ratios(list):
         routes:
         num_objects(int)
+        rng(np.random.Generator): draw all objects at once from rng instead of one at a time
+            from the random module, for sequences with many objects
 
     Returns: list of dictionary for json file
     """
@@ -31,18 +37,27 @@ def json_generator(num_objects: int,
         ratios = [[0.01, 0.09] for _ in range(len(patches))]
     patches_indexed = [(i, p, ratio[0], ratio[1]) for i, (p, ratio) in enumerate(zip(patches, ratios))]
 
+    # routes not taken yet, in the sorted order routes are picked from
+    routes_left = sorted(set(routes))
     seq = []
-    routes_choosed = []
-    for _ in range(num_objects):
-        i, p, min_ratio, max_ratio = random.choice(patches_indexed)
-        obj_path = {
-            "patch_label": i,
-            "patch_ratio": round(random.uniform(min_ratio, max_ratio), 2),
-            "route": random.choice(list(set(routes) - set(routes_choosed))),
-            "patch": p
-        }
-        seq.append(obj_path)
-        routes_choosed.append(obj_path["route"])
+    if rng is not None:
+        picked = rng.integers(len(patches_indexed), size=num_objects)
+        bounds = np.array([[min_ratio, max_ratio] for _, _, min_ratio, max_ratio in patches_indexed]).reshape(-1, 2)[picked]
+        ratios_picked = np.round(rng.uniform(bounds[:, 0], bounds[:, 1]), 2)
+        routes_picked = rng.choice(len(routes_left), size=num_objects, replace=False)
+        for k, ratio, r in zip(picked.tolist(), ratios_picked.tolist(), routes_picked.tolist()):
+            i, p, _, _ = patches_indexed[k]
+            seq.append({"patch_label": i, "patch_ratio": ratio, "route": routes_left[r], "patch": p})
+    else:
+        for _ in range(num_objects):
+            i, p, min_ratio, max_ratio = random.choice(patches_indexed)
+            obj_path = {
+                "patch_label": i,
+                "patch_ratio": round(random.uniform(min_ratio, max_ratio), 2),
+                "route": routes_left.pop(random.randrange(len(routes_left))),
+                "patch": p
+            }
+            seq.append(obj_path)
     seq.sort(key=lambda x: x["patch_label"], reverse=False)
     return seq
 
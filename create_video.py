@@ -4,40 +4,46 @@ import json
 import cv2
 import os
 import logging
-from src.simulator import simulate, Instruction
-from src.BackgroundIterator import BackgroundIterator
+from src.simulator import simulate, Instruction, OUTPUT_FORMATS
+from src.FrameWriter import IMAGE_FORMATS
+from src.PatchCache import patch_cache
+from src.BackgroundIterator import BackgroundIterator, StaticBackgroundIterator, VideoBackgroundIterator
+from src.BackgroundCache import BackgroundCache
 from src.MovementType import MovementType
 from src.LoggingManager import configure_logging
+from src.StageProfiler import StageProfiler
+from src.RenderCache import RenderCache, render_key, file_identity, has_random_steps
+from src.RouteLibrary import load_route_library
 from typing import Tuple
 
 
-def parse_background(bg: str, frame_width:int, frame_height:int) -> BackgroundIterator:
+def parse_background(bg: str, frame_width:int, frame_height:int, cache_dir: str = None) -> BackgroundIterator:
     bg_path = check_exists_with_default_dir_noexc(bg, "backgrounds")
     if bg_path is not None and os.path.exists(bg_path):
-        cap = cv2.VideoCapture(bg_path)
-        if not cap.isOpened():
+        try:
+            if cache_dir is not None:
+                frames = BackgroundCache(cache_dir).get(bg_path, frame_width, frame_height)
+                if len(frames) == 1:
+                    return StaticBackgroundIterator(frames[0])
+                return BackgroundIterator(frames)
+            # still images are decoded as single frame videos
+            background = VideoBackgroundIterator(bg_path, frame_width, frame_height)
+            if background.single_frame:
+                return StaticBackgroundIterator(next(background))
+            return background
+        except IOError:
             logging.error("Error opening video stream")
             exit(3)
-        frames = []
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret:
-                break
-            frames.append(cv2.resize(frame, dsize=(frame_width, frame_height), interpolation=cv2.INTER_AREA))
-        if len(frames) == 0:
+        except ValueError:
             logging.error("Given background image/video has no frames. exiting.")
             exit(5)
-        return BackgroundIterator(frames)
     elif ',' in bg:
         parts = bg.split(',')
         if len(parts) >= 3:
             try:
-                r, g, b = int(parts[0]), int(parts[0]), int(parts[0])
-                r = np.ones((frame_height, frame_width)) * r
-                g = np.ones((frame_height, frame_width)) * g
-                b = np.ones((frame_height, frame_width)) * b
-                np_background = np.dstack((r, g, b))
-                return BackgroundIterator([np_background])
+                r, g, b = int(parts[0]), int(parts[1]), int(parts[2])
+                # frames are BGR as everything else in OpenCV
+                return StaticBackgroundIterator.from_color(frame_width, frame_height, (b, g, r))
             except Exception as e:
                 logging.error(
                     "Unable to convert 'R,G,B' format from {}".format(bg))
@@ -47,6 +53,14 @@ def parse_background(bg: str, frame_width:int, frame_height:int) -> BackgroundIt
         exit(2)
 
 
+def background_identity(bg: str) -> str:
+    """Identity of a background argument for render_key, the file identity of a path or the color itself."""
+    bg_path = check_exists_with_default_dir_noexc(bg, "backgrounds")
+    if bg_path is not None and os.path.exists(bg_path):
+        return file_identity(bg_path)
+    return bg
+
+
 def check_json_field(index: int, json_dict: dict, val: str, required: bool = True, default_val=None):
     if val not in json_dict:
         if required:
@@ -98,9 +112,14 @@ def txt_to_MovementType(_type: str) -> MovementType:
 
 
 def parse_instructions(istr_file: str) -> Tuple[int, int, list]:
-    allowed_types = ['const', 'acc', 'dec', 'trap']
     with open(istr_file, 'r') as file:
-        route_readed = [l.strip() for l in file.readlines()]
+        return parse_route_lines(file.readlines())
+
+
+def parse_route_lines(lines: list) -> Tuple[int, int, list]:
+    """Parse the lines of a route (see parse_instructions), e.g. recorded in a run manifest."""
+    allowed_types = ['const', 'acc', 'dec', 'trap']
+    route_readed = [l.strip() for l in lines]
     origin = route_readed[0].split(',')
     ox, oy = int(origin[0]), int(origin[1])
     last_dw, last_dh = ox, oy
@@ -110,8 +129,11 @@ def parse_instructions(istr_file: str) -> Tuple[int, int, list]:
         if len(instr) == 0:
             logging.warning("Found istructions line empty, skipping")
             continue
+        # optional target scale and angle (degrees) of the patch at the end of the step
+        transform = []
         if len(instr) >=4:
             dw, dh, _type, _time = int(instr[0]), int(instr[1]), str(instr[2]).strip(), str(instr[3])
+            transform = [float(v) for v in instr[4:6]]
         elif len(instr) < 4 and instr[0].strip() == "pause":
             dw, dh, _type, _time = last_dw, last_dh, "const", str(instr[1])
         else:
@@ -121,8 +143,11 @@ def parse_instructions(istr_file: str) -> Tuple[int, int, list]:
             logging.error(
                 "Unable to parse step type '{}', use {}".format(_type, allowed_types))
             exit(6)
+        if len(transform) > 0 and transform[0] <= 0:
+            logging.error("Unable to parse scale {}, it must be positive".format(transform[0]))
+            exit(8)
         tp = txt_to_MovementType(_type)
-        route.append([dw, dh, tp, int(float(_time))])
+        route.append([dw, dh, tp, int(float(_time))] + transform)
         last_dw, last_dh = dw, dh
     return ox, oy, route
 
@@ -131,38 +156,102 @@ def parse_json(fn) -> list:
     path = check_exists_with_default_dir(fn, "sequences")
     with open(path, 'r') as file:
         json_file = json.load(file)
+    return parse_objects(json_file)
+
+
+def parse_objects(objects: list, routes: dict = None) -> list:
+    """Build the Instruction of each object of a sequence json.
+
+    Args:
+        objects(list): object dicts of the sequence json
+        routes(dict): (origin_x, origin_y, route) by name of routes already in memory, an
+            object route found in it is neither read from a file nor from a route library
+
+    Returns:
+        instructions(list): Instruction of each object
+    """
+    routes = {} if routes is None else routes
     # Parse instructions
     instructions = []
-    for i, obj_info in enumerate(json_file):
+    for i, obj_info in enumerate(objects):
+        obj_info = dict(obj_info)
         check_json_field(i, obj_info, "patch_label", required=True)
         check_json_field(i, obj_info, "patch_ratio",
                          required=False, default_val=1)
         check_json_field(i, obj_info, "route", required=True)
-        route_path = check_exists_with_default_dir(obj_info["route"], "routes")
+        # with a route_library, route is the name of a route compiled in it
+        check_json_field(i, obj_info, "route_library", required=False, default_val=None)
+        if obj_info["route_library"] is not None:
+            library = load_route_library(check_exists_with_default_dir(obj_info["route_library"], "routes"))
+            if obj_info["route"] not in library:
+                logging.error("Route {} not found in {}".format(obj_info["route"], obj_info["route_library"]))
+                exit(9)
+        elif obj_info["route"] not in routes:
+            route_path = check_exists_with_default_dir(obj_info["route"], "routes")
         check_json_field(i, obj_info, "patch", required=True)
         patch_path = check_exists_with_default_dir(
             obj_info["patch"], "patches")
 
         label = obj_info["patch_label"]
-        if patch_path.endswith(".npy"):
-            p = np.load(patch_path)
+        patch, mask = patch_cache.get(patch_path, obj_info["patch_ratio"])
+        if obj_info["route_library"] is not None:
+            ox, oy, route = library.get(obj_info["route"])
+        elif obj_info["route"] in routes:
+            ox, oy, route = routes[obj_info["route"]]
         else:
-            p = cv2.imread(patch_path, cv2.IMREAD_UNCHANGED)
-            # if there is an alpha channel, set to zeros and change to 3D
-            if p.shape[2] == 4:
-                p[np.where(p[:, :, 3] == 0)] = [0, 0, 0, 0]
-                p = p[:, :, :3]
-        ratio = obj_info["patch_ratio"]
-        patch = cv2.resize(p, dsize=(
-            int(p.shape[1] * ratio), int(p.shape[0] * ratio)), interpolation=cv2.INTER_AREA)
-        ox, oy, route = parse_instructions(route_path)
+            ox, oy, route = parse_instructions(route_path)
 
         inst = Instruction(label=label, patch=patch,
-                           origin_x=ox, origin_y=oy, route=route)
+                           origin_x=ox, origin_y=oy, route=route, mask=mask)
         instructions.append(inst)
     return instructions
 
 
+def add_writer_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("-OF", "--output-format", type=str, default="files", choices=OUTPUT_FORMATS, help="Write a pair of files per frame, pack frames into tar shards, or write only the video (seqN/video.mp4 unless --video is given) and annotations.npz")
+    parser.add_argument("-FS", "--frames-per-shard", type=int, default=1000, help="Number of frames in each tar shard with --output-format=shards")
+    parser.add_argument("-IF", "--image-format", type=str, default="png", choices=IMAGE_FORMATS, help="Format of the frame images")
+    parser.add_argument("-PC", "--png-compression", type=int, default=None, help="Png compression level 0-9 (e.g. 1 for fastest writes)")
+    parser.add_argument("-Q", "--quality", type=int, default=None, help="Jpg/webp quality 0-100 (e.g. 95)")
+    parser.add_argument("-WT", "--writer-threads", type=int, default=4, help="Number of threads encoding and writing frames")
+    parser.add_argument("-MV", "--min-visible", type=float, default=None, help="Occlusion aware annotations: drop objects with less than this fraction of their pixels visible, hidden ones are always dropped (e.g. 0.2)")
+    parser.add_argument("-TB", "--tight-boxes", action="store_true", help="Occlusion aware annotations: shrink boxes to the visible pixels of the objects")
+
+
+def writer_options_from_args(args: argparse.Namespace) -> dict:
+    options = dict(output_format=args.output_format, image_format=args.image_format,
+                   png_compression=args.png_compression, quality=args.quality, num_threads=args.writer_threads)
+    if args.output_format == "shards":
+        options["frames_per_shard"] = args.frames_per_shard
+    # runs resumed from older manifests do not have these arguments
+    if getattr(args, "min_visible", None) is not None:
+        options["min_visible"] = args.min_visible
+    if getattr(args, "tight_boxes", False):
+        options["tight_boxes"] = True
+    return options
+
+
+def add_profile_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("-PM", "--profile-memory", action="store_true", help="Also trace the peak memory of each stage in profile.json (slower)")
+    parser.add_argument("-CP", "--cprofile", action="store_true", help="Also dump cProfile stats of each sequence to profile.prof")
+
+
+def profile_options_from_args(args: argparse.Namespace) -> dict:
+    return dict(trace_memory=args.profile_memory, cprofile=args.cprofile)
+
+
+def add_render_cache_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("-RC", "--render-cache", type=str, default=None, help="Directory caching rendered sequences, copied instead of rendered again when sequence, routes, patches, background, size, fps, seed and output options did not change. Sequences with trap movements are only cached with a seed, their speeds are random otherwise (e.g. '.render_cache')")
+    parser.add_argument("-RCS", "--render-cache-size", type=float, default=None, help="Max size of the render cache in GB, least recently used sequences are evicted (e.g. 50)")
+
+
+def render_cache_from_args(args: argparse.Namespace) -> RenderCache:
+    if args.render_cache is None:
+        return None
+    max_bytes = None if args.render_cache_size is None else int(args.render_cache_size * 1024 ** 3)
+    return RenderCache(args.render_cache, max_bytes)
+
+
 def test_save_patches():
     """
     Create and save basic patches.
@@ -187,14 +276,33 @@ if __name__ == '__main__':
     parser.add_argument("-O", "--output-dir", type=str, default="datasets_out", help="Output directory (e.g. 'datasets_out'")
     parser.add_argument("-V", "--video", type=str, default=None, help="Output video file if wanted (e.g. 'out.mp4'")
     parser.add_argument("-F", "--fps", type=int, default=30, help="Output sequence fps (e.g. 30)")
+    parser.add_argument("-BC", "--bg-cache", type=str, default=None, help="Directory to cache resized background videos in (e.g. '.bg_cache')")
+    parser.add_argument("-SD", "--seed", type=int, default=-1, help="Seed of the random speeds of trap movements")
+    add_writer_arguments(parser)
+    add_profile_arguments(parser)
+    add_render_cache_arguments(parser)
     args = parser.parse_args()
+    if args.seed >= 0: np.random.seed(args.seed)
 
     frame_width = args.width
     frame_height = args.height
-    bg_iterator = parse_background(args.background, frame_width, frame_height)
-    instructions = parse_json(args.input_json)
+    profiler = StageProfiler(**profile_options_from_args(args))
+    with profiler.stage("background"):
+        bg_iterator = parse_background(args.background, frame_width, frame_height, args.bg_cache)
+    with profiler.stage("assets"):
+        instructions = parse_json(args.input_json)
     fps = args.fps
     video_out = args.video
     annotations_dir = args.output_dir
 
-    simulate(frame_width, frame_height, bg_iterator, instructions, annotations_dir, video_out, fps)
+    writer_options = writer_options_from_args(args)
+    render_cache = render_cache_from_args(args)
+    cache_key = None
+    if render_cache is not None and args.seed < 0 and has_random_steps(instructions):
+        logging.info("Not using the render cache, trap movements are random without --seed")
+    elif render_cache is not None:
+        cache_key = render_key(instructions, background_identity(args.background), frame_width, frame_height, fps,
+                               args.seed if args.seed >= 0 else None, writer_options)
+
+    simulate(frame_width, frame_height, bg_iterator, instructions, annotations_dir, video_out, fps,
+             writer_options=writer_options, profiler=profiler, render_cache=render_cache, cache_key=cache_key)
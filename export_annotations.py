@@ -0,0 +1,46 @@
+import argparse
+import os
+import re
+import logging
+from src.AnnotationStore import AnnotationStore, ANNOTATIONS_FILE, export_coco, export_mot
+from src.LoggingManager import configure_logging
+
+
+def find_sequences(dataset_dir: str) -> list:
+    """List (name, annotations path) of the seqN directories of a dataset, or of dataset_dir itself if it is one."""
+    if os.path.exists(os.path.join(dataset_dir, ANNOTATIONS_FILE)):
+        return [(os.path.basename(os.path.normpath(dataset_dir)), os.path.join(dataset_dir, ANNOTATIONS_FILE))]
+    sequences = []
+    for d in os.listdir(dataset_dir):
+        path = os.path.join(dataset_dir, d, ANNOTATIONS_FILE)
+        if re.fullmatch(r"seq\d+", d) and os.path.exists(path):
+            sequences.append((d, path))
+    sequences.sort(key=lambda s: int(s[0][3:]))
+    return sequences
+
+
+if __name__ == '__main__':
+    configure_logging(log_lvl=logging.INFO, log_console=True)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-D", "--dataset-dir", type=str, required=True, help="Dataset directory with seqN directories, or a single seqN directory")
+    parser.add_argument("-F", "--format", type=str, default="coco", choices=["coco", "mot"], help="Export format")
+    parser.add_argument("-O", "--output", type=str, default=None, help="Output json for coco (default <dataset-dir>/coco.json). mot files are written in <seqN>/gt/gt.txt")
+    parser.add_argument("-IF", "--image-format", type=str, default="png", help="Extension of the frame images referenced by coco")
+    args = parser.parse_args()
+
+    sequences = find_sequences(args.dataset_dir)
+    if len(sequences) == 0:
+        logging.error("No {} found in {}".format(ANNOTATIONS_FILE, args.dataset_dir))
+        exit(1)
+    if args.format == "coco":
+        output = args.output if args.output is not None else os.path.join(args.dataset_dir, "coco.json")
+        with open(output, 'w') as file:
+            export_coco([(name, AnnotationStore.load(path)) for name, path in sequences], file, args.image_format)
+        logging.info("Written {}".format(output))
+    else:
+        for name, path in sequences:
+            gt_dir = os.path.join(os.path.dirname(path), "gt")
+            os.makedirs(gt_dir, exist_ok=True)
+            with open(os.path.join(gt_dir, "gt.txt"), 'w') as file:
+                export_mot(AnnotationStore.load(path), file)
+        logging.info("Written mot gt of {} sequences".format(len(sequences)))
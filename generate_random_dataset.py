@@ -7,8 +7,18 @@ import logging
 from src.LoggingManager import configure_logging
 from create_random_route import routes_generator
 from create_random_sequence import json_generator
-from create_video import simulate, parse_background, parse_json
+from create_video import simulate, parse_background, parse_json, parse_objects, parse_route_lines
+from create_video import add_writer_arguments, writer_options_from_args
+from create_video import add_profile_arguments, profile_options_from_args
+from create_video import add_render_cache_arguments, render_cache_from_args, background_identity
+from src.RenderCache import render_key
+from src.StageProfiler import StageProfiler
+from src.RunManifest import RunManifest, DONE
+from src.RouteLibrary import RouteLibrary, ROUTE_LIBRARY_EXT, format_route
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tqdm import tqdm
 import random
+import shutil
 
 
 def log_and_exit(message: str, exit_code: int):
@@ -39,8 +49,9 @@ def parse_list_filenames(objects_args: str, base_dir: str):
 
 
 def create_random_routes(min_routes:int, max_routes:int, min_instructions:int, max_instructions:int, duration:int, allowed_commands: list = None):
+    """Generate random routes in memory, (origin_x, origin_y, route) by name."""
     commands = ["const", "acc", "trap", "pause"] if allowed_commands is None or len(allowed_commands) == 0 else allowed_commands
-    all_routes = []
+    all_routes = {}
     routes_num = random.randint(min_routes, max_routes)
     for i in range(routes_num):
         logging.debug(f"Creating random route {i}")
@@ -52,24 +63,31 @@ def create_random_routes(min_routes:int, max_routes:int, min_instructions:int, m
             min_pause=int((float(duration)/instr)/1.2),
             commands=commands
         )
-        route_fn = f"routes/route_{name}_{i}.txt"
-        with open(route_fn, 'w') as outfile:
-            outfile.writelines(route_new)
-        all_routes.append(route_fn)
+        all_routes[f"route_{name}_{i}"] = route_new
     return all_routes
 
 
-def build_next_dataset_dir(out_dir:str):
-    # create dataset_name_0, if exists dataset_name_1, ....
+def build_next_dataset_dir(out_dir:str, prefix: str):
+    # create prefix_0, if exists prefix_1, ...., claimed with an exclusive makedirs so that
+    # runs sharing out_dir never get the same one
+    os.makedirs(out_dir, exist_ok=True)
     i = 0
-    dataset_dir = os.path.join(out_dir, f"dts_{name}_{i}")
-    while os.path.exists(dataset_dir):
-        i += 1
-        dataset_dir = os.path.join(out_dir, f"dts_{name}_{i}")
-    return dataset_dir
+    while True:
+        dataset_dir = os.path.join(out_dir, f"{prefix}_{i}")
+        try:
+            os.makedirs(dataset_dir)
+            return dataset_dir
+        except FileExistsError:
+            i += 1
+
+
+def shard_range(num_sequences: int, shard_index: int, num_shards: int) -> range:
+    """Indices of the sequences of shard #shard_index, contiguous slices of about the same size covering all sequences."""
+    return range(num_sequences * shard_index // num_shards, num_sequences * (shard_index + 1) // num_shards)
 
 
 def generate_random_sequences(num_sequences: int, min_objects: int, max_objects: int, name:str, ratios, all_routes, objects):
+    """Generate random sequences in memory, the object list of each sequence json."""
     all_sequences = []
     for i in range(num_sequences):
         num_objs = random.randint(min_objects, max_objects)
@@ -79,28 +97,174 @@ def generate_random_sequences(num_sequences: int, min_objects: int, max_objects:
             routes=all_routes,
             patches=objects
         )
-        seq_fn = f"sequences/seq_{name}_{i}.json"
-        with open(seq_fn, 'w') as outfile:
-            json.dump(seq_new, outfile, indent=2)
-        all_sequences.append(seq_fn)
+        all_sequences.append(seq_new)
     return all_sequences
 
 
-def generate_videos(dta_dir, sequences, w, h, bgs, fps, also_save_video):
-    for i, seq in enumerate(sequences):
-        video_path = os.path.join(dta_dir, f"vid{i}.mp4") if also_save_video else None
-        logging.info(f"\nCreating new sequence #{i}")
-        bg_path = random.choice(bgs)
-        bachground_iterator = parse_background(bg_path, w, h)
-        instructions = parse_json(seq)
-        simulate(
-            width=w,
-            height=h,
-            background=bachground_iterator,
-            instructions=instructions,
-            dataset_dir=dta_dir,
-            video_out=video_path,
-            fps=fps)
+def save_assets(dta_dir, sequences, routes, first_index=0):
+    """Write the generated routes as a route library and the sequences as json files in dta_dir.
+
+    Sequence #i is written as dta_dir/sequences/seq_{first_index + i}.json, referencing its
+    generated routes in dta_dir/routes.npz, so it can be rendered again with create_video.py.
+    """
+    library_path = os.path.join(dta_dir, "routes" + ROUTE_LIBRARY_EXT)
+    if len(routes) > 0:
+        RouteLibrary.from_routes(routes).save(library_path)
+    os.makedirs(os.path.join(dta_dir, "sequences"), exist_ok=True)
+    for i, seq in enumerate(sequences, first_index):
+        seq = [dict(obj, route_library=library_path) if obj["route"] in routes else obj for obj in seq]
+        with open(os.path.join(dta_dir, "sequences", f"seq_{i}.json"), 'w') as outfile:
+            json.dump(seq, outfile, indent=2)
+
+
+def sequence_seed(base_seed: int, index: int) -> int:
+    """Seed of sequence #index, independent of the order sequences are generated in."""
+    return int(np.random.SeedSequence([base_seed, index]).generate_state(1)[0])
+
+
+def generate_video(index, seq, dta_dir, w, h, bgs, fps, also_save_video, bg_cache_dir=None, seed=None, writer_options=None,
+                   profile_options=None, render_cache=None, routes=None):
+    """Render sequence #index into dta_dir/seq{index} (and dta_dir/vid{index}.mp4).
+
+    seq is a sequence json file, or the object list of a sequence whose routes are
+    either files or in routes, (origin_x, origin_y, route) by name.
+    """
+    if seed is not None:
+        random.seed(seed)
+        np.random.seed(seed)
+    video_path = os.path.join(dta_dir, f"vid{index}.mp4") if also_save_video else None
+    logging.info(f"Creating new sequence #{index}")
+    bg_path = random.choice(bgs)
+    profiler = StageProfiler(**(profile_options or {}))
+    with profiler.stage("background"):
+        bachground_iterator = parse_background(bg_path, w, h, bg_cache_dir)
+    with profiler.stage("assets"):
+        instructions = parse_json(seq) if isinstance(seq, str) else parse_objects(seq, routes)
+    cache_key = None
+    if render_cache is not None:
+        cache_key = render_key(instructions, background_identity(bg_path), w, h, fps, seed, writer_options)
+    simulate(
+        width=w,
+        height=h,
+        background=bachground_iterator,
+        instructions=instructions,
+        dataset_dir=dta_dir,
+        video_out=video_path,
+        fps=fps,
+        sequence_index=index,
+        progress=False,
+        writer_options=writer_options,
+        profiler=profiler,
+        render_cache=render_cache,
+        cache_key=cache_key)
+    bachground_iterator.close()
+    return index
+
+
+def _init_worker():
+    # one OpenCV thread per process, parallelism comes from the pool
+    cv2.setNumThreads(1)
+
+
+def clear_partial_sequence(dta_dir, index):
+    """Remove what an interrupted run left of sequence #index."""
+    seq_dir = os.path.join(dta_dir, f"seq{index}")
+    if os.path.exists(seq_dir):
+        logging.info(f"Removing partial sequence #{index}")
+        shutil.rmtree(seq_dir)
+
+
+def generate_videos(dta_dir, sequences, w, h, bgs, fps, also_save_video, bg_cache_dir=None, workers=1, seed=None, writer_options=None,
+                    profile_options=None, manifest=None, render_cache=None, routes=None, first_index=0):
+    """Render all sequences, or only the pending ones of manifest which records each completed sequence.
+
+    Sequences are json files or object lists, see generate_video. Sequence #i is rendered
+    as sequence #first_index + i of the run, with the seed it has in the whole run.
+    """
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    routes = {} if routes is None else routes
+    indices = range(len(sequences)) if manifest is None else manifest.pending()
+    tasks = []
+    for i in indices:
+        index = first_index + i
+        if manifest is not None:
+            clear_partial_sequence(dta_dir, index)
+        # only the routes of the sequence are sent to the worker
+        seq_routes = {} if isinstance(sequences[i], str) else {obj["route"]: routes[obj["route"]] for obj in sequences[i]
+                                                                 if obj["route"] in routes}
+        tasks.append((index, sequences[i], dta_dir, w, h, bgs, fps, also_save_video, bg_cache_dir, sequence_seed(seed, index),
+                      writer_options, profile_options, render_cache, seq_routes))
+    if workers <= 1:
+        for task in tqdm(tasks, desc="Sequences"):
+            index = generate_video(*task)
+            if manifest is not None: manifest.mark_done(index - first_index)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        futures = [pool.submit(generate_video, *task) for task in tasks]
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Sequences"):
+            index = future.result()
+            if manifest is not None: manifest.mark_done(index - first_index)
+
+
+def merge_shards(shard_dirs: list, dataset_dir: str) -> RunManifest:
+    """Move the sequences of the completed shards of a run into dataset_dir, as a single run.
+
+    Shards render their sequences with the numbering of the whole run (see shard_range),
+    so the merged dataset has seq0, seq1, ... as if it was rendered on a single machine.
+    Only their manifests are left in the shard directories.
+
+    Args:
+        shard_dirs(list): dataset directories of all the shards of the run, in any order
+        dataset_dir(str): existing directory of the merged dataset
+
+    Returns:
+        manifest(RunManifest): saved manifest of the merged run
+
+    Raises:
+        ValueError: if the shards are not all the completed shards of one run
+    """
+    shards = sorted((RunManifest.load(d) for d in shard_dirs), key=lambda m: m.first_index)
+    first = shards[0]
+
+    def run_args(m):
+        # the number of workers may differ between machines
+        return {k: v for k, v in m.args.items() if k not in ("shard_index", "workers")}
+
+    num_shards = first.args.get("num_shards", 1)
+    if sorted(m.args.get("shard_index", 0) for m in shards) != list(range(num_shards)):
+        raise ValueError(f"Give each of the {num_shards} shards of the run once")
+    next_index = 0
+    for m in shards:
+        if m.seed != first.seed or run_args(m) != run_args(first):
+            raise ValueError(f"{m.dataset_dir} is not a shard of the same run as {first.dataset_dir}")
+        # the same arguments give other backgrounds and labels on a machine with other files
+        if m.backgrounds != first.backgrounds or m.objects != first.objects:
+            raise ValueError(f"{m.dataset_dir} has other backgrounds or patches than {first.dataset_dir}")
+        if m.first_index != next_index:
+            raise ValueError(f"Sequences from #{next_index} are missing before {m.dataset_dir}")
+        if len(m.pending()) > 0:
+            raise ValueError(f"{len(m.pending())} sequences of {m.dataset_dir} are not completed, see --resume")
+        missing = [i for i in range(m.first_index, m.first_index + len(m.sequences))
+                   if not os.path.isdir(os.path.join(m.dataset_dir, f"seq{i}"))]
+        if len(missing) > 0:
+            raise ValueError(f"Sequences {missing} are missing in {m.dataset_dir}")
+        next_index += len(m.sequences)
+
+    sequences, generated_routes = [], {}
+    for m in shards:
+        for i in range(m.first_index, m.first_index + len(m.sequences)):
+            for fn in [f"seq{i}", f"vid{i}.mp4"]:
+                if os.path.exists(os.path.join(m.dataset_dir, fn)):
+                    shutil.move(os.path.join(m.dataset_dir, fn), os.path.join(dataset_dir, fn))
+        sequences += m.sequences
+        generated_routes.update(m.generated_routes)
+    manifest = RunManifest(dataset_dir, first.seed, dict(first.args, shard_index=0, num_shards=1), first.routes, sequences,
+                           first.backgrounds, [DONE] * len(sequences), generated_routes, objects=first.objects)
+    manifest.save()
+    if os.path.isdir(os.path.join(first.dataset_dir, "sequences")):
+        save_assets(dataset_dir, sequences, {n: parse_route_lines(lines.splitlines()) for n, lines in generated_routes.items()})
+    return manifest
 
 
 if __name__ == '__main__':
@@ -123,11 +287,46 @@ if __name__ == '__main__':
     parser.add_argument("-R", "--routes", type=str, default='', help='A subset of routes in routes dir instead of all routes (e.g. "pentagon.txt,boxed.txt")')
     parser.add_argument("-AC", "--allowed-commands", type=str, default='const,acc,trap,pause', help='A list of available commands to random create routes in ["const", "acc", "trap", "pause"]')
     parser.add_argument("-SV", "--save-video", action="store_true",  help="If needed, also saves *.mp4 video file in output")
-    parser.add_argument("-OC", "--only-create", action="store_true",  help="Just create the random routes/sequences without creating the dataset")
+    parser.add_argument("-OC", "--only-create", action="store_true",  help="Just create the random routes/sequences in a new dataset directory (see --save-assets) without rendering it, which --resume does")
+    parser.add_argument("-SA", "--save-assets", action="store_true",  help="Also write the random routes (routes.npz route library) and sequences (sequences/seq_N.json) in the dataset directory")
     parser.add_argument("-F", "--fps", type=int, default=30, help="Output sequence fps (e.g. 30)")
     parser.add_argument("-SD", "--seed", type=int, default=-1, help="Use a seed for each random")
+    parser.add_argument("-WK", "--workers", type=int, default=1, help="Number of processes rendering sequences in parallel")
+    parser.add_argument("-BC", "--bg-cache", type=str, default=None, help="Directory to cache resized background videos in, shared by runs (e.g. '.bg_cache')")
+    parser.add_argument("-RS", "--resume", type=str, default=None, help="Dataset directory of an interrupted run to complete, with the arguments recorded in its manifest.json (e.g. 'datasets_out/dts_XYZ_0')")
+    parser.add_argument("-SI", "--shard-index", type=int, default=0, help="Render only shard #i of the --num-shards shards of the sequences")
+    parser.add_argument("-NS", "--num-shards", type=int, default=1, help="Split the sequences of the run in this many shards, rendered by different machines with the same arguments and --seed")
+    parser.add_argument("-MG", "--merge", type=str, default=None, help="Comma separated dataset directories of all the completed shards of a run to merge in a new dataset directory (e.g. 'datasets_out/dts_XYZ_shard0of2_0,datasets_out/dts_XYZ_shard1of2_0')")
+    add_writer_arguments(parser)
+    add_profile_arguments(parser)
+    add_render_cache_arguments(parser)
     args = parser.parse_args()
 
+    __location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
+    out_dir = os.path.join(__location__, "datasets_out")
+    if args.merge is not None:
+        dataset_dir = build_next_dataset_dir(out_dir, f"dts_{args.name}")
+        try:
+            manifest = merge_shards(args.merge.split(','), dataset_dir)
+        except (OSError, ValueError, KeyError) as e:
+            if len(os.listdir(dataset_dir)) == 0: os.rmdir(dataset_dir)
+            log_and_exit(f"Unable to merge the shards: {e}", 11)
+        logging.info(f"Merged {len(manifest.sequences)} sequences in {dataset_dir}")
+        exit(0)
+
+    manifest = None
+    if args.resume is not None:
+        try:
+            manifest = RunManifest.load(args.resume)
+        except (OSError, ValueError, KeyError):
+            log_and_exit(f"Unable to read the run manifest of {args.resume}", 11)
+        if len(manifest.missing_files()) > 0:
+            log_and_exit(f"Files of the run are missing: {manifest.missing_files()}", 10)
+        # the number of workers is the only setting that does not change the output
+        workers = args.workers
+        args = argparse.Namespace(**manifest.args)
+        args.workers = workers
+
     logging.info("parsing arguments")
     if args.seed >= 0: random.seed(args.seed)
     name = args.name
@@ -149,10 +348,11 @@ if __name__ == '__main__':
     if duration <= 100: log_and_exit("--duration must be more than 100 ms", 5)
     frame_width = args.width
     frame_height = args.height
-    backgrounds = [os.path.join("backgrounds", pa) for pa in os.listdir("backgrounds")]
+    # sorted, the patch label is the index in objects and the listing order differs between machines
+    backgrounds = [os.path.join("backgrounds", pa) for pa in sorted(os.listdir("backgrounds"))]
     if args.backgrounds != '':
         backgrounds = parse_list_filenames(args.backgrounds, "backgrounds")
-    objects = [os.path.join("patches", pa) for pa in os.listdir("patches")]
+    objects = [os.path.join("patches", pa) for pa in sorted(os.listdir("patches"))]
     if args.objects != '':
         objects = parse_list_filenames(args.objects, "patches")
     if len(ratios) != 0 and len(ratios) != len(objects):
@@ -160,26 +360,53 @@ if __name__ == '__main__':
     save_video = args.save_video
     framerate = args.fps
     only_create = args.only_create
+    if args.workers < 1: log_and_exit("--workers must be positive", 1)
+    # manifests of runs older than sharding have none
+    shard_index = getattr(args, "shard_index", 0)
+    num_shards = getattr(args, "num_shards", 1)
+    if num_shards < 1 or not 0 <= shard_index < num_shards: log_and_exit("--shard-index must be in [0, --num-shards)", 1)
+    if num_shards > number_videos: log_and_exit("--num-shards can't be more than --number-videos", 1)
+    # shards draw the same routes and sequences only from the same seed
+    if num_shards > 1 and args.seed < 0: log_and_exit("--num-shards needs a --seed", 1)
 
-    all_routes = []
-    if args.routes != '':
-        all_routes = parse_list_filenames(args.routes, "routes")
-    else:
-        all_routes = create_random_routes(min_routes_files, max_routes_files, min_instructions_per_route, max_instructions_per_route, duration, allowed_commands)
+    if manifest is None:
+        # random routes and sequences stay in memory, only the manifest records them
+        route_files = []
+        if args.routes != '':
+            route_files = parse_list_filenames(args.routes, "routes")
+            routes = {}
+        else:
+            routes = create_random_routes(min_routes_files, max_routes_files, min_instructions_per_route, max_instructions_per_route, duration, allowed_commands)
 
-    logging.info("Creating random sequences...")
-    all_sequences = generate_random_sequences(number_videos, min_objects, max_objects, name, ratios, all_routes, objects)
+        logging.info("Creating random sequences...")
+        # every shard draws the sequences before its own so that it gets the same ones as a single run
+        shard = shard_range(number_videos, shard_index, num_shards)
+        all_sequences = generate_random_sequences(shard.stop, min_objects, max_objects, name, ratios, route_files + sorted(routes), objects)
+        all_sequences = all_sequences[shard.start:]
+        prefix = f"dts_{name}"
+        if num_shards > 1:
+            used = {obj["route"] for seq in all_sequences for obj in seq}
+            routes = {n: r for n, r in routes.items() if n in used}
+            prefix = f"dts_{name}_shard{shard_index}of{num_shards}"
 
-    if only_create:
-        logging.info("Random routes/sequences created.")
-        exit(0)
+        dataset_dir = build_next_dataset_dir(out_dir, prefix)
+        seed = args.seed if args.seed >= 0 else random.randrange(2 ** 32)
+        manifest = RunManifest(dataset_dir, seed, vars(args), route_files, all_sequences, backgrounds,
+                               generated_routes={n: "".join(format_route(*r)) for n, r in routes.items()}, first_index=shard.start,
+                               objects=objects)
+        manifest.save()
+        if args.save_assets or only_create:
+            save_assets(dataset_dir, all_sequences, routes, shard.start)
+        if only_create:
+            logging.info(f"Random routes/sequences created in {dataset_dir}, render them with --resume={dataset_dir}")
+            exit(0)
+    else:
+        routes = {n: parse_route_lines(lines.splitlines()) for n, lines in manifest.generated_routes.items()}
+        logging.info(f"Resuming {len(manifest.pending())} of {len(manifest.sequences)} sequences")
 
     logging.info("Building datasets...")
-    __location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
-    out_dir = os.path.join(__location__, "datasets_out")
-    if not os.path.exists(out_dir):
-        os.makedirs(out_dir)
-    dataset_dir = build_next_dataset_dir(out_dir)
-    generate_videos(dataset_dir, all_sequences, frame_width, frame_height, backgrounds, framerate, save_video)
+    generate_videos(manifest.dataset_dir, manifest.sequences, frame_width, frame_height, manifest.backgrounds, framerate, save_video,
+                    args.bg_cache, args.workers, manifest.seed, writer_options_from_args(args), profile_options_from_args(args),
+                    manifest, render_cache_from_args(args), routes, manifest.first_index)
 
     logging.info("Ended dataset creation")
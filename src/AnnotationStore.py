@@ -0,0 +1,173 @@
+import os
+import json
+import numpy as np
+
+# one row per object per frame, box corners are inclusive pixel coords
+ANNOTATION_DTYPE = np.dtype([
+    ('frame', np.int32),
+    ('object_id', np.int32),
+    ('label', np.int32),
+    ('x1', np.int32),
+    ('y1', np.int32),
+    ('x2', np.int32),
+    ('y2', np.int32),
+    ('visible', np.float32),
+])
+
+ANNOTATIONS_FILE = "annotations.npz"
+
+
+class AnnotationStore:
+    """Columnar store of all the boxes of a sequence.
+
+    Rows are ANNOTATION_DTYPE records sorted by (frame, object_id). Objects out of
+    the frame keep a row with box -1 and visible 0. visible is 1 for the other
+    objects, or their visible fraction once updated by a LabelBuffer.
+
+    Attributes:
+        boxes(ndarray): ANNOTATION_DTYPE rows
+        width(int): frame width
+        height(int): frame height
+    """
+
+    def __init__(self, boxes: np.ndarray, width: int, height: int) -> None:
+        order = np.lexsort((boxes['object_id'], boxes['frame']))
+        self.boxes = boxes[order]
+        self.width = width
+        self.height = height
+        self.num_frames = int(self.boxes['frame'][-1]) + 1 if len(self.boxes) > 0 else 0
+        self._offsets = np.searchsorted(self.boxes['frame'], np.arange(self.num_frames + 1))
+
+    def __len__(self) -> int:
+        return len(self.boxes)
+
+    @classmethod
+    def from_tracks(cls, tracks: list, width: int, height: int) -> 'AnnotationStore':
+        """Build the store from the evolver tracks of the objects.
+
+        Args:
+            tracks(list): (label, track) of each object, object_id is the position in the list
+            width(int): frame width
+            height(int): frame height
+        """
+        parts = []
+        for object_id, (label, track) in enumerate(tracks):
+            part = np.zeros(len(track), dtype=ANNOTATION_DTYPE)
+            part['frame'] = np.arange(len(track))
+            part['object_id'] = object_id
+            part['label'] = label
+            bbox = track['bbox']
+            part['y1'], part['x1'], part['y2'], part['x2'] = bbox[:, 0], bbox[:, 1], bbox[:, 2], bbox[:, 3]
+            part['visible'] = bbox[:, 0] >= 0
+            parts.append(part)
+        boxes = np.concatenate(parts) if len(parts) > 0 else np.zeros(0, dtype=ANNOTATION_DTYPE)
+        return cls(boxes, width, height)
+
+    def frame_slice(self, frame: int) -> slice:
+        """Rows of frame #frame."""
+        if frame >= self.num_frames:
+            return slice(0, 0)
+        return slice(self._offsets[frame], self._offsets[frame + 1])
+
+    def to_yolo(self, boxes: np.ndarray = None) -> np.ndarray:
+        """Normalize boxes to yolo [cx, cy, w, h] relative to frame size.
+
+        Args:
+            boxes(ndarray): rows to convert, all rows if None
+
+        Returns:
+            yolo(ndarray): (n, 4) float boxes, as create_annotation of each box
+        """
+        boxes = self.boxes if boxes is None else boxes
+        x1, y1 = boxes['x1'].astype(np.float64), boxes['y1'].astype(np.float64)
+        x2, y2 = boxes['x2'].astype(np.float64), boxes['y2'].astype(np.float64)
+        return np.stack([((x2 + x1) / 2.0) / self.width, ((y2 + y1) / 2.0) / self.height,
+                         (x2 - x1) / self.width, (y2 - y1) / self.height], axis=1)
+
+    def yolo_lines(self, frame: int, visible_only: bool = False) -> str:
+        """Yolo annotation file content of frame #frame, one "label cx cy w h" line per object.
+
+        Objects out of the frame have a line too, unless visible_only is set.
+        """
+        boxes = self.boxes[self.frame_slice(frame)]
+        if visible_only:
+            boxes = boxes[boxes['visible'] > 0]
+        yolo = self.to_yolo(boxes).tolist()
+        return "".join(["{} {} {} {} {}\n".format(label, *ann) for label, ann in zip(boxes['label'].tolist(), yolo)])
+
+    def save(self, path: str) -> None:
+        with open(path + ".tmp", 'wb') as file:
+            np.savez(file, boxes=self.boxes, size=np.array([self.width, self.height]))
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path: str) -> 'AnnotationStore':
+        with np.load(path) as data:
+            width, height = data['size'].tolist()
+            return cls(data['boxes'], width, height)
+
+
+def export_coco(stores: list, out_file, image_format: str = "png", chunk_size: int = 10000) -> None:
+    """Stream the visible boxes of many sequences as a COCO json.
+
+    Args:
+        stores(list): (sequence name, AnnotationStore), images are "<name>/%010d.<format>"
+        out_file: writable text file
+        image_format(str): extension of the frame images
+        chunk_size(int): rows converted at a time
+    """
+    out_file.write('{"images": [')
+    first = True
+    image_ids = []
+    next_image_id = 0
+    for name, store in stores:
+        image_ids.append(next_image_id)
+        next_image_id += store.num_frames
+        for frame in range(store.num_frames):
+            image = {"id": image_ids[-1] + frame, "file_name": "{}/{:010d}.{}".format(name, frame, image_format),
+                     "width": store.width, "height": store.height}
+            out_file.write(("" if first else ", ") + json.dumps(image))
+            first = False
+
+    out_file.write('], "annotations": [')
+    first = True
+    ann_id = 0
+    labels = set()
+    for (name, store), image_id in zip(stores, image_ids):
+        for start in range(0, len(store), chunk_size):
+            boxes = store.boxes[start:start + chunk_size]
+            boxes = boxes[boxes['visible'] > 0]
+            w = (boxes['x2'] - boxes['x1'] + 1).tolist()
+            h = (boxes['y2'] - boxes['y1'] + 1).tolist()
+            for frame, label, x, y, bw, bh in zip((boxes['frame'] + image_id).tolist(), boxes['label'].tolist(),
+                                                  boxes['x1'].tolist(), boxes['y1'].tolist(), w, h):
+                ann = {"id": ann_id, "image_id": frame, "category_id": label, "bbox": [x, y, bw, bh],
+                       "area": bw * bh, "iscrowd": 0}
+                out_file.write(("" if first else ", ") + json.dumps(ann))
+                first = False
+                ann_id += 1
+            labels.update(np.unique(boxes['label']).tolist())
+
+    categories = [{"id": label, "name": str(label)} for label in sorted(labels)]
+    out_file.write('], "categories": ' + json.dumps(categories) + '}')
+
+
+def export_mot(store: AnnotationStore, out_file, chunk_size: int = 10000) -> None:
+    """Stream the visible boxes of a sequence in MOT challenge gt format.
+
+    Lines are "frame, id, left, top, width, height, 1, label, visibility" with
+    1-based frame, id and pixel coords.
+
+    Args:
+        store(AnnotationStore)
+        out_file: writable text file
+        chunk_size(int): rows converted at a time
+    """
+    for start in range(0, len(store), chunk_size):
+        boxes = store.boxes[start:start + chunk_size]
+        boxes = boxes[boxes['visible'] > 0]
+        rows = np.stack([boxes['frame'] + 1, boxes['object_id'] + 1, boxes['x1'] + 1, boxes['y1'] + 1,
+                         boxes['x2'] - boxes['x1'] + 1, boxes['y2'] - boxes['y1'] + 1,
+                         np.ones(len(boxes), dtype=np.int32), boxes['label']], axis=1)
+        for row, visible in zip(rows.tolist(), boxes['visible'].tolist()):
+            out_file.write("{},{},{},{},{},{},{},{},{:g}\n".format(*row, visible))
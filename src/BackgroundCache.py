@@ -0,0 +1,84 @@
+import os
+import uuid
+import shutil
+import hashlib
+import logging
+import numpy as np
+import cv2
+
+
+class BackgroundCache:
+    """On-disk cache of decoded and resized background videos.
+
+    Each entry is a (frames, h, w, 3) uint8 .npy file keyed by the video identity
+    (path, size, mtime) and the resize parameters. Entries are opened as read-only
+    memmaps, so frames are read through the page cache and shared between
+    processes using the same background.
+
+    Attributes:
+        cache_dir(str): directory of the cached .npy files
+    """
+
+    def __init__(self, cache_dir: str) -> None:
+        self.cache_dir = cache_dir
+        if not os.path.exists(cache_dir): os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, video_path: str, frame_width: int, frame_height: int, interpolation: int = cv2.INTER_AREA) -> str:
+        stat = os.stat(video_path)
+        identity = "{}|{}|{}|{}x{}|{}".format(os.path.realpath(video_path), stat.st_size, stat.st_mtime_ns,
+                                              frame_width, frame_height, interpolation)
+        return hashlib.sha1(identity.encode()).hexdigest()
+
+    def get(self, video_path: str, frame_width: int, frame_height: int, interpolation: int = cv2.INTER_AREA) -> np.ndarray:
+        """Get the resized frames of a video, decoding it only on a miss.
+
+        Args:
+            video_path(str): path of the background video (or image)
+            frame_width(int)
+            frame_height(int)
+            interpolation(int): cv2 interpolation used to resize
+
+        Returns:
+            frames(ndarray): (n, h, w, 3) uint8 read-only memmap
+        """
+        path = os.path.join(self.cache_dir, self.key(video_path, frame_width, frame_height, interpolation) + ".npy")
+        if not os.path.exists(path):
+            logging.info("Caching background {} in {}".format(video_path, path))
+            self._build(video_path, frame_width, frame_height, interpolation, path)
+        return np.load(path, mmap_mode='r')
+
+    @staticmethod
+    def _build(video_path: str, frame_width: int, frame_height: int, interpolation: int, path: str) -> None:
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            raise IOError("Unable to open video stream {}".format(video_path))
+
+        # frames are streamed to a raw file first since their number is known only at the end
+        tmp_id = "{}.{}".format(os.getpid(), uuid.uuid4().hex)
+        raw_path = "{}.{}.raw".format(path, tmp_id)
+        tmp_path = "{}.{}.tmp".format(path, tmp_id)
+        num_frames = 0
+        try:
+            with open(raw_path, 'wb') as raw:
+                while True:
+                    ret, frame = cap.read()
+                    if not ret:
+                        break
+                    frame = cv2.resize(frame, dsize=(frame_width, frame_height), interpolation=interpolation)
+                    raw.write(np.ascontiguousarray(frame, dtype=np.uint8).data)
+                    num_frames += 1
+            cap.release()
+            if num_frames == 0:
+                raise ValueError("Video {} has no frames".format(video_path))
+
+            header = {'descr': np.lib.format.dtype_to_descr(np.dtype(np.uint8)), 'fortran_order': False,
+                      'shape': (num_frames, frame_height, frame_width, 3)}
+            with open(tmp_path, 'wb') as out, open(raw_path, 'rb') as raw:
+                np.lib.format.write_array_header_1_0(out, header)
+                shutil.copyfileobj(raw, out, 16 * 1024 ** 2)
+            # atomic publish, concurrent builders of the same key write identical files
+            os.replace(tmp_path, path)
+        finally:
+            cap.release()
+            for p in (raw_path, tmp_path):
+                if os.path.exists(p): os.remove(p)
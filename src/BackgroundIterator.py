@@ -1,5 +1,14 @@
+import queue
+import threading
+import numpy as np
+import cv2
+
 
 class BackgroundIterator:
+    """Iterate over background frames, holding the last one once they end.
+
+    Frames are uint8 (h, w, 3) arrays that the caller is free to modify.
+    """
     index: int
 
     def __init__(self, frames: list):
@@ -15,3 +24,168 @@ class BackgroundIterator:
         frame = self.frames[self.index].copy()
         self.index += 1
         return frame
+
+    def reserve(self, num_frames: int):
+        """Keep valid the last num_frames frames handed out.
+
+        Nothing to do here since each frame is a new array, iterators reusing their
+        buffers grow them.
+        """
+        pass
+
+    def mark_dirty(self, rects: list):
+        """Tell that only rects of the last frame handed out were modified.
+
+        Iterators reusing their buffers then refresh only these rects when the buffer
+        comes around again, instead of the whole frame. Without a call the whole
+        frame is refreshed.
+
+        Args:
+            rects(list): [row_i, row_f, col_i, col_f] modified slices of the frame
+        """
+        pass
+
+    def close(self):
+        pass
+
+
+class StaticBackgroundIterator(BackgroundIterator):
+    """Background iterator of a constant frame, a solid color or a still image.
+
+    Frames are handed out from a ring of preallocated buffers refreshed from the
+    pristine frame, so nothing is allocated per frame. A frame handed out stays
+    valid until as many frames as buffers are requested after it (see reserve).
+    When the caller reports the rects it painted (see mark_dirty), only those are
+    refreshed, so the work per frame follows the patch area and not the frame area.
+
+    Attributes:
+        frame(ndarray): read-only uint8 pristine frame
+    """
+
+    def __init__(self, frame: np.ndarray, num_buffers: int = 1):
+        self.frame = np.array(frame, dtype=np.uint8)
+        self.frame.setflags(write=False)
+        self.frames = [self.frame]
+        self.index = 0
+        self._buffers = []
+        # rects modified in each buffer, None when the whole buffer has to be refreshed
+        self._dirty = []
+        self.reserve(num_buffers)
+
+    @classmethod
+    def from_color(cls, frame_width: int, frame_height: int, bgr: tuple) -> 'StaticBackgroundIterator':
+        frame = np.empty((frame_height, frame_width, 3), dtype=np.uint8)
+        frame[:, :] = bgr
+        return cls(frame)
+
+    def reserve(self, num_frames: int):
+        while len(self._buffers) < num_frames:
+            self._buffers.append(np.empty_like(self.frame))
+            self._dirty.append(None)
+
+    def mark_dirty(self, rects: list):
+        if self.index == 0:
+            return
+        rects = [list(rect) for rect in rects]
+        # rects as large as the frame are slower to refresh one by one
+        if sum((r_f - r_i) * (c_f - c_i) for r_i, r_f, c_i, c_f in rects) * 2 >= self.frame.shape[0] * self.frame.shape[1]:
+            rects = None
+        self._dirty[(self.index - 1) % len(self._buffers)] = rects
+
+    def __next__(self):
+        slot = self.index % len(self._buffers)
+        buffer = self._buffers[slot]
+        if self._dirty[slot] is None:
+            np.copyto(buffer, self.frame)
+        else:
+            for r_i, r_f, c_i, c_f in self._dirty[slot]:
+                buffer[r_i:r_f, c_i:c_f] = self.frame[r_i:r_f, c_i:c_f]
+        self._dirty[slot] = None
+        self.index += 1
+        return buffer
+
+
+def _read_frames(cap: cv2.VideoCapture, frame_size: tuple, interpolation: int, frames: queue.Queue, stop: threading.Event):
+    """Decode and resize frames of cap into the frames queue, None marks the end."""
+    try:
+        while not stop.is_set():
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frame = cv2.resize(frame, dsize=frame_size, interpolation=interpolation)
+            while not stop.is_set():
+                try:
+                    frames.put(frame, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+    finally:
+        cap.release()
+        frames.put(None)
+
+
+class VideoBackgroundIterator(BackgroundIterator):
+    """Background iterator decoding video frames on demand.
+
+    Frames are decoded and resized by a background thread into a small read-ahead
+    buffer, so memory does not depend on the video length. As BackgroundIterator,
+    the last frame is held once the video ends.
+
+    Attributes:
+        video_path(str)
+        frame_width(int)
+        frame_height(int)
+        buffer_size(int): number of frames decoded ahead
+    """
+
+    def __init__(self, video_path: str, frame_width: int, frame_height: int, buffer_size: int = 8,
+                 interpolation: int = cv2.INTER_AREA):
+        self.video_path = video_path
+        self.frame_width = frame_width
+        self.frame_height = frame_height
+        self.buffer_size = buffer_size
+        self.index = 0
+        self._last = None
+
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            raise IOError("Unable to open video stream {}".format(video_path))
+        self._frames = queue.Queue(maxsize=buffer_size)
+        self._stop = threading.Event()
+        self._reader = threading.Thread(target=_read_frames, daemon=True, args=(
+            cap, (frame_width, frame_height), interpolation, self._frames, self._stop))
+        self._reader.start()
+
+        # two frames are looked ahead to know if a frame is the last one
+        self._next = self._frames.get()
+        if self._next is None:
+            raise ValueError("Video {} has no frames".format(video_path))
+        self._following = self._frames.get()
+        self.single_frame = self._following is None
+
+    def __next__(self):
+        self.index += 1
+        if self._last is not None:
+            return self._last.copy()
+        frame = self._next
+        if self._following is None:
+            # keep a pristine copy, the returned frame is modified by the caller
+            self._last = frame
+            return frame.copy()
+        self._next = self._following
+        self._following = self._frames.get()
+        return frame
+
+    def close(self):
+        self._stop.set()
+        # unblock the reader if it waits on a full buffer
+        while self._reader.is_alive():
+            try:
+                self._frames.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        self._reader.join()
+
+    def __del__(self):
+        if hasattr(self, "_reader"):
+            self.close()
@@ -0,0 +1,113 @@
+import os
+import numpy as np
+import cv2
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+
+IMAGE_FORMATS = ['png', 'jpg', 'webp']
+
+
+def write_atomic(path: str, data: bytes) -> None:
+    """Write data to a temporary file then rename it, readers never see a partial file."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as file:
+        file.write(data)
+    os.replace(tmp_path, path)
+
+
+class FrameWriter:
+    """Write frames and their annotations with a bounded pool of threads.
+
+    OpenCV releases the GIL while encoding, so images of consecutive frames are
+    encoded in parallel. write() waits for the oldest frame while max_pending frames
+    are in flight, which bounds the memory held by the writer: only the last
+    max_pending written frames are still in use when write() returns.
+
+    Attributes:
+        dataset_dir(str): directory of the sequence
+        image_format(str): one of IMAGE_FORMATS
+        png_compression(int): png compression level 0-9, OpenCV default if None
+        quality(int): jpg/webp quality 0-100, OpenCV default if None
+        num_threads(int)
+        max_pending(int)
+    """
+
+    def __init__(self, dataset_dir: str, image_format: str = 'png', png_compression: int = None, quality: int = None,
+                 num_threads: int = 4, max_pending: int = None) -> None:
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError("Unknown image format '{}', use {}".format(image_format, IMAGE_FORMATS))
+        self.dataset_dir = dataset_dir
+        self.image_format = image_format
+        self.png_compression = png_compression
+        self.quality = quality
+        self.num_threads = max(1, num_threads)
+        self.max_pending = 2 * self.num_threads if max_pending is None else max_pending
+
+        self.params = []
+        if image_format == 'png' and png_compression is not None:
+            self.params = [cv2.IMWRITE_PNG_COMPRESSION, png_compression]
+        elif image_format == 'jpg' and quality is not None:
+            self.params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+        elif image_format == 'webp' and quality is not None:
+            self.params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+
+        self._pool = ThreadPoolExecutor(max_workers=self.num_threads)
+        self._futures = deque()
+        self._errors = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, index: int, frame: np.ndarray, annotations: str) -> None:
+        """Queue frame #index and its annotation lines for writing.
+
+        The frame must not be modified by the caller afterwards.
+
+        Args:
+            index(int): frame index, used as file name
+            frame(ndarray)
+            annotations(str): content of the annotation file
+        """
+        if len(self._errors) > 0:
+            raise self._errors[0]
+        if len(self._futures) >= self.max_pending:
+            wait([self._futures.popleft()])
+        future = self._pool.submit(self._write, index, frame, annotations)
+        future.add_done_callback(self._done)
+        self._futures.append(future)
+
+    def _encode(self, index: int, frame: np.ndarray) -> bytes:
+        ret, buffer = cv2.imencode("." + self.image_format, frame, self.params)
+        if not ret:
+            raise IOError("Unable to encode frame {}".format(index))
+        return buffer.tobytes()
+
+    def _write(self, index: int, frame: np.ndarray, annotations: str) -> None:
+        fn = os.path.join(self.dataset_dir, "{:010d}".format(index))
+        write_atomic(fn + "." + self.image_format, self._encode(index, frame))
+        write_atomic(fn + ".txt", annotations.encode())
+
+    def _done(self, future) -> None:
+        if future.exception() is not None:
+            self._errors.append(future.exception())
+
+    def close(self) -> None:
+        """Wait for all queued frames, raising the first write error if any."""
+        self._pool.shutdown(wait=True)
+        if len(self._errors) > 0:
+            raise self._errors[0]
+
+    def abort(self) -> None:
+        """Drop the queued frames not started yet and wait for the others, for a sequence that failed.
+
+        Write errors are not raised, so they do not hide the error the sequence failed with.
+        """
+        for future in self._futures:
+            future.cancel()
+        self._pool.shutdown(wait=True)
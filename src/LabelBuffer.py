@@ -0,0 +1,167 @@
+import itertools
+import numpy as np
+from src.AnnotationStore import AnnotationStore
+
+
+class LabelBuffer:
+    """Object ID buffer of the composed frames, for occlusion aware annotations.
+
+    Objects are painted in level order, so an object is only occluded by the later
+    objects its frame rectangle intersects. Those are written to the ID buffer only
+    in the window bounding these intersections, and the windows are cleared after,
+    so the frame is never scanned as a whole. Objects nothing covers are not
+    written at all: a whole patch is visible as it is (see Sprite.coverage_summary),
+    and the visible part of a patch clipped by the frame border comes from the
+    summed-area table of its coverage (Sprite.coverage_table).
+
+    The visible fraction of an object is its visible pixels over all the pixels its
+    patch draws, so an object partly out of the frame is partly visible. Each frame
+    the store rows of the placed objects get that fraction, and objects below
+    min_visible (or without any visible pixel) are dropped: box -1 and visible 0,
+    as objects out of the frame.
+
+    Attributes:
+        store(AnnotationStore): boxes updated each frame
+        min_visible(float): visible fraction under which an object is dropped
+        tight_boxes(bool): shrink boxes to the visible pixels of the objects
+        ids(ndarray): (height, width) buffer, 1 + the position of the object painted last in the windows, 0 elsewhere
+    """
+
+    def __init__(self, store: AnnotationStore, min_visible: float = 0.0, tight_boxes: bool = False) -> None:
+        self.store = store
+        self.min_visible = min_visible
+        self.tight_boxes = tight_boxes
+        num_objects = int(store.boxes['object_id'].max()) + 1 if len(store) > 0 else 0
+        dtype = np.int16 if num_objects < np.iinfo(np.int16).max else np.int32
+        self.ids = np.zeros((store.height, store.width), dtype=dtype)
+        self._upper = None
+
+    def visibility(self, sprites: list, steps: np.ndarray, tight: bool = True):
+        """Visible pixels and tight box of objects painted in order.
+
+        Args:
+            sprites(list): Sprite of each object, in paint order
+            steps(ndarray): TRACK_DTYPE step of each object in this frame
+            tight(bool): also compute the visible boxes, which needs the row and column counts
+                of the objects the frame border or other objects cut
+
+        Returns:
+            counts(ndarray): (n,) visible pixels of each object
+            totals(ndarray): (n,) pixels drawn by the whole patch of each object
+            boxes(ndarray): (n, 4) [top, left, bottom, right] visible box of each object, -1 if none.
+                None if not tight
+            cut(ndarray): (n,) bool, objects not whole and visible as they are
+        """
+        n = len(sprites)
+        summary = np.fromiter(itertools.chain.from_iterable(sprite.coverage_summary() for sprite in sprites),
+                              dtype=np.int32, count=7 * n).reshape(n, 7)
+        totals = summary[:, 2].astype(np.int64)
+        dst, src = steps['dst'], steps['src']
+        in_frame = steps['bbox'][:, 0] >= 0
+        # overlap[i, j] when the frame rectangles intersect and j is painted after i, objects out
+        # of the frame have empty rectangles
+        if self._upper is None or len(self._upper) != n:
+            self._upper = np.triu(np.ones((n, n), dtype=bool), k=1)
+        overlap = ((dst[:, None, 0] < dst[None, :, 1]) & (dst[None, :, 0] < dst[:, None, 1]) &
+                   (dst[:, None, 2] < dst[None, :, 3]) & (dst[None, :, 2] < dst[:, None, 3]) & self._upper)
+        occluded = overlap.any(axis=1)
+        clipped = np.any(dst[:, 1::2] - dst[:, ::2] != summary[:, :2], axis=1)
+        cut = in_frame & (occluded | clipped)
+        counts = np.where(in_frame, totals, 0)
+        boxes = None
+        if tight:
+            # whole patches nothing covers, the common case, are visible as they are
+            boxes = np.where(counts[:, None] > 0, summary[:, 3:] + np.tile(dst[:, ::2], 2), -1)
+        if not cut.any():
+            return counts, totals, boxes, cut
+
+        # the window of an occluded object bounds its intersections with the later objects, outside
+        # of it nothing covers the object and inside the ids are 1 + the later object painted last
+        dst, src, occluded = dst.tolist(), src.tolist(), occluded.tolist()
+        pairs = list(zip(*[axis.tolist() for axis in np.nonzero(overlap)]))
+        windows = [None] * n
+        for i, j in pairs:
+            (a_i, a_f, b_i, b_f), (r_i, r_f, c_i, c_f) = dst[i], dst[j]
+            r_i, r_f, c_i, c_f = max(a_i, r_i), min(a_f, r_f), max(b_i, c_i), min(b_f, c_f)
+            window = windows[i]
+            windows[i] = [r_i, r_f, c_i, c_f] if window is None else [min(window[0], r_i), max(window[1], r_f),
+                                                                         min(window[2], c_i), max(window[3], c_f)]
+        # an object is painted in the windows of the objects it covers, in paint order
+        for k, i in sorted((j, i) for i, j in pairs):
+            fr_i, fr_f, fc_i, fc_f = dst[k]
+            r_i, r_f = max(windows[i][0], fr_i), min(windows[i][1], fr_f)
+            c_i, c_f = max(windows[i][2], fc_i), min(windows[i][3], fc_f)
+            if r_i < r_f and c_i < c_f:
+                pr, pc = src[k][0] - fr_i, src[k][2] - fc_i
+                np.copyto(self.ids[r_i:r_f, c_i:c_f], k + 1,
+                          where=sprites[k].coverage[r_i + pr:r_f + pr, c_i + pc:c_f + pc])
+
+        for k in np.flatnonzero(cut).tolist():
+            fr_i, fr_f, fc_i, fc_f = dst[k]
+            pr_i, pr_f, pc_i, pc_f = src[k]
+            table = sprites[k].coverage_table()
+            if not occluded[k]:
+                counts[k] = table[pr_f, pc_f] - table[pr_i, pc_f] - table[pr_f, pc_i] + table[pr_i, pc_i]
+                if tight:
+                    boxes[k] = -1
+                if tight and counts[k] > 0:
+                    # counts up to each row and col of the patch part in the frame, the first and
+                    # last drawn ones are where they increase
+                    row_sums = table[pr_i:pr_f + 1, pc_f] - table[pr_i:pr_f + 1, pc_i]
+                    col_sums = table[pr_f, pc_i:pc_f + 1] - table[pr_i, pc_i:pc_f + 1]
+                    top, bottom = np.searchsorted(row_sums, row_sums[[0, -1]] + [1, 0]).tolist()
+                    left, right = np.searchsorted(col_sums, col_sums[[0, -1]] + [1, 0]).tolist()
+                    boxes[k] = [fr_i + top - 1, fc_i + left - 1, fr_i + bottom - 1, fc_i + right - 1]
+                continue
+            r_i, r_f, c_i, c_f = windows[k]
+            pr, pc = pr_i - fr_i, pc_i - fc_i
+            hidden = sprites[k].coverage[r_i + pr:r_f + pr, c_i + pc:c_f + pc] & (self.ids[r_i:r_f, c_i:c_f] > k + 1)
+            if not tight:
+                counts[k] = (table[pr_f, pc_f] - table[pr_i, pc_f] - table[pr_f, pc_i] + table[pr_i, pc_i] -
+                             np.count_nonzero(hidden))
+                continue
+            row_counts = np.diff(table[pr_i:pr_f + 1, pc_f] - table[pr_i:pr_f + 1, pc_i])
+            col_counts = np.diff(table[pr_f, pc_i:pc_f + 1] - table[pr_i, pc_i:pc_f + 1])
+            row_counts[r_i - fr_i:r_f - fr_i] -= np.count_nonzero(hidden, axis=1)
+            col_counts[c_i - fc_i:c_f - fc_i] -= np.count_nonzero(hidden, axis=0)
+            counts[k] = row_counts.sum()
+            rows, cols = np.flatnonzero(row_counts), np.flatnonzero(col_counts)
+            boxes[k] = -1
+            if len(rows) > 0:
+                boxes[k] = [fr_i + rows[0], fc_i + cols[0], fr_i + rows[-1], fc_i + cols[-1]]
+        for k in range(n):
+            if occluded[k]:
+                r_i, r_f, c_i, c_f = windows[k]
+                self.ids[r_i:r_f, c_i:c_f] = 0
+        return counts, totals, boxes, cut
+
+    def update(self, frame: int, placed: list) -> None:
+        """Update the store rows of frame #frame.
+
+        Args:
+            frame(int): frame index
+            placed(list): (object_id, sprite, step) of the objects in the frame, in paint order
+        """
+        if len(placed) == 0:
+            return
+        object_ids, sprites, steps = zip(*placed)
+        counts, totals, visible_boxes, cut = self.visibility(list(sprites), np.array(list(steps), dtype=steps[0].dtype),
+                                                             self.tight_boxes)
+        # whole objects, visible 1 and untouched boxes in the store, only change with tight boxes. Patches
+        # drawing no pixel are never visible
+        changed = cut | (counts < totals * self.min_visible) | (totals == 0) if not self.tight_boxes else counts >= 0
+        if not changed.any():
+            return
+        rows = self.store.boxes[self.store.frame_slice(frame)]
+        index = np.searchsorted(rows['object_id'], np.array(object_ids)[changed])
+        counts, totals = counts[changed], totals[changed]
+        visible = counts / np.maximum(totals, 1)
+        keep = (counts > 0) & (visible >= self.min_visible)
+        if visible_boxes is None:
+            boxes = np.stack([rows[field][index] for field in ['y1', 'x1', 'y2', 'x2']], axis=1)
+        else:
+            boxes = visible_boxes[changed]
+        boxes[~keep] = -1
+        # rows is a view of the store
+        rows['visible'][index] = np.where(keep, visible, 0)
+        rows['y1'][index], rows['x1'][index], rows['y2'][index], rows['x2'][index] = boxes.T
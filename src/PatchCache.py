@@ -0,0 +1,111 @@
+import os
+import logging
+import threading
+import numpy as np
+import cv2
+from collections import OrderedDict
+from typing import Tuple
+from src.simulator import patch_mask, premultiply_alpha
+
+
+def load_patch(patch_path: str, ratio: float) -> np.ndarray:
+    """Decode a patch image (or .npy array) and resize it by ratio.
+
+    Args:
+        patch_path(str): path of the patch
+        ratio(float): scale factor applied to the patch
+
+    Returns:
+        patch(ndarray): (h, w, 4) uint8 premultiplied BGRA patch for images with alpha, else
+            (h, w, 3) uint8 patch whose black pixels are transparent
+    """
+    if patch_path.endswith(".npy"):
+        p = np.load(patch_path)
+    else:
+        p = cv2.imread(patch_path, cv2.IMREAD_UNCHANGED)
+        if p.ndim == 3 and p.shape[2] == 4:
+            if p.dtype == np.uint16:
+                p = (p // 257).astype(np.uint8)
+            # resized premultiplied, straight color would bleed into transparent pixels
+            p = premultiply_alpha(p)
+    patch = cv2.resize(p, dsize=(
+        int(p.shape[1] * ratio), int(p.shape[0] * ratio)), interpolation=cv2.INTER_AREA)
+    if patch.dtype != np.uint8:
+        patch = np.clip(patch, 0, 255).astype(np.uint8)
+    return patch
+
+
+class PatchCache:
+    """LRU cache of decoded patches, ready to be composited, with their masks.
+
+    Entries are keyed by (path, mtime, ratio) so an edited asset is decoded again.
+    Cached arrays are shared between callers and therefore read-only.
+
+    Attributes:
+        max_bytes(int): size limit of cached patches and masks
+        hits(int)
+        misses(int)
+    """
+
+    def __init__(self, max_bytes: int = 512 * 1024 ** 2) -> None:
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+    def get(self, patch_path: str, ratio: float) -> Tuple[np.ndarray, np.ndarray]:
+        """Get a resized patch and its opacity mask, decoding it only on a miss.
+
+        Args:
+            patch_path(str): path of the patch
+            ratio(float): scale factor applied to the patch
+
+        Returns:
+            patch(ndarray): (h, w, 3) or premultiplied (h, w, 4) uint8 read-only patch (see load_patch)
+            mask(ndarray): (h, w) bool read-only mask (see patch_mask)
+        """
+        key = (os.path.realpath(patch_path), os.stat(patch_path).st_mtime_ns, float(ratio))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        patch = load_patch(patch_path, ratio)
+        mask = patch_mask(patch)
+        patch.setflags(write=False)
+        mask.setflags(write=False)
+        entry = (patch, mask)
+
+        size = patch.nbytes + mask.nbytes
+        if size > self.max_bytes:
+            logging.debug("Patch {} ({} bytes) exceeds cache size, not cached".format(patch_path, size))
+            return entry
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = entry
+                self._nbytes += size
+            while self._nbytes > self.max_bytes:
+                _, (old_patch, old_mask) = self._entries.popitem(last=False)
+                self._nbytes -= old_patch.nbytes + old_mask.nbytes
+        return entry
+
+
+# process-wide cache used by create_video.parse_json
+patch_cache = PatchCache()
@@ -0,0 +1,185 @@
+import os
+import json
+import uuid
+import shutil
+import hashlib
+import logging
+from src.MovementType import MovementType
+
+CACHED_VIDEO = "video.mp4"
+# files of a sequence that describe a run rather than its output
+UNCACHED_FILES = ["profile.json", "profile.prof"]
+# writer options that do not change the written files
+UNKEYED_WRITER_OPTIONS = ["num_threads", "max_pending"]
+
+
+def link_or_copy(src: str, dst: str) -> None:
+    """Hard link src to dst, copy it if linking is not possible (e.g. other file system).
+
+    An existing dst is removed first, writing into it would modify the files it is linked to.
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def file_identity(path: str) -> str:
+    """Identity of a file by path, size and modification time, as BackgroundCache."""
+    stat = os.stat(path)
+    return "{}|{}|{}".format(os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
+
+
+def has_random_steps(instructions: list) -> bool:
+    """Whether the render of instructions depends on the random generators: trap steps draw their cruise velocity.
+
+    Without a seed such a sequence is rendered differently each time, and must not be cached.
+    """
+    return any(step[2].value == MovementType.trap.value for instruction in instructions for step in instruction.route)
+
+
+def render_key(instructions: list, background: str, width: int, height: int, fps: int, seed: int = None,
+               writer_options: dict = None) -> str:
+    """Hash of everything a rendered sequence depends on.
+
+    Objects are hashed as loaded, which covers the sequence json, its route files
+    and the resized patch bytes.
+
+    Args:
+        instructions(list): Instruction of each object
+        background(str): identity of the background, e.g. its color or file_identity
+        width(int)
+        height(int)
+        fps(int)
+        seed(int): seed of the random generators before simulate
+        writer_options(dict): writer_options of simulate
+
+    Returns:
+        key(str): hex digest
+    """
+    digest = hashlib.sha1()
+    options = {k: v for k, v in (writer_options or {}).items() if k not in UNKEYED_WRITER_OPTIONS}
+    digest.update(json.dumps([background, width, height, fps, seed, options], sort_keys=True).encode())
+    for instruction in instructions:
+        route = [[dw, dh, command.value, time] + list(transform) for dw, dh, command, time, *transform in instruction.route]
+        digest.update(json.dumps([instruction.label, instruction.origin_x, instruction.origin_y, route,
+                                  instruction.patch.shape, str(instruction.patch.dtype)]).encode())
+        digest.update(instruction.patch.tobytes())
+        digest.update(instruction.mask.tobytes())
+    return digest.hexdigest()
+
+
+class RenderCache:
+    """On-disk cache of rendered sequences keyed by render_key.
+
+    An entry is a directory with the files of the seqN directory and the video if
+    one was rendered. Files are hard linked in and out of the cache when possible,
+    which is safe since the frame writers replace files instead of modifying them,
+    and the video writer and get() remove an existing file before writing it. Entries
+    are published atomically and evicted least recently used first once the cache
+    grows over max_bytes.
+
+    Attributes:
+        cache_dir(str)
+        max_bytes(int): size limit of the cache, unlimited if None
+        hits(int)
+        misses(int)
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = None) -> None:
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _entry(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key: str, seq_dir: str, video_out: str = None) -> bool:
+        """Fill seq_dir (and video_out) with the cached sequence of key.
+
+        Args:
+            key(str): render_key of the sequence
+            seq_dir(str): empty seqN directory
+            video_out(str): path of the video if wanted, an entry without video is a miss
+
+        Returns:
+            hit(bool): False if the sequence has to be rendered, seq_dir is left empty
+        """
+        entry = self._entry(key)
+        if not os.path.isdir(entry) or (video_out is not None and not os.path.exists(os.path.join(entry, CACHED_VIDEO))):
+            self.misses += 1
+            return False
+        copied = []
+        try:
+            for name in os.listdir(entry):
+                dst = video_out if name == CACHED_VIDEO else os.path.join(seq_dir, name)
+                if dst is None:
+                    continue
+                link_or_copy(os.path.join(entry, name), dst)
+                copied.append(dst)
+            os.utime(entry)
+        except OSError:
+            # evicted meanwhile by another process
+            for dst in copied:
+                os.remove(dst)
+            self.misses += 1
+            return False
+        self.hits += 1
+        return True
+
+    def put(self, key: str, seq_dir: str, video_out: str = None) -> None:
+        """Store the rendered seq_dir (and video_out) as the entry of key, then evict to max_bytes."""
+        entry = self._entry(key)
+        tmp_entry = "{}.{}.{}.tmp".format(entry, os.getpid(), uuid.uuid4().hex)
+        os.makedirs(tmp_entry)
+        try:
+            for name in os.listdir(seq_dir):
+                path = os.path.join(seq_dir, name)
+                # a video inside seq_dir (output_format 'video') is stored as CACHED_VIDEO below
+                if name not in UNCACHED_FILES and os.path.isfile(path) and not (
+                        video_out is not None and os.path.samefile(path, video_out)):
+                    link_or_copy(path, os.path.join(tmp_entry, name))
+            if video_out is not None:
+                link_or_copy(video_out, os.path.join(tmp_entry, CACHED_VIDEO))
+            if os.path.isdir(entry):
+                # e.g. an entry without the video
+                shutil.rmtree(entry, ignore_errors=True)
+            os.replace(tmp_entry, entry)
+        except OSError as e:
+            logging.warning("Unable to cache sequence {}: {}".format(key, e))
+        finally:
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+        self.evict()
+
+    def entries(self) -> list:
+        """(mtime, size, path) of the published entries, least recently used first."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith(".tmp") or not os.path.isdir(path):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+                entries.append((os.path.getmtime(path), size, path))
+            except OSError:
+                continue
+        return sorted(entries)
+
+    def nbytes(self) -> int:
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self) -> None:
+        if self.max_bytes is None:
+            return
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            logging.info("Evicting cached sequence {}".format(os.path.basename(path)))
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
@@ -0,0 +1,212 @@
+import os
+import struct
+import zipfile
+import functools
+import numpy as np
+from typing import Tuple
+from src.MovementType import MovementType
+
+ROUTE_LIBRARY_EXT = ".npz"
+# route file keyword of each MovementType, see create_video.txt_to_MovementType
+MOVEMENT_TEXT = {MovementType.urm.value: "const", MovementType.uarm.value: "acc", MovementType.trap.value: "trap"}
+MOVEMENT_CODES = [m.value for m in MovementType]
+
+# a route step, scale and angle are NaN when the step keeps the current ones
+STEP_DTYPE = np.dtype([
+    ('dest', np.int32, (2,)),
+    ('type', np.int8),
+    ('time', np.int32),
+    ('scale', np.float64),
+    ('angle', np.float64),
+])
+
+
+def memmap_npz(path: str) -> dict:
+    """Memory map the arrays of an uncompressed .npz file (np.savez) instead of reading them.
+
+    Returns:
+        arrays(dict): read-only memory mapped arrays by name, None if some member is compressed
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as file:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                return None
+            # the local file header has its own name and extra field lengths
+            file.seek(info.header_offset + 26)
+            name_len, extra_len = struct.unpack('<HH', file.read(4))
+            file.seek(info.header_offset + 30 + name_len + extra_len)
+            version = np.lib.format.read_magic(file)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+            array = np.memmap(path, dtype=dtype, mode='r', offset=file.tell(), shape=shape,
+                              order='F' if fortran_order else 'C')
+            # plain ndarray views, memmap slicing is slower. Members are not aligned in the
+            # archive and searching unaligned arrays is much slower, those (the small index
+            # arrays, the packed steps are always aligned) are copied
+            arrays[info.filename[:-len(".npy")]] = np.asarray(array) if array.flags.aligned else np.array(array)
+    return arrays
+
+
+def format_route(origin_x: int, origin_y: int, route: list) -> list:
+    """Lines of the route text format (see create_video.parse_instructions) of a parsed route."""
+    lines = ["{},{}\n".format(origin_x, origin_y)]
+    for dw, dh, command, time_ms, *transform in route:
+        fields = [dw, dh, MOVEMENT_TEXT[command.value], time_ms] + list(transform)
+        lines.append(",".join(str(f) for f in fields) + "\n")
+    return lines
+
+
+class RouteLibrary:
+    """Many routes compiled in a few typed arrays, saved as a single .npz file.
+
+    The steps of all routes are concatenated in one STEP_DTYPE array, route i owns
+    steps[offsets[i]:offsets[i + 1]]. Names are sorted so a route is found by
+    binary search. The arrays of a saved library are memory mapped, so loading
+    takes about the same time for any number of routes.
+
+    Attributes:
+        names(ndarray): sorted route names
+        origins(ndarray): (n, 2) int origin (x, y) of each route
+        offsets(ndarray): (n + 1,) int64 first step of each route
+        steps(ndarray): STEP_DTYPE steps of all routes
+    """
+
+    def __init__(self, names: np.ndarray, origins: np.ndarray, offsets: np.ndarray, steps: np.ndarray) -> None:
+        self.names = names
+        self.origins = origins
+        self.offsets = offsets
+        self.steps = steps
+
+    @classmethod
+    def from_routes(cls, routes: dict) -> 'RouteLibrary':
+        """Compile parsed routes.
+
+        Args:
+            routes(dict): (origin_x, origin_y, route) by name, as returned by create_video.parse_instructions
+
+        Returns:
+            library(RouteLibrary)
+        """
+        names = sorted(routes)
+        origins = np.array([routes[name][:2] for name in names], dtype=np.int64).reshape(-1, 2)
+        lengths = [len(routes[name][2]) for name in names]
+        offsets = np.zeros(len(names) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(lengths)
+        route_steps = [step for name in names for step in routes[name][2]]
+        steps = np.zeros(len(route_steps), dtype=STEP_DTYPE)
+        steps['dest'] = np.array([step[:2] for step in route_steps], dtype=np.int32).reshape(-1, 2)
+        steps['type'] = [MOVEMENT_CODES.index(step[2].value) for step in route_steps]
+        steps['time'] = [step[3] for step in route_steps]
+        steps['scale'] = [step[4] if len(step) > 4 else np.nan for step in route_steps]
+        steps['angle'] = [step[5] if len(step) > 5 else np.nan for step in route_steps]
+        return cls(np.array(names, dtype=str), origins, offsets, steps)
+
+    @classmethod
+    def from_batch(cls, names: list, origins: np.ndarray, steps: np.ndarray, counts: np.ndarray) -> 'RouteLibrary':
+        """Compile padded route arrays, e.g. of create_random_route.routes_batch_generator.
+
+        Args:
+            names(list): name of each route
+            origins(ndarray): (n, 2) origin (x, y) of each route
+            steps(ndarray): (n, K) STEP_DTYPE steps of each route
+            counts(ndarray): (n,) number of steps of each route, the following ones are ignored
+
+        Returns:
+            library(RouteLibrary)
+        """
+        names = np.asarray(names, dtype=str)
+        order = np.argsort(names, kind='stable')
+        counts = np.asarray(counts, dtype=np.int64)[order]
+        steps = steps[order]
+        offsets = np.zeros(len(names) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(counts)
+        return cls(names[order], np.asarray(origins, dtype=np.int64)[order], offsets,
+                   steps[np.arange(steps.shape[1]) < counts[:, None]])
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> 'RouteLibrary':
+        """Load a saved library.
+
+        Args:
+            path(str): .npz library
+            mmap(bool): memory map the arrays, so only the routes used are read from disk
+
+        Returns:
+            library(RouteLibrary)
+        """
+        data = memmap_npz(path) if mmap else None
+        if data is None:
+            with np.load(path) as npz:
+                data = {name: npz[name] for name in npz.files}
+        return cls(data['names'], data['origins'], data['offsets'], data['steps'])
+
+    def save(self, path: str) -> None:
+        """Save the library, uncompressed so that loading is a plain copy."""
+        if not path.endswith(ROUTE_LIBRARY_EXT):
+            path = path + ROUTE_LIBRARY_EXT
+        np.savez(path, names=self.names, origins=self.origins, offsets=self.offsets, steps=self.steps)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def _index(self, name: str) -> int:
+        # a key of the names dtype, otherwise numpy casts all the names at each search
+        i = int(np.searchsorted(self.names, np.array(name, dtype=self.names.dtype)))
+        if i == len(self.names) or self.names[i] != name:
+            return -1
+        return i
+
+    def __contains__(self, name: str) -> bool:
+        return self._index(name) >= 0
+
+    def get(self, name: str) -> Tuple[int, int, list]:
+        """Route of name as create_video.parse_instructions returns it.
+
+        Raises:
+            KeyError: if there is no route with that name
+        """
+        i = self._index(name)
+        if i < 0:
+            raise KeyError(name)
+        steps = self.steps[self.offsets[i]:self.offsets[i + 1]]
+        types = list(MovementType)
+        route = []
+        for dest, code, time_ms, scale, angle in zip(steps['dest'].tolist(), steps['type'].tolist(),
+                                                    steps['time'].tolist(), steps['scale'].tolist(),
+                                                    steps['angle'].tolist()):
+            step = [dest[0], dest[1], types[code], time_ms]
+            if not np.isnan(scale):
+                step.append(scale)
+                if not np.isnan(angle):
+                    step.append(angle)
+            route.append(step)
+        origin_x, origin_y = self.origins[i].tolist()
+        return origin_x, origin_y, route
+
+    def export_text(self, out_dir: str) -> list:
+        """Write each route as <name>.txt in out_dir.
+
+        Returns:
+            paths(list): written route files
+        """
+        os.makedirs(out_dir, exist_ok=True)
+        paths = []
+        for name in self.names.tolist():
+            path = os.path.join(out_dir, name + ".txt")
+            with open(path, 'w') as file:
+                file.writelines(format_route(*self.get(name)))
+            paths.append(path)
+        return paths
+
+
+@functools.lru_cache(maxsize=8)
+def _load_route_library(path: str, mtime_ns: int) -> RouteLibrary:
+    return RouteLibrary.load(path)
+
+
+def load_route_library(path: str) -> RouteLibrary:
+    """Load a route library once per process, again only if the file changed."""
+    return _load_route_library(os.path.realpath(path), os.stat(path).st_mtime_ns)
@@ -0,0 +1,90 @@
+import os
+import json
+from src.FrameWriter import write_atomic
+
+MANIFEST_FILE = "manifest.json"
+# indices of the sequences completed since the manifest was saved, one per line
+DONE_LOG = "done.log"
+DONE = "done"
+PENDING = "pending"
+
+
+class RunManifest:
+    """Record of a random dataset run, enough to resume it after a failure.
+
+    It is saved as MANIFEST_FILE in the dataset directory when the run starts.
+    Completed sequences are then appended to DONE_LOG instead of saving the whole
+    manifest again, which holds every generated sequence and route. Sequences are
+    rendered from the recorded seed, so a resumed sequence is the same as in an
+    uninterrupted run.
+
+    Attributes:
+        dataset_dir(str): dts_<name>_<i> directory of the run
+        seed(int): base seed of the sequences (see sequence_seed)
+        args(dict): command line arguments of the run
+        routes(list): route files of the run
+        sequences(list): sequence json files, or the object list of sequences generated in
+            memory, sequence #i is rendered in seq<first_index + i>
+        backgrounds(list): background files picked from
+        status(list): DONE or PENDING for each sequence
+        generated_routes(dict): lines of the route text format by name, of the routes generated
+            in memory and referenced by the sequences
+        first_index(int): index of the first sequence in the whole run, for a run split in shards
+        objects(list): patch files of the generated sequences, the patch label is the index in it
+    """
+
+    def __init__(self, dataset_dir: str, seed: int, args: dict, routes: list, sequences: list, backgrounds: list,
+                 status: list = None, generated_routes: dict = None, first_index: int = 0,
+                 objects: list = None) -> None:
+        self.dataset_dir = dataset_dir
+        self.seed = seed
+        self.args = args
+        self.routes = routes
+        self.sequences = sequences
+        self.backgrounds = backgrounds
+        self.status = [PENDING] * len(sequences) if status is None else status
+        self.generated_routes = {} if generated_routes is None else generated_routes
+        self.first_index = first_index
+        self.objects = [] if objects is None else objects
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.dataset_dir, MANIFEST_FILE)
+
+    def save(self) -> None:
+        manifest = {"seed": self.seed, "args": self.args, "routes": self.routes, "sequences": self.sequences,
+                    "backgrounds": self.backgrounds, "status": self.status, "generated_routes": self.generated_routes,
+                    "first_index": self.first_index, "objects": self.objects}
+        write_atomic(self.path, json.dumps(manifest, indent=2).encode())
+        # the saved status includes the logged sequences
+        if os.path.exists(os.path.join(self.dataset_dir, DONE_LOG)):
+            os.remove(os.path.join(self.dataset_dir, DONE_LOG))
+
+    @classmethod
+    def load(cls, dataset_dir: str) -> 'RunManifest':
+        with open(os.path.join(dataset_dir, MANIFEST_FILE), 'r') as file:
+            manifest = json.load(file)
+        status = manifest["status"]
+        if os.path.exists(os.path.join(dataset_dir, DONE_LOG)):
+            with open(os.path.join(dataset_dir, DONE_LOG), 'r') as file:
+                for line in file:
+                    # the last line is partial if the run stopped while writing it
+                    if line.endswith("\n"):
+                        status[int(line)] = DONE
+        return cls(dataset_dir, manifest["seed"], manifest["args"], manifest["routes"], manifest["sequences"],
+                   manifest["backgrounds"], status, manifest.get("generated_routes"), manifest.get("first_index", 0),
+                   manifest.get("objects"))
+
+    def pending(self) -> list:
+        """Indices in sequences of the ones not completed yet, partially written ones included."""
+        return [i for i, status in enumerate(self.status) if status != DONE]
+
+    def mark_done(self, index: int) -> None:
+        self.status[index] = DONE
+        with open(os.path.join(self.dataset_dir, DONE_LOG), 'a') as file:
+            file.write("{}\n".format(index))
+
+    def missing_files(self) -> list:
+        """Recorded routes, sequence files and backgrounds that no longer exist."""
+        sequence_files = [seq for seq in self.sequences if isinstance(seq, str)]
+        return [fn for fn in self.routes + sequence_files + self.backgrounds if not os.path.exists(fn)]
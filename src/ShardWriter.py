@@ -0,0 +1,158 @@
+import io
+import os
+import json
+import time
+import tarfile
+import contextlib
+import numpy as np
+import cv2
+from collections import deque
+from typing import Tuple
+from src.FrameWriter import FrameWriter, write_atomic
+
+SHARDS_INDEX = "shards.json"
+
+
+class ShardWriter(FrameWriter):
+    """Pack frames and their annotations into tar shards of fixed size.
+
+    Each shard holds frames_per_shard "%010d.<format>" images with their "%010d.txt"
+    annotations. Images are encoded on the thread pool of FrameWriter and appended
+    in order. Shards are renamed into place when full, and SHARDS_INDEX, written
+    last, maps every frame to its byte offsets for random access (see ShardReader).
+    It is only written by close(), a sequence that failed (see abort) has none.
+
+    Attributes:
+        frames_per_shard(int)
+        shards(list): file names of the written shards
+    """
+
+    def __init__(self, dataset_dir: str, frames_per_shard: int = 1000, **kwargs) -> None:
+        super().__init__(dataset_dir, **kwargs)
+        self.frames_per_shard = frames_per_shard
+        self.shards = []
+        self._frames = []
+        self._pending = deque()
+        self._tar = None
+        self._tar_count = 0
+
+    def write(self, index: int, frame: np.ndarray, annotations: str) -> None:
+        if len(self._pending) >= self.max_pending:
+            self._append(*self._pending.popleft())
+        self._pending.append((index, self._pool.submit(self._encode, index, frame), annotations))
+
+    def _shard_path(self, shard: int) -> str:
+        return os.path.join(self.dataset_dir, "shard-{:06d}.tar".format(shard))
+
+    def _close_shard(self) -> None:
+        if self._tar is None:
+            return
+        self._tar.close()
+        path = self._shard_path(len(self.shards))
+        os.replace(path + ".tmp", path)
+        self.shards.append(os.path.basename(path))
+        self._tar = None
+
+    def _add_member(self, name: str, data: bytes) -> int:
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        # a ustar header is a single block, data follows it
+        offset = self._tar.offset + tarfile.BLOCKSIZE
+        self._tar.addfile(info, io.BytesIO(data))
+        return offset
+
+    def _append(self, index: int, future, annotations: str) -> None:
+        image = future.result()
+        if self._tar is not None and self._tar_count >= self.frames_per_shard:
+            self._close_shard()
+        if self._tar is None:
+            self._tar = tarfile.open(self._shard_path(len(self.shards)) + ".tmp", 'w', format=tarfile.USTAR_FORMAT)
+            self._tar_count = 0
+        name = "{:010d}".format(index)
+        text = annotations.encode()
+        image_offset = self._add_member(name + "." + self.image_format, image)
+        text_offset = self._add_member(name + ".txt", text)
+        self._frames.append([index, len(self.shards), image_offset, len(image), text_offset, len(text)])
+        self._tar_count += 1
+
+    def close(self) -> None:
+        while len(self._pending) > 0:
+            self._append(*self._pending.popleft())
+        self._close_shard()
+        super().close()
+        index = {"image_format": self.image_format, "frames_per_shard": self.frames_per_shard,
+                 "shards": self.shards, "frames": self._frames}
+        write_atomic(os.path.join(self.dataset_dir, SHARDS_INDEX), json.dumps(index).encode())
+
+    def abort(self) -> None:
+        for _, future, _ in self._pending:
+            future.cancel()
+        self._pending.clear()
+        super().abort()
+        if self._tar is not None:
+            # the shard being filled is left as its temporary file if it can not be removed
+            with contextlib.suppress(OSError, tarfile.TarError):
+                self._tar.close()
+                os.remove(self._shard_path(len(self.shards)) + ".tmp")
+            self._tar = None
+
+
+class ShardReader:
+    """Random access reader of a sequence written by ShardWriter.
+
+    Attributes:
+        dataset_dir(str): directory of the sequence
+        image_format(str)
+        shards(list): file names of the shards
+    """
+
+    def __init__(self, dataset_dir: str) -> None:
+        self.dataset_dir = dataset_dir
+        with open(os.path.join(dataset_dir, SHARDS_INDEX), 'r') as file:
+            index = json.load(file)
+        self.image_format = index["image_format"]
+        self.shards = index["shards"]
+        self._frames = {f[0]: f[1:] for f in index["frames"]}
+        self._files = {}
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    def __getitem__(self, index: int) -> Tuple[np.ndarray, str]:
+        return self.read_image(index), self.read_annotations(index)
+
+    def __iter__(self):
+        for index in sorted(self._frames):
+            yield self[index]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _read(self, shard: int, offset: int, size: int) -> bytes:
+        if shard not in self._files:
+            self._files[shard] = open(os.path.join(self.dataset_dir, self.shards[shard]), 'rb')
+        file = self._files[shard]
+        file.seek(offset)
+        return file.read(size)
+
+    def read_bytes(self, index: int) -> bytes:
+        """Encoded image of frame #index."""
+        shard, offset, size, _, _ = self._frames[index]
+        return self._read(shard, offset, size)
+
+    def read_image(self, index: int) -> np.ndarray:
+        return cv2.imdecode(np.frombuffer(self.read_bytes(index), dtype=np.uint8), cv2.IMREAD_COLOR)
+
+    def read_annotations(self, index: int) -> str:
+        """Yolo annotation lines of frame #index."""
+        shard, _, _, offset, size = self._frames[index]
+        return self._read(shard, offset, size).decode()
+
+    def close(self) -> None:
+        for file in self._files.values():
+            file.close()
+        self._files.clear()
@@ -0,0 +1,92 @@
+import os
+import json
+import time
+import cProfile
+import tracemalloc
+from contextlib import contextmanager
+from src.FrameWriter import write_atomic
+
+PROFILE_FILE = "profile.json"
+CPROFILE_FILE = "profile.prof"
+
+
+class StageProfiler:
+    """Accumulate wall time, cpu time, frames and peak traced memory of named stages.
+
+    A stage can be entered many times, e.g. once per frame, its measures add up.
+    CPU time is the one of the whole process, so work of background threads (frame
+    writers, video decode) is counted in the stage open meanwhile.
+
+    Attributes:
+        trace_memory(bool): trace allocations with tracemalloc, which slows down python code
+        cprofile(bool): also run cProfile on the calling thread until save()
+        stages(dict): measures of each stage by name, in order of first use
+    """
+
+    def __init__(self, trace_memory: bool = False, cprofile: bool = False) -> None:
+        self.trace_memory = trace_memory
+        self.cprofile = cprofile
+        self.stages = {}
+        self._start_wall = time.perf_counter()
+        self._start_cpu = time.process_time()
+        self._own_tracing = trace_memory and not tracemalloc.is_tracing()
+        if self._own_tracing:
+            tracemalloc.start()
+        self._cprofile = None
+        if cprofile:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    def _reset_peak(self) -> None:
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        elif self._own_tracing:
+            # python < 3.9, restarting the tracing also resets the peak
+            tracemalloc.stop()
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name: str, frames: int = 0):
+        """Measure the enclosed block as part of stage name.
+
+        Args:
+            name(str): stage name
+            frames(int): frames processed by the block
+
+        Yields:
+            stage(dict): measures of the stage, frames can be added when known only at the end
+        """
+        stage = self.stages.setdefault(name, {"wall": 0.0, "cpu": 0.0, "calls": 0, "frames": 0, "peak_mb": None})
+        if self.trace_memory:
+            self._reset_peak()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield stage
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            stage["wall"] += wall
+            stage["cpu"] += cpu
+            stage["calls"] += 1
+            stage["frames"] += frames
+            if self.trace_memory:
+                peak_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+                stage["peak_mb"] = peak_mb if stage["peak_mb"] is None else max(stage["peak_mb"], peak_mb)
+
+    def report(self) -> dict:
+        """Measures of all stages, with frames/s and the total wall and cpu time since creation."""
+        stages = {}
+        for name, stage in self.stages.items():
+            stages[name] = dict(stage, fps=stage["frames"] / stage["wall"] if stage["frames"] > 0 and stage["wall"] > 0 else None)
+        return {"stages": stages, "wall": time.perf_counter() - self._start_wall,
+                "cpu": time.process_time() - self._start_cpu}
+
+    def save(self, out_dir: str) -> None:
+        """Write the PROFILE_FILE report in out_dir, and the CPROFILE_FILE stats with cprofile."""
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(os.path.join(out_dir, CPROFILE_FILE))
+            self._cprofile = None
+        if self._own_tracing:
+            tracemalloc.stop()
+            self._own_tracing = False
+        write_atomic(os.path.join(out_dir, PROFILE_FILE), json.dumps(self.report(), indent=2).encode())
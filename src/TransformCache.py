@@ -0,0 +1,142 @@
+import numpy as np
+import cv2
+from collections import OrderedDict
+from typing import Tuple
+
+# quantization of the per-frame scale and angle (degrees) of a patch, a smooth zoom
+# or rotation reuses each transformed patch for several frames
+SCALE_STEP = 0.01
+ANGLE_STEP = 1.0
+
+
+def quantize_transform(scale, angle) -> Tuple[np.ndarray, np.ndarray]:
+    """Round scales to SCALE_STEP and angles to ANGLE_STEP in [0, 360).
+
+    Args:
+        scale(float or ndarray): scale factors, at least SCALE_STEP
+        angle(float or ndarray): counterclockwise rotations in degrees
+
+    Returns:
+        scale(ndarray): quantized scales
+        angle(ndarray): quantized angles
+    """
+    scale = np.maximum(np.round(np.asarray(scale, dtype=float) / SCALE_STEP), 1) * SCALE_STEP
+    angle = np.mod(np.round(np.asarray(angle, dtype=float) / ANGLE_STEP), round(360 / ANGLE_STEP)) * ANGLE_STEP
+    # e.g. 1.1 instead of 110 * 0.01 = 1.1000000000000001
+    return np.round(scale, 9), np.round(angle, 9)
+
+
+def _scaled_size(h: int, w: int, scale: float) -> Tuple[int, int]:
+    return max(1, int(round(h * scale))), max(1, int(round(w * scale)))
+
+
+def _rotated_size(h: int, w: int, angle: float) -> Tuple[int, int]:
+    # rounded first so that e.g. cos(90) ~ 6e-17 does not add a pixel
+    cos, sin = abs(np.cos(np.radians(angle))), abs(np.sin(np.radians(angle)))
+    return int(np.ceil(round(h * cos + w * sin, 6))), int(np.ceil(round(w * cos + h * sin, 6)))
+
+
+def transformed_shape(shape: tuple, scale: float, angle: float) -> Tuple[int, int]:
+    """(h, w) of a patch of shape (h, w, ...) transformed by transform_patch."""
+    h, w = _scaled_size(shape[0], shape[1], scale)
+    if angle == 0:
+        return h, w
+    return _rotated_size(h, w, angle)
+
+
+def transform_patch(patch: np.ndarray, mask: np.ndarray, scale: float, angle: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Scale then rotate a patch and its mask around their center.
+
+    The rotated patch is padded to its bounding rectangle with transparent pixels,
+    so the patch extent and bounding box follow the rotation. Premultiplied BGRA
+    patches are interpolated as they are, which is correct for premultiplied color.
+
+    Args:
+        patch(ndarray): (h, w, 3) or premultiplied (h, w, 4) uint8 patch
+        mask(ndarray): (h, w) bool opacity mask of the patch
+        scale(float): scale factor
+        angle(float): counterclockwise rotation in degrees
+
+    Returns:
+        patch(ndarray): transformed patch of shape transformed_shape(patch.shape, scale, angle)
+        mask(ndarray): transformed mask
+    """
+    h, w = _scaled_size(patch.shape[0], patch.shape[1], scale)
+    mask = mask.astype(np.uint8)
+    if (h, w) != patch.shape[:2]:
+        interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+        patch = cv2.resize(patch, dsize=(w, h), interpolation=interpolation)
+        mask = cv2.resize(mask, dsize=(w, h), interpolation=cv2.INTER_NEAREST)
+    if angle != 0:
+        out_h, out_w = _rotated_size(h, w, angle)
+        m = cv2.getRotationMatrix2D(((w - 1) / 2, (h - 1) / 2), angle, 1.0)
+        m[0, 2] += (out_w - w) / 2
+        m[1, 2] += (out_h - h) / 2
+        patch = cv2.warpAffine(patch, m, (out_w, out_h), flags=cv2.INTER_LINEAR,
+                               borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+        mask = cv2.warpAffine(mask, m, (out_w, out_h), flags=cv2.INTER_NEAREST,
+                              borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+    return patch, mask != 0
+
+
+def _nbytes(entry) -> int:
+    if hasattr(entry, "nbytes"):
+        return entry.nbytes
+    return sum(array.nbytes for array in entry)
+
+
+class TransformCache:
+    """LRU cache of the scaled and rotated versions of one patch.
+
+    Entries are keyed by the quantized (scale, angle), see quantize_transform, and
+    built once from transform_patch. The untransformed patch is always cached.
+
+    Attributes:
+        patch(ndarray): patch as loaded
+        mask(ndarray): opacity mask of the patch
+        build(callable): build(patch, mask) -> cached entry, e.g. a Sprite, (patch, mask) by default
+        max_bytes(int): size limit of the cached entries (their nbytes, or the sum of their arrays)
+        hits(int)
+        misses(int)
+    """
+
+    def __init__(self, patch: np.ndarray, mask: np.ndarray, build=None, max_bytes: int = 64 * 1024 ** 2) -> None:
+        self.patch = patch
+        self.mask = mask
+        self.build = (lambda p, m: (p, m)) if build is None else build
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._identity = self.build(patch, mask)
+        self._entries = OrderedDict()
+        self._nbytes = 0
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, scale: float, angle: float):
+        """Get the entry of the patch transformed by the quantized (scale, angle)."""
+        scale, angle = quantize_transform(scale, angle)
+        key = (int(round(scale / SCALE_STEP)), int(round(angle / ANGLE_STEP)))
+        if key == (round(1 / SCALE_STEP), 0):
+            return self._identity
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+        self.misses += 1
+        entry = self.build(*transform_patch(self.patch, self.mask, float(scale), float(angle)))
+        size = _nbytes(entry)
+        if size > self.max_bytes:
+            return entry
+        self._entries[key] = entry
+        self._nbytes += size
+        while self._nbytes > self.max_bytes:
+            _, old = self._entries.popitem(last=False)
+            self._nbytes -= _nbytes(old)
+        return entry
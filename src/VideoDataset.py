@@ -0,0 +1,71 @@
+import os
+import numpy as np
+import cv2
+from typing import Tuple
+from src.AnnotationStore import AnnotationStore, ANNOTATIONS_FILE
+from src.simulator import VIDEO_FILE
+
+
+class VideoDataset:
+    """Loader pairing the decoded frames of a sequence video with their boxes.
+
+    Reads sequences written with the 'video' output format: the video and the
+    annotations.npz store, whose rows are keyed by frame index.
+
+    Attributes:
+        sequence_dir(str): seqN directory
+        video_path(str): video of the sequence, seqN/video.mp4 by default
+        store(AnnotationStore)
+    """
+
+    def __init__(self, sequence_dir: str, video_path: str = None) -> None:
+        self.sequence_dir = sequence_dir
+        self.video_path = os.path.join(sequence_dir, VIDEO_FILE) if video_path is None else video_path
+        self.store = AnnotationStore.load(os.path.join(sequence_dir, ANNOTATIONS_FILE))
+
+    def __len__(self) -> int:
+        return self.store.num_frames
+
+    def boxes(self, index: int, visible_only: bool = False) -> np.ndarray:
+        """ANNOTATION_DTYPE rows of frame #index.
+
+        Objects out of the frame, or dropped as not visible enough (see LabelBuffer), have
+        a row with box -1 and visible 0, unless visible_only is set.
+        """
+        boxes = self.store.boxes[self.store.frame_slice(index)]
+        if visible_only:
+            boxes = boxes[boxes['visible'] > 0]
+        return boxes
+
+    def yolo(self, index: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Labels and (n, 4) yolo [cx, cy, w, h] boxes of the visible objects of frame #index, as the other output formats."""
+        boxes = self.boxes(index, visible_only=True)
+        return boxes['label'], self.store.to_yolo(boxes)
+
+    def __iter__(self):
+        """Decode the video sequentially, yielding (frame, boxes) of each frame."""
+        cap = cv2.VideoCapture(self.video_path)
+        if not cap.isOpened():
+            raise IOError("Unable to open video {}".format(self.video_path))
+        try:
+            for index in range(len(self)):
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                yield frame, self.boxes(index)
+        finally:
+            cap.release()
+
+    def __getitem__(self, index: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Seek and decode frame #index, with its boxes."""
+        if index < 0 or index >= len(self):
+            raise IndexError(index)
+        cap = cv2.VideoCapture(self.video_path)
+        try:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+            ret, frame = cap.read()
+        finally:
+            cap.release()
+        if not ret:
+            raise IOError("Unable to read frame {} of {}".format(index, self.video_path))
+        return frame, self.boxes(index)
@@ -4,11 +4,24 @@ import logging
 import numpy as np
 from typing import Tuple
 from src.MovementType import MovementType
-from src.motion_law import urm, uarm, trapezoidal_profile
+from src.motion_law import urm_array, uarm_array, trapezoidal_profile_array
+from src.TransformCache import quantize_transform, transformed_shape
 
 __location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
 sys.path.insert(0, __location__)
 
+# per-frame placement of a patch, slices are [row_i, row_f, col_i, col_f] and
+# bbox is [top, left, bottom, right] (all -1 when the patch is out of frame),
+# scale and angle are the quantized transform of the patch (see TransformCache)
+TRACK_DTYPE = np.dtype([
+    ('center', np.float64, (2,)),
+    ('dst', np.int32, (4,)),
+    ('src', np.int32, (4,)),
+    ('bbox', np.int32, (4,)),
+    ('scale', np.float64),
+    ('angle', np.float64),
+])
+
 
 class Evolver:
     """Evolver to implement custom video with patch applied.
@@ -19,6 +32,8 @@ class Evolver:
         origin(ndarray)
         patch(np.ndarray)
         fps(int)
+        scale(float): current scale of the patch
+        angle(float): current counterclockwise rotation of the patch, in degrees
     """
 
     def __init__(self, frame_w: int, frame_h: int, origin_w: int, origin_h: int, patch: np.ndarray, fps: int) -> None:
@@ -28,13 +43,15 @@ class Evolver:
         self.origin = np.array([origin_h, origin_w], dtype=float)
         self.patch = patch
         self.fps = fps
+        self.scale = 1.0
+        self.angle = 0.0
 
         # internal states
         self.v = 1
         self.step = float(1 / self.fps)
 
         # output
-        self.frames = []
+        self.tracks = []
         self.gth = []
 
     def update_origin(self, origin_w: int, origin_h: int) -> None:
@@ -45,28 +62,35 @@ class Evolver:
 
     def reset(self) -> None:
         self.v = 1
-        self.frames.clear()
+        self.tracks.clear()
         self.gth.clear()
 
-    def compute_evolutions(self, route: list) -> Tuple[list, list]:
+    def compute_evolutions(self, route: list) -> Tuple[np.ndarray, list]:
         """Compute evolutions for each steps in route list.
 
+        Steps are [d_w, d_h, command, time_ms], optionally followed by the target
+        scale and angle of the patch, which are reached at the end of the step with
+        the same motion law as the position. Without them the current ones are kept.
+
         Args:
             route(list): list of steps for patch applied
 
         Returns:
-            frames(list): list of frames to animate the path
-            gth(list): list of path center coord in the frame
+            track(ndarray): TRACK_DTYPE placement of the patch for each frame
+            gth(list): list of patch coord in the frame for each frame
         """
-        for (d_w, d_h, command, time_ms) in route:
+        for step in route:
+            d_w, d_h, command, time_ms = step[:4]
+            scale = float(step[4]) if len(step) > 4 else self.scale
+            angle = float(step[5]) if len(step) > 5 else self.angle
             # compute kinematic data
             dest = np.array([d_h, d_w], dtype=float)
             t_f = time_ms / 1000
             num_frames = int(self.fps * t_f)
 
             # initializations
-            x = np.zeros(2)
-            empty_frame = np.zeros((self.frame_h, self.frame_w, 3))
+            t = np.arange(num_frames) * self.step
+            x = np.zeros((num_frames, 2))
 
             # velocity and acceleratione to compute motion laws
             vc = np.sign((dest - self.origin) / t_f)
@@ -74,69 +98,134 @@ class Evolver:
             self.v = (dest - self.origin) / t_f
             acc = 2 * (dest - self.origin - self.v * t_f) / (t_f ** 2)
 
-            # compute new x-point with selected motion law for each frame
-            for i in range(num_frames):
-                t = i * self.step
-                if command.value == MovementType.urm.value:
-                    x[0] = urm(self.origin[0], self.v[0], t)
-                    x[1] = urm(self.origin[1], self.v[1], t)
-                elif command.value == MovementType.uarm.value:
-                    x[0] = uarm(self.origin[0], self.v[0], acc[0], t)
-                    x[1] = uarm(self.origin[1], self.v[1], acc[1], t)
-                elif command.value == MovementType.trap.value:
-                    _, x[0] = trapezoidal_profile(self.origin[0], dest[0], t_f, vc[0], t)
-                    _, x[1] = trapezoidal_profile(self.origin[1], dest[1], t_f, vc[1], t)
-                else:
-                    logging.error("Wrong type!")
-                frame, gth = self.apply_patch(empty_frame, self.patch, x)
-                self.frames.append(frame)
-                self.gth.append(gth)
+            # compute x-points of all frames with selected motion law
+            if command.value == MovementType.urm.value:
+                for k in range(2):
+                    x[:, k] = urm_array(self.origin[k], self.v[k], t)
+            elif command.value == MovementType.uarm.value:
+                for k in range(2):
+                    x[:, k] = uarm_array(self.origin[k], self.v[k], acc[k], t)
+            elif command.value == MovementType.trap.value:
+                for k in range(2):
+                    _, x[:, k] = trapezoidal_profile_array(self.origin[k], dest[k], t_f, vc[k], t)
+            else:
+                logging.error("Wrong type!")
+
+            s, a = quantize_transform(self.interpolate(command, self.scale, scale, t_f, t),
+                                      self.interpolate(command, self.angle, angle, t_f, t))
+            if np.all(s == 1) and np.all(a == 0):
+                track = self.compute_track(self.frame_h, self.frame_w, self.patch.shape, x)
+            else:
+                # extent of the transformed patch, computed once per distinct transform
+                pairs, inverse = np.unique(np.stack([s, a], axis=1), axis=0, return_inverse=True)
+                shapes = np.array([transformed_shape(self.patch.shape, *pair) for pair in pairs]).reshape(-1, 2)
+                track = self.compute_track(self.frame_h, self.frame_w, shapes[inverse.reshape(-1)], x)
+            track['scale'] = s
+            track['angle'] = a
+            self.tracks.append(track)
+            self.gth.extend(track['bbox'].tolist())
             self.origin = dest
-        return self.frames, self.gth
+            self.scale, self.angle = scale, angle
+        if len(self.tracks) == 0:
+            return np.zeros(0, dtype=TRACK_DTYPE), self.gth
+        return np.concatenate(self.tracks), self.gth
+
+    @staticmethod
+    def interpolate(command: MovementType, x_i: float, x_f: float, t_f: float, t: np.ndarray) -> np.ndarray:
+        """Interpolate a scalar (scale, angle) from x_i to x_f with the motion law of command.
+
+        Constant and accelerated steps are linear, as their positions. Unlike positions,
+        the trapezoidal profile uses the mean of the allowed cruise velocities instead
+        of a random one, so the random streams are unchanged.
+
+        Args:
+            command(MovementType)
+            x_i(float): value at the start of the step
+            x_f(float): value at the end of the step
+            t_f(float): step duration
+            t(ndarray): time vector
+
+        Returns:
+            x(ndarray): value for each time in t
+        """
+        if x_i == x_f:
+            return np.full(t.shape, x_i, dtype=float)
+        v = (x_f - x_i) / t_f
+        if command.value == MovementType.trap.value:
+            return trapezoidal_profile_array(x_i, x_f, t_f, 1.5 * v, t)[1]
+        return urm_array(x_i, v, t)
+
+    @staticmethod
+    def compute_track(frame_h: int, frame_w: int, patch_shape, x: np.ndarray) -> np.ndarray:
+        """Compute where a patch lands in the frame for each center in x.
+
+        Args:
+            frame_h(int)
+            frame_w(int)
+            patch_shape(tuple or ndarray): (h, w, ...) shape of the patch, or (n, 2) (h, w) of
+                the patch in each frame when it is transformed
+            x(ndarray): (n, 2) centers of patch in frame reference
+
+        Returns:
+            track(ndarray): n TRACK_DTYPE elements with frame/patch slices and bbox
+        """
+        x = np.asarray(x, dtype=float).reshape(-1, 2)
+        x_px = np.floor(x).astype(np.int64)
+        if isinstance(patch_shape, np.ndarray) and patch_shape.ndim == 2:
+            p_h, p_w = patch_shape[:, 0], patch_shape[:, 1]
+        else:
+            p_h, p_w = patch_shape[0], patch_shape[1]
+
+        # compute coord, even patches have no central pixel
+        r_i = x_px[:, 0] - p_h // 2
+        r_f = x_px[:, 0] + p_h // 2 + (p_h % 2)
+        c_i = x_px[:, 1] - p_w // 2
+        c_f = x_px[:, 1] + p_w // 2 + (p_w % 2)
+
+        # fix frame indices to handle edges
+        fr_i = np.maximum(0, r_i)
+        fr_f = np.minimum(frame_h, r_f)
+        fc_i = np.maximum(0, c_i)
+        fc_f = np.minimum(frame_w, c_f)
+
+        track = np.zeros(len(x), dtype=TRACK_DTYPE)
+        track['center'] = x
+        track['dst'] = np.stack([fr_i, fr_f, fc_i, fc_f], axis=1)
+        track['src'] = np.stack([fr_i - r_i, p_h - (r_f - fr_f), fc_i - c_i, p_w - (c_f - fc_f)], axis=1)
+        track['bbox'] = np.stack([fr_i, fc_i, fr_f - 1, fc_f - 1], axis=1)
+        track['scale'] = 1
+
+        # out of border
+        out = (r_i >= frame_h) | (r_f <= 0) | (c_i >= frame_w) | (c_f <= 0)
+        track['dst'][out] = 0
+        track['src'][out] = 0
+        track['bbox'][out] = -1
+        return track
 
     @staticmethod
     def apply_patch(frame: np.ndarray, patch: np.ndarray, x: np.ndarray) -> Tuple[np.ndarray, list]:
         """To Apply patch in desired frame.
 
+        The whole patch rectangle is copied, so it only handles opaque 3 channel patches.
+        Patches loaded with alpha (premultiplied BGRA) are composited by simulator.Sprite.
+
         Args:
             frame(ndarray)
-            patch(ndarray)
+            patch(ndarray): opaque (h, w, 3) patch
             x(ndarray): center of patch in frame reference
 
         Returns:
             frame with applied patch and the coord where It is applied
             [top_left_x, top_left_y, bottom_right_x, bottom_right_y]
         """
-        # compute coord
-        x = np.floor(x)
-        r_i = int(x[0] - int(patch.shape[0] / 2))
-        r_f = int(x[0] + int(patch.shape[0] / 2) + 1)
-        c_i = int(x[1] - int(patch.shape[1] / 2))
-        c_f = int(x[1] + int(patch.shape[1] / 2) + 1)
-
-        # check for even case for patch
-        if patch.shape[0] % 2 == 0:
-            r_f = int(x[0] + int(patch.shape[0] / 2))
-        if patch.shape[1] % 2 == 0:
-            c_f = int(x[1] + int(patch.shape[1] / 2))
-
-        # out of border
-        if r_i >= frame.shape[0] or r_f <= 0 or c_i >= frame.shape[1] or c_f <= 0:
+        assert patch.ndim == 3 and patch.shape[2] == 3, "apply_patch needs an opaque 3 channel patch, see simulator.Sprite"
+        step = Evolver.compute_track(frame.shape[0], frame.shape[1], patch.shape, x)[0]
+        if step['bbox'][0] < 0:
             return frame, [-1, -1, -1, -1]
-
-        # fix frame indices to handle edges
-        fr_i = max(0, r_i)
-        fr_f = min(frame.shape[0], r_f)
-        fc_i = max(0, c_i)
-        fc_f = min(frame.shape[1], c_f)
-
-        # fix path indices to handle edges
-        pc_f = patch.shape[1] - (c_f - fc_f)
-        pc_i = fc_i - c_i
-        pr_f = patch.shape[0] - (r_f - fr_f)
-        pr_i = fr_i - r_i
+        fr_i, fr_f, fc_i, fc_f = step['dst']
+        pr_i, pr_f, pc_i, pc_f = step['src']
 
         # patch
         frame = frame.copy()
         frame[fr_i:fr_f, fc_i:fc_f, :] = patch[pr_i:pr_f, pc_i:pc_f, :]
-        return frame, [fr_i, fc_i, fr_f - 1, fc_f - 1]
+        return frame, step['bbox'].tolist()
@@ -1,3 +1,4 @@
+import numpy as np
 from typing import Tuple
 
 
@@ -69,3 +70,70 @@ def trapezoidal_profile(x_i: float, x_f: float, t_f: float, v_c: float, t: float
         return True, x_i + acc * tc_1 * t - 0.5 * acc * tc_1 ** 2
     elif t > tc_2:
         return True, x_f - 0.5 * acc * (t_f - t) ** 2
+
+
+def urm_array(x_0: float, v_m: float, t: np.ndarray) -> np.ndarray:
+    """Compute Uniform Rectilinear Motion (U.R.M) law over a time vector.
+
+    Args:
+        x_0(float): initial point
+        v_m(float): constant velocity
+        t(ndarray): time vector
+
+    Returns:
+        x(ndarray): $$ x_0 + v_m * t $$ for each time in t
+    """
+    return x_0 + v_m * t
+
+
+def uarm_array(x_0: float, v_0: float, a_m: float, t: np.ndarray) -> np.ndarray:
+    """Compute Uniformly Accelerated Rectilinear Motion (U.A.R.M) law over a time vector.
+
+    Squares are computed with np.float_power so that each element is bit for bit
+    equal to the scalar uarm (numpy `**` rounds differently from libm pow).
+
+    Args:
+        x_0(float): initial point
+        v_0(float): initial velocity
+        a_m(float): constant acceleration
+        t(ndarray): time vector
+
+    Returns:
+        x(ndarray): $$ x_0 + v_0 * t + 0.5 * a_m * (t ** 2) $$ for each time in t
+    """
+    return x_0 + v_0 * t + 0.5 * a_m * np.float_power(t, 2)
+
+
+def trapezoidal_profile_array(x_i: float, x_f: float, t_f: float, v_c: float, t: np.ndarray) -> Tuple[bool, np.ndarray]:
+    """Compute motion law with trapezoidal profile for velocity over a time vector.
+
+    Same law and cruise velocity condition of trapezoidal_profile.
+
+    Args:
+        x_i(float): initial position
+        x_f(float): final position
+        t_f(float): final time (duration)
+        v_c(float): cruise velocity
+        t(ndarray): time vector
+
+    Returns:
+        flag(bool): cruise velocity condition check
+        x(ndarray): motion law for each time in t
+    """
+    if abs(v_c) <= abs(x_f - x_i) / t_f or abs(v_c) > 2 * abs(x_f - x_i) / t_f:
+        return False, np.full(t.shape, x_i, dtype=float)
+
+    t_c = (x_i - x_f + v_c * t_f) / v_c
+    acc = (v_c ** 2) / (x_i - x_f + v_c * t_f)
+
+    tc_1 = t_c
+    tc_2 = t_f - t_c
+
+    x = np.empty(t.shape, dtype=float)
+    acc_phase = t <= tc_1
+    dec_phase = ~acc_phase & (t > tc_2)
+    cruise_phase = ~(acc_phase | dec_phase)
+    x[acc_phase] = x_i + 0.5 * acc * np.float_power(t[acc_phase], 2)
+    x[cruise_phase] = x_i + acc * tc_1 * t[cruise_phase] - 0.5 * acc * tc_1 ** 2
+    x[dec_phase] = x_f - 0.5 * acc * np.float_power(t_f - t[dec_phase], 2)
+    return True, x
@@ -3,12 +3,63 @@ import os
 import sys
 import cv2
 import logging
+from contextlib import nullcontext
 from tqdm import tqdm
 
 __location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
 sys.path.insert(0, __location__)
 from evolver import Evolver
 from BackgroundIterator import BackgroundIterator
+from FrameWriter import FrameWriter
+from ShardWriter import ShardWriter
+from AnnotationStore import AnnotationStore, ANNOTATIONS_FILE
+from StageProfiler import StageProfiler
+from RenderCache import RenderCache
+from TransformCache import TransformCache
+from LabelBuffer import LabelBuffer
+
+# 'video' writes no frame images, only the video and the annotations of the sequence
+OUTPUT_FORMATS = ['files', 'shards', 'video']
+VIDEO_FILE = "video.mp4"
+
+
+def patch_mask(patch: np.ndarray) -> np.ndarray:
+    """Compute opacity mask of a patch, black pixels are transparent.
+
+    Premultiplied BGRA patches are black where fully transparent, so their mask
+    is alpha != 0.
+
+    Args:
+        patch(ndarray): (h, w, 3) patch or (h, w, 4) premultiplied BGRA patch
+
+    Returns:
+        mask(ndarray): (h, w) bool mask of the pixels to paste
+    """
+    return np.sum(patch, axis=2) != 0
+
+
+def div255(x: np.ndarray) -> np.ndarray:
+    """Divide in place uint16 values up to 255 * 255 by 255, rounding to nearest."""
+    x += 128
+    x += x >> 8
+    x >>= 8
+    return x
+
+
+def premultiply_alpha(patch: np.ndarray) -> np.ndarray:
+    """Premultiply the color of a uint8 BGRA patch by its alpha.
+
+    Args:
+        patch(ndarray): (h, w, 4) uint8 straight BGRA patch
+
+    Returns:
+        patch(ndarray): (h, w, 4) uint8 premultiplied BGRA patch, black where fully transparent
+    """
+    out = patch.copy()
+    color = patch[:, :, :3].astype(np.uint16)
+    color *= patch[:, :, 3:]
+    out[:, :, :3] = div255(color)
+    return out
 
 
 class Instruction:
@@ -16,51 +67,211 @@ class Instruction:
     origin_x: int = 0
     origin_y: int = 0
     patch: np.ndarray = None
+    mask: np.ndarray = None
     route: list = None
 
-    def __init__(self, label: int, patch: np.ndarray, origin_x: int, origin_y: int, route: list):
+    def __init__(self, label: int, patch: np.ndarray, origin_x: int, origin_y: int, route: list, mask: np.ndarray = None):
         self.label = label
         self.patch = patch
+        self.mask = patch_mask(patch) if mask is None else mask
         self.route = route
         self.origin_x = origin_x
         self.origin_y = origin_y
 
 
+class Sprite:
+    """Patch prepared to be composited over frames.
+
+    Fully opaque pixels are copied with a single masked copy. Only the pixels
+    with partial alpha, the antialiased edge of a premultiplied BGRA patch, are
+    alpha blended with integer arithmetic: dst = color + dst * (255 - alpha) / 255.
+    Patches without alpha are opaque where mask is set.
+
+    Attributes:
+        color(ndarray): (h, w, 3) premultiplied color
+        opaque(ndarray): (h, w) bool mask of the fully opaque pixels
+        edge_rows(ndarray): rows of the partially transparent pixels
+        edge_cols(ndarray): cols of the partially transparent pixels
+        edge_color(ndarray): (n, 3) uint16 color of the partially transparent pixels
+        edge_inv_alpha(ndarray): (n, 1) uint16 255 - alpha of the partially transparent pixels
+        coverage(ndarray): (h, w) bool mask of the pixels drawn, opaque or not, built on first use
+    """
+
+    def __init__(self, patch: np.ndarray, mask: np.ndarray = None):
+        if patch.shape[2] == 4:
+            self.color = patch[:, :, :3]
+            alpha = patch[:, :, 3]
+            self.opaque = alpha == 255
+            self.edge_rows, self.edge_cols = np.nonzero((alpha != 0) & (alpha != 255))
+            self.edge_color = self.color[self.edge_rows, self.edge_cols].astype(np.uint16)
+            self.edge_inv_alpha = (255 - alpha[self.edge_rows, self.edge_cols]).astype(np.uint16)[:, None]
+        else:
+            self.color = patch
+            self.opaque = patch_mask(patch) if mask is None else mask
+            self.edge_rows = self.edge_cols = np.zeros(0, dtype=np.intp)
+            self.edge_color = np.zeros((0, 3), dtype=np.uint16)
+            self.edge_inv_alpha = np.zeros((0, 1), dtype=np.uint16)
+        self.color = np.ascontiguousarray(self.color)
+        # a mask of the same shape as the copied pixels is much faster than a broadcast one
+        self._opaque3 = np.repeat(self.opaque[:, :, None], 3, axis=2)
+        self._coverage = None
+        self._coverage_table = None
+        self._coverage_summary = None
+
+    @property
+    def nbytes(self) -> int:
+        arrays = [self.color, self.opaque, self._opaque3, self.edge_rows, self.edge_cols, self.edge_color,
+                  self.edge_inv_alpha, self._coverage, self._coverage_table]
+        return sum(a.nbytes for a in arrays if a is not None)
+
+    @property
+    def coverage(self) -> np.ndarray:
+        if self._coverage is None:
+            self._coverage = self.opaque.copy()
+            self._coverage[self.edge_rows, self.edge_cols] = True
+        return self._coverage
+
+    def coverage_table(self) -> np.ndarray:
+        """(h + 1, w + 1) summed-area table of coverage, the drawn pixels of [r_i:r_f, c_i:c_f] are
+        t[r_f, c_f] - t[r_i, c_f] - t[r_f, c_i] + t[r_i, c_i]."""
+        if self._coverage_table is None:
+            h, w = self.opaque.shape
+            self._coverage_table = np.zeros((h + 1, w + 1), dtype=np.int64)
+            np.cumsum(np.cumsum(self.coverage, axis=0), axis=1, out=self._coverage_table[1:, 1:])
+        return self._coverage_table
+
+    def coverage_summary(self) -> tuple:
+        """(h, w, drawn pixels, top, left, bottom, right) of coverage, the box is -1 if nothing is drawn."""
+        if self._coverage_summary is None:
+            h, w = self.opaque.shape
+            rows, cols = np.flatnonzero(self.coverage.any(axis=1)), np.flatnonzero(self.coverage.any(axis=0))
+            box = (-1,) * 4 if len(rows) == 0 else (rows[0], cols[0], rows[-1], cols[-1])
+            self._coverage_summary = tuple(int(v) for v in (h, w, np.count_nonzero(self.coverage)) + box)
+        return self._coverage_summary
+
+    def paste(self, frame: np.ndarray, step: np.void) -> None:
+        """Composite in place the sprite where a track step (TRACK_DTYPE element) places it."""
+        if step['bbox'][0] < 0:
+            return
+        fr_i, fr_f, fc_i, fc_f = step['dst']
+        pr_i, pr_f, pc_i, pc_f = step['src']
+        np.copyto(frame[fr_i:fr_f, fc_i:fc_f, :], self.color[pr_i:pr_f, pc_i:pc_f, :],
+                  casting='unsafe', where=self._opaque3[pr_i:pr_f, pc_i:pc_f, :])
+        if len(self.edge_rows) == 0:
+            return
+        rows, cols, color, inv_alpha = self.edge_rows, self.edge_cols, self.edge_color, self.edge_inv_alpha
+        if pr_i > 0 or pc_i > 0 or pr_f < self.opaque.shape[0] or pc_f < self.opaque.shape[1]:
+            # patch clipped by the frame border
+            inside = (rows >= pr_i) & (rows < pr_f) & (cols >= pc_i) & (cols < pc_f)
+            rows, cols, color, inv_alpha = rows[inside], cols[inside], color[inside], inv_alpha[inside]
+        rows = rows + (fr_i - pr_i)
+        cols = cols + (fc_i - pc_i)
+        dst = frame[rows, cols].astype(np.uint16)
+        dst *= inv_alpha
+        dst = div255(dst)
+        dst += color
+        frame[rows, cols] = dst
+
+
+def iter_frames(levels: list, background: BackgroundIterator, profiler: StageProfiler = None, labels: LabelBuffer = None):
+    """Compose objects over the background one frame at a time.
+
+    Args:
+        levels(list): (patch, mask, track) of each object, later levels are painted on top.
+            Premultiplied BGRA patches are alpha blended (see Sprite), scaled or rotated
+            patches come from a TransformCache of the object
+        background(BackgroundIterator)
+        profiler(StageProfiler): measures the 'background', 'aggregate' and 'visibility' stages if given
+        labels(LabelBuffer): if given, the annotations of each frame are made occlusion aware
+            (object_id is the level index) before the frame is yielded
+
+    Yields:
+        frame(ndarray): composed frame
+    """
+    stage = profiler.stage if profiler is not None else lambda name, frames=0: nullcontext()
+    sprites = []
+    for patch, mask, track in levels:
+        if np.any(track['scale'] != 1) or np.any(track['angle'] != 0):
+            sprites.append((None, TransformCache(patch, mask, build=Sprite), track))
+        else:
+            sprites.append((Sprite(patch, mask), None, track))
+    for frame_index in range(max([len(track) for _, _, track in levels])):
+        with stage("background", 1):
+            base_frame = next(background)
+        placed = []
+        painted = []
+        with stage("aggregate", 1):
+            for object_id, (sprite, transforms, track) in enumerate(sprites):
+                if frame_index < len(track):
+                    step = track[frame_index]
+                    if transforms is not None:
+                        sprite = transforms.get(step['scale'], step['angle'])
+                    sprite.paste(base_frame, step)
+                    if step['bbox'][0] >= 0:
+                        painted.append(step['dst'].tolist())
+                    if labels is not None:
+                        placed.append((object_id, sprite, step))
+            # a static background then only restores the patch rects
+            background.mark_dirty(painted)
+        if labels is not None:
+            with stage("visibility", 1):
+                labels.update(frame_index, placed)
+        yield base_frame
+
+
 def aggregate_frames(levels: list, background: BackgroundIterator) -> list:
-    frames_out = []
+    """Compose objects over the background.
+
+    Args:
+        levels(list): (patch, mask, track) of each object, later levels are painted on top
+        background(BackgroundIterator)
 
+    Returns:
+        frames_out(list): composed frames
+    """
     logging.info("Aggregating frames...")
-    for frame_index in tqdm(range(max([len(l) for l in levels]))):
-        base_frame = next(background)
-        for i in range(len(levels)):
-            if frame_index < len(levels[i]):
-                frame = levels[i][frame_index]
-                x, y = np.where(np.sum(frame, axis=2) != 0)
-                for i, j in zip(x, y):
-                    base_frame[i, j, :] = frame[i, j, :]
-        frames_out.append(base_frame)
-    return frames_out
+    num_frames = max([len(track) for _, _, track in levels])
+    background.reserve(num_frames)
+    return list(tqdm(iter_frames(levels, background), total=num_frames))
 
 
-def render_video(video_path:str, frames:list, fps:int):
+def open_video_writer(video_path: str, frame_size: tuple, fps: int) -> cv2.VideoWriter:
     if not video_path.endswith('.mp4'): video_path = video_path + '.mp4'
-    frameSize = frames[0].shape[1], frames[0].shape[0]
+    # VideoWriter truncates an existing file in place, which may be hard linked in a RenderCache entry
+    if os.path.lexists(video_path): os.remove(video_path)
     fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-    out = cv2.VideoWriter(video_path, fourcc, fps, frameSize)
+    return cv2.VideoWriter(video_path, fourcc, fps, frame_size)
+
+
+def render_video(video_path:str, frames:list, fps:int):
+    frameSize = frames[0].shape[1], frames[0].shape[0]
+    out = open_video_writer(video_path, frameSize, fps)
     logging.info("Rendering frames...")
     for frame in frames:
         out.write(frame.astype('uint8'))
     out.release()
 
 
-def build_datasets_dir(base_dir):
-    if not os.path.exists(base_dir): os.makedirs(base_dir)
-    i = 0
+def build_datasets_dir(base_dir, index: int = None):
+    """Create the seqN directory of a sequence inside base_dir.
+
+    Without index the first free seqN is taken. The directory is claimed with an
+    exclusive makedirs, so concurrent processes never get the same one.
+    """
+    os.makedirs(base_dir, exist_ok=True)
     def build(d, index): return os.path.join(d, "seq{}".format(index))
-    while os.path.exists(build(base_dir, i)): i += 1
-    dir = build(base_dir, i)
-    os.makedirs(dir)
-    return dir
+    if index is not None:
+        dir = build(base_dir, index)
+        os.makedirs(dir)
+        return dir
+    i = 0
+    while True:
+        dir = build(base_dir, i)
+        try:
+            os.makedirs(dir)
+            return dir
+        except FileExistsError:
+            i += 1
 
 
 def create_annotation(annotation_ul_dr, w:int, h:int):
@@ -69,28 +280,117 @@ def create_annotation(annotation_ul_dr, w:int, h:int):
     return [((dw+uw)/2.0)/w, ((dh+uh)/2.0)/h, (dw-uw)/w, (dh-uh)/h]
 
 
-def simulate(width: int, height: int, background: BackgroundIterator, instructions: list, dataset_dir: str, video_out: str=None, fps: int = 30):
-    dataset_dir = build_datasets_dir(dataset_dir)
+def simulate(width: int, height: int, background: BackgroundIterator, instructions: list, dataset_dir: str, video_out: str=None, fps: int = 30,
+             return_frames: bool = False, sequence_index: int = None, progress: bool = True, writer_options: dict = None,
+             profiler: StageProfiler = None, render_cache: RenderCache = None, cache_key: str = None):
+    """Evolve, compose and write a sequence one frame at a time.
+
+    Frames are streamed to the dataset writer and to the video, so memory does not
+    grow with the sequence duration. The time and memory of each stage are saved in
+    seqN/profile.json (see StageProfiler).
+
+    Args:
+        width(int): frame width
+        height(int): frame height
+        background(BackgroundIterator)
+        instructions(list): Instruction of each object
+        dataset_dir(str): base dir where the seqN directory is created
+        video_out(str): output video path if wanted, seqN/video.mp4 by default with 'video' output format
+        fps(int)
+        return_frames(bool): also collect and return all composed frames
+        sequence_index(int): N of the seqN directory, first free one if None
+        progress(bool): show progress bars of each stage
+        writer_options(dict): output_format, one of OUTPUT_FORMATS ('files' by default), and keyword
+            arguments of its writer, FrameWriter or ShardWriter (image_format, png_compression, ...)
+            min_visible and tight_boxes make the annotations occlusion aware (see LabelBuffer): objects
+            with a smaller visible fraction, or no visible pixel, are dropped, and boxes shrink to the
+            visible pixels. Dropped objects have no yolo line
+        profiler(StageProfiler): profiler of the sequence, to include stages run before like asset
+            loading, a timing only one if None
+        render_cache(RenderCache): cache to copy the sequence from if cache_key was already rendered,
+            and to store it in otherwise. Not used with return_frames
+        cache_key(str): render_key of the sequence, not cached if None
+
+    Returns:
+        frames_out(list): composed frames if return_frames is set, else None
+    """
+    profiler = StageProfiler() if profiler is None else profiler
+    dataset_dir = build_datasets_dir(dataset_dir, sequence_index)
     logging.info("Saving annotations in {}".format(dataset_dir))
+    writer_options = dict(writer_options or {})
+    output_format = writer_options.pop("output_format", "files")
+    min_visible = writer_options.pop("min_visible", None)
+    tight_boxes = writer_options.pop("tight_boxes", False)
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError("Unknown output format '{}', use {}".format(output_format, OUTPUT_FORMATS))
+    if output_format == "video" and video_out is None:
+        video_out = os.path.join(dataset_dir, VIDEO_FILE)
+    if video_out is not None and not video_out.endswith('.mp4'):
+        video_out = video_out + '.mp4'
+    use_cache = render_cache is not None and cache_key is not None and not return_frames
+    if use_cache:
+        with profiler.stage("cache"):
+            hit = render_cache.get(cache_key, dataset_dir, video_out)
+        if hit:
+            logging.info("Copied cached sequence {}".format(cache_key))
+            profiler.save(dataset_dir)
+            return None
     levels = []
-    ann_out = []
     logging.info("Evolving objects...")
-    for instruction in tqdm(instructions):
-        evolver = Evolver(width, height, instruction.origin_x, instruction.origin_y, instruction.patch, fps)
-        frames_out, annotations = evolver.compute_evolutions(instruction.route)
-        levels.append(frames_out)
-        ann_out.append([(instruction.label, ann) for ann in annotations])
-    frames_out = aggregate_frames(levels, background)
-    logging.info("Writing dataset in yolo annotations...")
-    for i in tqdm(range(len(frames_out))):
-        fn = os.path.join(dataset_dir, "{:010d}".format(i))
-        cv2.imwrite(fn + ".png", frames_out[i])
-        with open(fn + ".txt", 'w') as file:
-            for j in range(len(ann_out)):
-                if i < len(ann_out[j]):
-                    label, ann = ann_out[j][i]
-                    ann_yolo = create_annotation(ann, width, height)
-                    file.write("{} {} {} {} {}\n".format(label, ann_yolo[0], ann_yolo[1], ann_yolo[2], ann_yolo[3]))
-    if video_out is not None:
-        render_video(video_out, frames_out, fps)
+    for instruction in tqdm(instructions, disable=not progress):
+        with profiler.stage("evolve") as stage:
+            evolver = Evolver(width, height, instruction.origin_x, instruction.origin_y, instruction.patch, fps)
+            track, _ = evolver.compute_evolutions(instruction.route)
+            stage["frames"] += len(track)
+        levels.append((instruction.patch, instruction.mask, track))
+    num_frames = max([len(track) for _, _, track in levels])
+    store = AnnotationStore.from_tracks([(instruction.label, track) for instruction, (_, _, track) in zip(instructions, levels)],
+                                        width, height)
+    labels = None
+    if min_visible is not None or tight_boxes:
+        labels = LabelBuffer(store, min_visible or 0.0, tight_boxes)
+
+    if output_format == "video":
+        writer = None
+    elif output_format == "shards":
+        writer = ShardWriter(dataset_dir, **writer_options)
+    else:
+        writer = FrameWriter(dataset_dir, **writer_options)
+
+    frames_out = [] if return_frames else None
+    video_writer = None
+    logging.info("Aggregating frames and writing dataset in yolo annotations...")
+    try:
+        # frames queued to the writer must stay untouched while the next ones are composed
+        background.reserve(num_frames if return_frames else (1 if writer is None else writer.max_pending + 1))
+        frames = iter_frames(levels, background, profiler, labels)
+        for i, frame in enumerate(tqdm(frames, total=num_frames, disable=not progress)):
+            if video_out is not None:
+                with profiler.stage("video", 1):
+                    if video_writer is None:
+                        video_writer = open_video_writer(video_out, (frame.shape[1], frame.shape[0]), fps)
+                    video_writer.write(frame.astype(np.uint8, copy=False))
+            if writer is not None:
+                with profiler.stage("write", 1):
+                    writer.write(i, frame, store.yolo_lines(i, visible_only=labels is not None))
+            if return_frames:
+                frames_out.append(frame)
+        # waiting for the queued frames is part of the write stage
+        if writer is not None:
+            with profiler.stage("write"):
+                writer.close()
+    except BaseException:
+        # the writer does not mark an interrupted sequence complete (see ShardWriter)
+        if writer is not None:
+            writer.abort()
+        raise
+    finally:
+        if video_writer is not None:
+            with profiler.stage("video"):
+                video_writer.release()
+    store.save(os.path.join(dataset_dir, ANNOTATIONS_FILE))
+    if use_cache:
+        with profiler.stage("cache"):
+            render_cache.put(cache_key, dataset_dir, video_out)
+    profiler.save(dataset_dir)
     return frames_out
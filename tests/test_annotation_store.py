@@ -0,0 +1,67 @@
+import io
+import os
+import json
+import tempfile
+import unittest
+import numpy as np
+from src.evolver import Evolver
+from src.simulator import create_annotation
+from src.AnnotationStore import AnnotationStore, export_coco, export_mot
+
+h, w = 48, 64
+
+
+class TestAnnotationStore(unittest.TestCase):
+    def setUp(self):
+        track_1 = Evolver.compute_track(h, w, (5, 5, 3), np.array([[10, 10], [20, 30], [-10, -10]]))
+        track_2 = Evolver.compute_track(h, w, (4, 6, 3), np.array([[0, 63], [47, 0]]))
+        self.tracks = [(3, track_1), (1, track_2)]
+        self.store = AnnotationStore.from_tracks(self.tracks, w, h)
+
+    def test_from_tracks(self):
+        self.assertEqual(len(self.store), 5)
+        self.assertEqual(self.store.num_frames, 3)
+        self.assertEqual(self.store.boxes['frame'].tolist(), [0, 0, 1, 1, 2])
+        self.assertEqual(self.store.boxes['object_id'].tolist(), [0, 1, 0, 1, 0])
+        self.assertEqual(self.store.boxes['visible'].tolist(), [1, 1, 1, 1, 0])
+        row = self.store.boxes[2]
+        self.assertEqual([row['y1'], row['x1'], row['y2'], row['x2']], self.tracks[0][1]['bbox'][1].tolist())
+
+    def test_yolo_lines(self):
+        for frame in range(3):
+            expected = ""
+            for label, track in self.tracks:
+                if frame < len(track):
+                    ann = create_annotation(track['bbox'][frame].tolist(), w, h)
+                    expected += "{} {} {} {} {}\n".format(label, ann[0], ann[1], ann[2], ann[3])
+            self.assertEqual(self.store.yolo_lines(frame), expected)
+        self.assertEqual(self.store.yolo_lines(10), "")
+
+    def test_save_load(self):
+        with tempfile.TemporaryDirectory() as out_dir:
+            path = os.path.join(out_dir, "annotations.npz")
+            self.store.save(path)
+            store = AnnotationStore.load(path)
+        self.assertEqual((store.width, store.height), (w, h))
+        self.assertEqual(np.array_equal(store.boxes, self.store.boxes), True)
+
+    def test_exporters(self):
+        out = io.StringIO()
+        export_coco([("seq0", self.store), ("seq1", self.store)], out)
+        coco = json.loads(out.getvalue())
+        self.assertEqual(len(coco["images"]), 6)
+        self.assertEqual(coco["images"][3]["file_name"], "seq1/0000000000.png")
+        self.assertEqual(len(coco["annotations"]), 8)
+        self.assertEqual(coco["annotations"][4]["image_id"], 3)
+        self.assertEqual(coco["annotations"][0]["bbox"], [8, 8, 5, 5])
+        self.assertEqual([c["id"] for c in coco["categories"]], [1, 3])
+
+        out = io.StringIO()
+        export_mot(self.store, out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(lines[0], "1,1,9,9,5,5,1,3,1")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import cv2
+from src.BackgroundIterator import BackgroundIterator, StaticBackgroundIterator, VideoBackgroundIterator
+from src.BackgroundCache import BackgroundCache
+
+
+def write_video(path: str, num_frames: int, w: int = 64, h: int = 48):
+    out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), 10, (w, h))
+    for i in range(num_frames):
+        out.write(np.full((h, w, 3), i * 10, dtype=np.uint8))
+    out.release()
+
+
+class TestBackgroundIterator(unittest.TestCase):
+    def test_hold_last_frame(self):
+        bg = BackgroundIterator([np.zeros((2, 2, 3)), np.ones((2, 2, 3))])
+        self.assertEqual(np.all(next(bg) == 0), True)
+        for _ in range(3):
+            frame = next(bg)
+            self.assertEqual(np.all(frame == 1), True)
+            frame[:] = 5
+
+    def test_video_background_iterator(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "bg.mp4")
+            write_video(path, 20)
+            cap = cv2.VideoCapture(path)
+            expected = []
+            while True:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                expected.append(cv2.resize(frame, dsize=(32, 24), interpolation=cv2.INTER_AREA))
+            cap.release()
+
+            bg = VideoBackgroundIterator(path, 32, 24, buffer_size=2)
+            for i in range(len(expected) + 5):
+                frame = next(bg)
+                self.assertEqual(frame.shape, (24, 32, 3))
+                self.assertEqual(np.array_equal(frame, expected[min(i, len(expected) - 1)]), True)
+                frame[:] = 0
+            bg.close()
+
+            bg = VideoBackgroundIterator(path, 32, 24, buffer_size=2)
+            next(bg)
+            bg.close()
+
+    def test_static_background_iterator(self):
+        bg = StaticBackgroundIterator.from_color(4, 3, (10, 20, 30))
+        bg.reserve(3)
+        frames = [next(bg) for _ in range(3)]
+        for frame in frames:
+            self.assertEqual(frame.dtype, np.uint8)
+            self.assertEqual(frame.shape, (3, 4, 3))
+            self.assertEqual(frame[0, 0].tolist(), [10, 20, 30])
+            frame[:] = 0
+        # the ring of buffers is reused and refreshed
+        frame = next(bg)
+        self.assertIs(frame, frames[0])
+        self.assertEqual(np.all(frame == [10, 20, 30]), True)
+
+    def test_static_background_dirty_rects(self):
+        bg = StaticBackgroundIterator.from_color(8, 6, (10, 20, 30))
+        bg.reserve(2)
+        first = next(bg)
+        first[:] = 0
+        # only the marked rect is restored when the buffer comes around again
+        bg.mark_dirty([[1, 3, 2, 4]])
+        second = next(bg)
+        second[:] = 0
+        frame = next(bg)
+        self.assertIs(frame, first)
+        self.assertEqual(np.all(frame[1:3, 2:4] == [10, 20, 30]), True)
+        self.assertEqual(np.count_nonzero(frame.any(axis=2)), 4)
+        # buffers without marks are refreshed as a whole
+        frame = next(bg)
+        self.assertIs(frame, second)
+        self.assertEqual(np.all(frame == [10, 20, 30]), True)
+        # as are buffers marked with rects about as large as the frame
+        next(bg)[:] = 0
+        bg.mark_dirty([[0, 6, 0, 4]])
+        next(bg)
+        self.assertEqual(np.all(next(bg) == [10, 20, 30]), True)
+
+    def test_video_single_frame(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "bg.png")
+            cv2.imwrite(path, np.full((48, 64, 3), 7, dtype=np.uint8))
+            bg = VideoBackgroundIterator(path, 32, 24)
+            self.assertEqual(bg.single_frame, True)
+            self.assertEqual(np.all(next(bg) == 7), True)
+            bg.close()
+
+            path = os.path.join(tmp_dir, "bg.mp4")
+            write_video(path, 2)
+            bg = VideoBackgroundIterator(path, 32, 24)
+            self.assertEqual(bg.single_frame, False)
+            bg.close()
+
+    def test_video_background_iterator_failure(self):
+        with self.assertRaises(IOError):
+            VideoBackgroundIterator("not_existing_video.mp4", 32, 24)
+
+
+class TestBackgroundCache(unittest.TestCase):
+    def test_get(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "bg.mp4")
+            write_video(path, 12)
+            cache = BackgroundCache(os.path.join(tmp_dir, "cache"))
+            frames = cache.get(path, 32, 24)
+            self.assertEqual(frames.dtype, np.uint8)
+            self.assertEqual(frames.shape, (12, 24, 32, 3))
+            self.assertEqual(isinstance(frames, np.memmap), True)
+
+            bg = VideoBackgroundIterator(path, 32, 24)
+            for i in range(12):
+                self.assertEqual(np.array_equal(frames[i], next(bg)), True)
+            bg.close()
+
+            # second get must not decode again
+            cached = os.path.join(cache.cache_dir, cache.key(path, 32, 24) + ".npy")
+            mtime = os.stat(cached).st_mtime_ns
+            self.assertEqual(np.array_equal(cache.get(path, 32, 24), frames), True)
+            self.assertEqual(os.stat(cached).st_mtime_ns, mtime)
+            self.assertEqual(len(os.listdir(cache.cache_dir)), 1)
+
+            cache.get(path, 16, 12)
+            self.assertEqual(len(os.listdir(cache.cache_dir)), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,31 @@
+import tempfile
+import unittest
+from benchmark import Case, run_benchmarks, compare_results, parse_resolutions, STAGES
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_parse_resolutions(self):
+        self.assertEqual(parse_resolutions("224x224,1280X720"), [(224, 224), (1280, 720)])
+
+    def test_run_benchmarks(self):
+        with tempfile.TemporaryDirectory() as work_dir:
+            cases = [Case(48, 32, 2, 5, background, 2, work_dir) for background in ['color', 'video']]
+            results = run_benchmarks(cases, STAGES, {"output_format": "files", "num_threads": 2}, repeat=1)
+        self.assertEqual([case["name"] for case in results["cases"]], ["48x32-o2-f5-color", "48x32-o2-f5-video"])
+        for case in results["cases"]:
+            self.assertEqual(case["frames"], 10)
+            self.assertEqual(sorted(case["stages"]), sorted(STAGES))
+            for result in case["stages"].values():
+                self.assertGreater(result["fps"], 0)
+                self.assertGreaterEqual(result["peak_mb"], 0)
+
+    def test_compare_results(self):
+        def results(fps):
+            return {"cases": [{"name": "a", "stages": {"write": {"fps": fps}, "evolve": {"fps": 100}}}]}
+        self.assertEqual(compare_results(results(95), results(100), 0.1), [])
+        self.assertEqual(compare_results(results(80), results(100), 0.1), [("a", "write", 100, 80)])
+        self.assertEqual(compare_results(results(80), {"cases": []}, 0.1), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -43,6 +43,10 @@ class Test_evolver(unittest.TestCase):
         self.assertEqual(np.count_nonzero(modified_frame) / 3, 1)
         self.assertEqual((gth[0], gth[1], gth[2], gth[3]), (0, 0, 0, 0))
 
+        # BGRA patches are composited by simulator.Sprite
+        with self.assertRaises(AssertionError):
+            Evolver.apply_patch(frame, np.ones((3, 3, 4)), x)
+
     def test_compute_evolutions(self):
         circle = cv2.imread('../patches/circle.png')
         origin_w = 200
@@ -57,18 +61,46 @@ class Test_evolver(unittest.TestCase):
 
         # compute evolutions
         evolver = Evolver(frame_w, frame_h, origin_w, origin_h, circle, fps)
-        frames, gth = evolver.compute_evolutions(route)
-        self.assertEqual(len(frames), len(gth))
+        track, gth = evolver.compute_evolutions(route)
+        self.assertEqual(len(track), len(gth))
+        self.assertEqual(len(track), sum([int(fps * step[3] / 1000) for step in route]))
+
+        # track must place the patch as apply_patch does
+        for i in range(0, len(track), 7):
+            modified_frame, gth_i = Evolver.apply_patch(frame, circle, track['center'][i])
+            self.assertEqual(gth[i], gth_i)
+            self.assertEqual(track['bbox'][i].tolist(), gth_i)
 
-        # create video
-        frameSize = frames[0].shape[1], frames[0].shape[0]
-        codec = cv2.VideoWriter_fourcc(*"mp4v")
-        video = cv2.VideoWriter("test_video_output.mp4", codec, fps, frameSize)
+    def test_compute_evolutions_transform(self):
+        patch = np.ones((10, 20, 3))
+        fps = 10
+        route = [[100, 100, MovementType.urm, 1000, 2.0, 90],
+                 [100, 100, MovementType.urm, 1000],
+                 [200, 100, MovementType.trap, 1000, 0.5]]
+        evolver = Evolver(frame_w, frame_h, 100, 100, patch, fps)
+        track, _ = evolver.compute_evolutions(route)
+        self.assertEqual(track['scale'][:10].tolist(), [1.0, 1.1, 1.2, 1.3, 1.4, 1.5, 1.6, 1.7, 1.8, 1.9])
+        self.assertEqual(track['angle'][:10].tolist(), [0, 9, 18, 27, 36, 45, 54, 63, 72, 81])
+        # kept by steps without transform, then reached with the step motion law
+        self.assertEqual(np.allclose(track['scale'][10:20], 2), True)
+        self.assertEqual(np.all(track['angle'][10:] == 90), True)
+        self.assertEqual(np.all(np.diff(track['scale'][20:]) < 0), True)
+        self.assertEqual((evolver.scale, evolver.angle), (0.5, 90))
 
-        for frm in frames:
-            video.write(frm.astype('uint8'))
-        video.release()
+        # bbox follows the scaled and rotated extent: 40x20 patch rotated by 90 degrees
+        top, left, bottom, right = track['bbox'][10]
+        self.assertEqual((bottom - top + 1, right - left + 1), (40, 20))
+        src = track['src'][10]
+        self.assertEqual((src[1] - src[0], src[3] - src[2]), (40, 20))
 
+    def test_compute_track(self):
+        x = np.array([[200, 400], [0, 0], [-2, -2], [-1, -1], [719, 1279]], dtype=float)
+        track = Evolver.compute_track(frame_h, frame_w, (3, 3, 3), x)
+        self.assertEqual(track['bbox'].tolist(), [[199, 399, 201, 401], [0, 0, 1, 1], [-1, -1, -1, -1],
+                                                  [0, 0, 0, 0], [718, 1278, 719, 1279]])
+        self.assertEqual(track['dst'][1].tolist(), [0, 2, 0, 2])
+        self.assertEqual(track['src'][1].tolist(), [1, 3, 1, 3])
+        self.assertEqual(track['src'][4].tolist(), [0, 2, 0, 2])
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,47 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import cv2
+from src.FrameWriter import FrameWriter
+
+
+class TestFrameWriter(unittest.TestCase):
+    def test_write(self):
+        frames = [np.full((8, 10, 3), i * 20, dtype=np.uint8) for i in range(10)]
+        with tempfile.TemporaryDirectory() as out_dir:
+            with FrameWriter(out_dir, num_threads=3, max_pending=2) as writer:
+                for i, frame in enumerate(frames):
+                    writer.write(i, frame, "0 0.5 0.5 0.1 0.1\n")
+            files = sorted(os.listdir(out_dir))
+            self.assertEqual(len(files), 20)
+            self.assertEqual(files[:2], ["0000000000.png", "0000000000.txt"])
+            for i, frame in enumerate(frames):
+                fn = os.path.join(out_dir, "{:010d}".format(i))
+                self.assertEqual(np.array_equal(cv2.imread(fn + ".png"), frame), True)
+                with open(fn + ".txt") as file:
+                    self.assertEqual(file.read(), "0 0.5 0.5 0.1 0.1\n")
+
+    def test_image_formats(self):
+        frame = np.full((8, 10, 3), 100, dtype=np.uint8)
+        with tempfile.TemporaryDirectory() as out_dir:
+            with FrameWriter(out_dir, image_format='jpg', quality=90) as writer:
+                writer.write(0, frame, "")
+            with FrameWriter(out_dir, image_format='webp', quality=90) as writer:
+                writer.write(1, frame, "")
+            with FrameWriter(out_dir, png_compression=9) as writer:
+                writer.write(2, frame, "")
+            self.assertEqual(sorted(os.listdir(out_dir)), ["0000000000.jpg", "0000000000.txt", "0000000001.txt",
+                                                           "0000000001.webp", "0000000002.png", "0000000002.txt"])
+        with self.assertRaises(ValueError):
+            FrameWriter(out_dir, image_format='bmp')
+
+    def test_write_error(self):
+        writer = FrameWriter("not_existing_dir")
+        writer.write(0, np.zeros((4, 4, 3), dtype=np.uint8), "")
+        with self.assertRaises(OSError):
+            writer.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
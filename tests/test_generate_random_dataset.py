@@ -0,0 +1,66 @@
+import os
+import shutil
+import tempfile
+import unittest
+from generate_random_dataset import shard_range, merge_shards
+from src.RunManifest import RunManifest, DONE, PENDING
+
+
+def write_shard(dataset_dir: str, shard_index: int, first_index: int, sequences: list, status: str = DONE, seed: int = 7,
+                backgrounds: list = None, objects: list = None):
+    os.makedirs(dataset_dir)
+    for i in range(first_index, first_index + len(sequences)):
+        os.makedirs(os.path.join(dataset_dir, f"seq{i}"))
+        open(os.path.join(dataset_dir, f"seq{i}", "annotations.npy"), 'w').close()
+    args = {"fps": 30, "workers": shard_index + 1, "shard_index": shard_index, "num_shards": 2}
+    RunManifest(dataset_dir, seed, args, [], sequences, backgrounds or ["bg.png"], [status] * len(sequences),
+                {"route_{}".format(first_index): "1,2\n3,4,const,100\n"}, first_index, objects or ["a.png", "b.png"]).save()
+
+
+class TestShards(unittest.TestCase):
+    def test_shard_range(self):
+        for num_sequences, num_shards in [(10, 3), (5, 5), (7, 1)]:
+            shards = [shard_range(num_sequences, i, num_shards) for i in range(num_shards)]
+            self.assertEqual([i for shard in shards for i in shard], list(range(num_sequences)))
+            self.assertEqual(max(len(s) for s in shards) - min(len(s) for s in shards) <= 1, True)
+
+    def test_merge_shards(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            shard_dirs = [os.path.join(tmp_dir, "shard0"), os.path.join(tmp_dir, "shard1")]
+            write_shard(shard_dirs[0], 0, 0, ["a.json", "b.json"])
+            write_shard(shard_dirs[1], 1, 2, ["c.json"], PENDING)
+            merged_dir = os.path.join(tmp_dir, "merged")
+            os.makedirs(merged_dir)
+            self.assertRaises(ValueError, merge_shards, shard_dirs[:1], merged_dir)
+            # shards are complete before they are merged
+            self.assertRaises(ValueError, merge_shards, shard_dirs, merged_dir)
+            RunManifest.load(shard_dirs[1]).mark_done(0)
+
+            manifest = merge_shards(shard_dirs[::-1], merged_dir)
+            self.assertEqual(sorted(os.listdir(merged_dir)), ["manifest.json", "seq0", "seq1", "seq2"])
+            self.assertEqual(sorted(os.listdir(shard_dirs[1])), ["done.log", "manifest.json"])
+            loaded = RunManifest.load(merged_dir)
+            self.assertEqual((loaded.seed, loaded.first_index, loaded.sequences), (7, 0, ["a.json", "b.json", "c.json"]))
+            self.assertEqual(loaded.pending(), [])
+            self.assertEqual((loaded.args["shard_index"], loaded.args["num_shards"]), (0, 1))
+            self.assertEqual(sorted(loaded.generated_routes), ["route_0", "route_2"])
+            self.assertEqual(manifest.sequences, loaded.sequences)
+            self.assertEqual((loaded.backgrounds, loaded.objects), (["bg.png"], ["a.png", "b.png"]))
+
+    def test_merge_other_run(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            shard_dirs = [os.path.join(tmp_dir, "shard0"), os.path.join(tmp_dir, "shard1")]
+            write_shard(shard_dirs[0], 0, 0, ["a.json"])
+            write_shard(shard_dirs[1], 1, 1, ["b.json"], seed=8)
+            self.assertRaises(ValueError, merge_shards, shard_dirs, tmp_dir)
+            self.assertEqual(os.path.isdir(os.path.join(shard_dirs[1], "seq1")), True)
+
+            # patch labels index files listed in another order on another machine
+            for other in [{"objects": ["b.png", "a.png"]}, {"backgrounds": ["bg2.png"]}]:
+                shutil.rmtree(shard_dirs[1])
+                write_shard(shard_dirs[1], 1, 1, ["b.json"], **other)
+                self.assertRaises(ValueError, merge_shards, shard_dirs, tmp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
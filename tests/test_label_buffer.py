@@ -0,0 +1,98 @@
+import unittest
+import numpy as np
+import cv2
+from src.evolver import Evolver
+from src.simulator import Sprite, iter_frames, patch_mask
+from src.BackgroundIterator import BackgroundIterator
+from src.AnnotationStore import AnnotationStore
+from src.LabelBuffer import LabelBuffer
+
+h, w = 40, 60
+
+
+def square(size: int) -> np.ndarray:
+    patch = np.zeros((size, size, 3), dtype=np.uint8)
+    patch[:, :, 2] = 255
+    return patch
+
+
+class TestLabelBuffer(unittest.TestCase):
+    def test_occlusion(self):
+        # a covered for its bottom half by c, b hidden under c, d out of the frame for its bottom half
+        positions = [[[15, 15]], [[20, 15]], [[20, 15]], [[40, 39]]]
+        levels = []
+        for position in positions:
+            patch = square(10)
+            levels.append((patch, patch_mask(patch), Evolver.compute_track(h, w, patch.shape, np.array(position))))
+        store = AnnotationStore.from_tracks([(i, track) for i, (_, _, track) in enumerate(levels)], w, h)
+        full = store.boxes.copy()
+        labels = LabelBuffer(store, min_visible=0.3, tight_boxes=True)
+        frame = next(iter_frames(levels, BackgroundIterator([np.zeros((h, w, 3), dtype=np.uint8)]), labels=labels))
+
+        self.assertEqual(np.count_nonzero(labels.ids), 0)
+        self.assertEqual(store.boxes['visible'].tolist(), [0.5, 0, 1, 0.5])
+        a, b, c, d = store.boxes
+        self.assertEqual([a['y1'], a['x1'], a['y2'], a['x2']], [full[0]['y1'], full[0]['x1'], full[2]['y1'] - 1, full[0]['x2']])
+        self.assertEqual([b['y1'], b['x1'], b['y2'], b['x2']], [-1] * 4)
+        self.assertEqual([c['y1'], c['x1'], c['y2'], c['x2']], [full[2]['y1'], full[2]['x1'], full[2]['y2'], full[2]['x2']])
+        self.assertEqual([d['y1'], d['x1'], d['y2'], d['x2']], [full[3]['y1'], full[3]['x1'], h - 1, full[3]['x2']])
+        self.assertEqual(store.yolo_lines(0, visible_only=True).count("\n"), 3)
+        self.assertEqual(np.count_nonzero(frame[:, :, 2]), 150 + 50)
+
+        # without tight boxes only the dropped objects change
+        store = AnnotationStore.from_tracks([(i, track) for i, (_, _, track) in enumerate(levels)], w, h)
+        labels = LabelBuffer(store, min_visible=0.6)
+        next(iter_frames(levels, BackgroundIterator([np.zeros((h, w, 3), dtype=np.uint8)]), labels=labels))
+        self.assertEqual(store.boxes['visible'].tolist(), [0, 0, 1, 0])
+        self.assertEqual(np.array_equal(store.boxes[2], full[2]), True)
+
+    def test_transparent_patch(self):
+        # a patch drawing no pixel is dropped as objects without visible pixels
+        patches = [square(10), np.zeros((10, 10, 4), dtype=np.uint8)]
+        for tight_boxes in [False, True]:
+            levels = [(patch, patch_mask(patch), Evolver.compute_track(h, w, patch.shape, np.array([[15, 15 + 20 * i]])))
+                      for i, patch in enumerate(patches)]
+            store = AnnotationStore.from_tracks([(i, track) for i, (_, _, track) in enumerate(levels)], w, h)
+            labels = LabelBuffer(store, tight_boxes=tight_boxes)
+            next(iter_frames(levels, BackgroundIterator([np.zeros((h, w, 3), dtype=np.uint8)]), labels=labels))
+            self.assertEqual(store.boxes['visible'].tolist(), [1, 0])
+            self.assertEqual(store.boxes[1]['x1'], -1)
+            self.assertEqual(store.yolo_lines(0, visible_only=True).count("\n"), 1)
+
+    def test_visibility(self):
+        # against the id buffer of all the objects painted over the whole frame
+        rng = np.random.default_rng(0)
+        patches = []
+        for size in [7, 12, 20]:
+            patch = np.zeros((size, size + 3, 4), dtype=np.uint8)
+            cv2.circle(patch, (size // 2, size // 2), size // 2, (255, 255, 255, 128), -1)
+            patch[size // 3:, size // 3:] = 255
+            patches.append(patch)
+        labels = LabelBuffer(AnnotationStore.from_tracks([], w, h))
+        for _ in range(50):
+            placed = []
+            for i in range(12):
+                sprite = Sprite(patches[i % 3])
+                position = rng.integers([-5, -5], [w + 5, h + 5])
+                placed.append((sprite, Evolver.compute_track(h, w, patches[i % 3].shape, position[None])[0]))
+            sprites, steps = [sprite for sprite, _ in placed], np.array([step for _, step in placed])
+            counts, totals, boxes, _ = labels.visibility(sprites, steps)
+            self.assertEqual(labels.visibility(sprites, steps, tight=False)[0].tolist(), counts.tolist())
+
+            ids = np.zeros((h, w), dtype=int)
+            for k, (sprite, step) in enumerate(placed):
+                if step['bbox'][0] >= 0:
+                    fr_i, fr_f, fc_i, fc_f = step['dst']
+                    pr_i, pr_f, pc_i, pc_f = step['src']
+                    ids[fr_i:fr_f, fc_i:fc_f][sprite.coverage[pr_i:pr_f, pc_i:pc_f]] = k + 1
+            for k, (sprite, step) in enumerate(placed):
+                rows, cols = np.nonzero(ids == k + 1)
+                self.assertEqual(counts[k], len(rows))
+                self.assertEqual(totals[k], np.count_nonzero(sprite.coverage))
+                if len(rows) > 0:
+                    self.assertEqual(boxes[k].tolist(), [rows.min(), cols.min(), rows.max(), cols.max()])
+            self.assertEqual(np.count_nonzero(labels.ids), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,7 @@
 import unittest
 import numpy as np
 from src.motion_law import urm, uarm, trapezoidal_profile
+from src.motion_law import urm_array, uarm_array, trapezoidal_profile_array
 
 # global
 origin = np.array([400, 200], dtype=float)
@@ -73,6 +74,29 @@ class TestMotionLaw(unittest.TestCase):
         self.assertEqual(all(flag), False)
         self.assertEqual((x[0], x[1]), (origin[0], origin[1]))
 
+    def test_array_laws_match_scalar(self):
+        t = np.arange(num_step + 1) * step
+        v = (dest - origin) / tf
+        acc = 2 * (dest - origin - v * tf) / (tf ** 2)
+        vc = np.sign((dest - origin) / tf)
+        vc = vc * np.random.uniform(abs(dest - origin) / tf + 0.001, 2 * abs(dest - origin) / tf)
+        for k in range(2):
+            x_urm = urm_array(origin[k], v[k], t)
+            x_uarm = uarm_array(origin[k], v[k], acc[k], t)
+            flag, x_trap = trapezoidal_profile_array(origin[k], dest[k], tf, vc[k], t)
+            self.assertEqual(flag, True)
+            for i in range(num_step + 1):
+                t_i = i * step
+                self.assertEqual(x_urm[i], urm(origin[k], v[k], t_i))
+                self.assertEqual(x_uarm[i], uarm(origin[k], v[k], acc[k], t_i))
+                self.assertEqual(x_trap[i], trapezoidal_profile(origin[k], dest[k], tf, vc[k], t_i)[1])
+
+    def test_trapezoidal_array_failure(self):
+        vc = 2 * abs(dest[0] - origin[0]) / tf + 1
+        flag, x = trapezoidal_profile_array(origin[0], dest[0], tf, vc, np.arange(10) * step)
+        self.assertEqual(flag, False)
+        self.assertEqual(np.all(x == origin[0]), True)
+
 
 if __name__ == '__main__':
     unittest.main()
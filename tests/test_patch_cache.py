@@ -0,0 +1,62 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import cv2
+from src.PatchCache import PatchCache, load_patch
+
+
+class TestPatchCache(unittest.TestCase):
+    def test_get_decodes_once(self):
+        cache = PatchCache()
+        patch, mask = cache.get('../patches/circle.png', 0.5)
+        self.assertEqual(patch.dtype, np.uint8)
+        self.assertEqual(patch.shape[:2], mask.shape)
+        self.assertEqual(np.array_equal(patch, load_patch('../patches/circle.png', 0.5)), True)
+        self.assertEqual(patch.flags.writeable, False)
+
+        patch_2, mask_2 = cache.get('../patches/circle.png', 0.5)
+        self.assertIs(patch_2, patch)
+        self.assertIs(mask_2, mask)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        cache.get('../patches/circle.png', 1)
+        self.assertEqual((cache.hits, cache.misses, len(cache)), (1, 2, 2))
+
+    def test_load_alpha(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "patch.png")
+            patch = np.zeros((4, 4, 4), dtype=np.uint8)
+            patch[:2] = [10, 20, 30, 255]
+            patch[2] = [200, 100, 50, 51]
+            cv2.imwrite(path, patch)
+            loaded = load_patch(path, 1)
+        self.assertEqual(loaded.shape, (4, 4, 4))
+        self.assertEqual(loaded[0, 0].tolist(), [10, 20, 30, 255])
+        self.assertEqual(loaded[2, 0].tolist(), [40, 20, 10, 51])
+        self.assertEqual(loaded[3, 0].tolist(), [0, 0, 0, 0])
+
+    def test_eviction(self):
+        cache = PatchCache(max_bytes=101 * 101 * 4 + 1)
+        cache.get('../patches/circle.png', 1)
+        cache.get('../patches/square_green.npy', 1)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.nbytes <= cache.max_bytes, True)
+        cache.get('../patches/square_green.npy', 1)
+        self.assertEqual(cache.hits, 1)
+
+    def test_modified_file(self):
+        cache = PatchCache()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "patch.npy")
+            np.save(path, np.ones((4, 4, 3), dtype=np.uint8))
+            patch, _ = cache.get(path, 1)
+            np.save(path, np.ones((4, 4, 3), dtype=np.uint8) * 2)
+            os.utime(path, ns=(os.stat(path).st_atime_ns, os.stat(path).st_mtime_ns + 10 ** 9))
+            patch_2, _ = cache.get(path, 1)
+        self.assertEqual(np.all(patch == 1), True)
+        self.assertEqual(np.all(patch_2 == 2), True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,12 @@
 import unittest
 import json
+import numpy as np
 from src.LoggingManager import configure_logging
-from create_random_route import generate_number_with_sum, routes_generator
+from create_random_route import generate_number_with_sum, routes_generator, routes_batch_generator
 from create_random_sequence import json_generator
+from create_video import parse_instructions, parse_objects
+from src.MovementType import MovementType
+from src.RouteLibrary import RouteLibrary, format_route
 
 
 class TestRandomRouteGenerator(unittest.TestCase):
@@ -30,14 +34,51 @@ class TestRandomRouteGenerator(unittest.TestCase):
         num_instructions = 10
         duration = 2000
         frame_size = (720, 640)
-        instructions = routes_generator(num_instructions, duration, frame_size)
+        origin_x, origin_y, route = routes_generator(num_instructions, duration, frame_size)
 
-        # take into account the origin
-        self.assertEqual(len(instructions), num_instructions + 1)
+        self.assertEqual(len(route), num_instructions)
+        self.assertEqual(sum(step[3] for step in route), duration)
+        self.assertEqual(0 <= origin_x <= frame_size[0] and 0 <= origin_y <= frame_size[1], True)
 
         # save file
         with open(f"../routes/test_routes.txt", 'w+') as outfile:
-            outfile.writelines(instructions)
+            outfile.writelines(format_route(origin_x, origin_y, route))
+        self.assertEqual(parse_instructions("../routes/test_routes.txt"), (origin_x, origin_y, route))
+
+    def test_routes_batch_generator(self):
+        num_routes, duration, frame_size = 500, 2000, (160, 120)
+        counts = np.random.default_rng(0).integers(1, 9, size=num_routes)
+        origins, steps, counts_out = routes_batch_generator(num_routes, counts, duration, frame_size, 100,
+                                                            commands=["pause", "trap"], seed=3)
+        self.assertEqual(counts_out.tolist(), counts.tolist())
+        _, steps_2, _ = routes_batch_generator(num_routes, counts, duration, frame_size, 100, commands=["pause", "trap"], seed=3)
+        self.assertEqual(steps.tobytes(), steps_2.tobytes())
+
+        library = RouteLibrary.from_batch(["r{:03d}".format(i) for i in range(num_routes)], origins, steps, counts)
+        for i in range(num_routes):
+            origin_x, origin_y, route = library.get("r{:03d}".format(i))
+            self.assertEqual(len(route), counts[i])
+            self.assertEqual(sum(step[3] for step in route), duration)
+            self.assertEqual(min(step[3] for step in route) >= 100, True)
+            # pauses (const steps with these commands) stay in place, never start a route nor follow a pause
+            previous, previous_pause = (origin_x, origin_y), True
+            for dw, dh, command, _ in route:
+                pause = command == MovementType.urm
+                self.assertEqual(pause and previous_pause, False)
+                if pause:
+                    self.assertEqual((dw, dh), previous)
+                self.assertEqual(0 <= dw <= frame_size[0] and 0 <= dh <= frame_size[1], True)
+                previous, previous_pause = (dw, dh), pause
+
+    def test_in_memory_sequence(self):
+        routes = {"route_a": routes_generator(3, 1000, (640, 480)), "route_b": routes_generator(4, 1000, (640, 480))}
+        sequence = json_generator(2, routes=sorted(routes), patches=["../patches/circle.png"])
+        instructions = parse_objects(sequence, routes)
+        self.assertEqual(len(instructions), 2)
+        for obj, instruction in zip(sequence, instructions):
+            self.assertEqual((instruction.origin_x, instruction.origin_y, instruction.route), routes[obj["route"]])
+        # objects are not modified
+        self.assertEqual("route_library" in sequence[0], False)
 
 
 class TestRandomSequenceGenerator(unittest.TestCase):
@@ -47,6 +88,15 @@ class TestRandomSequenceGenerator(unittest.TestCase):
         with open(f"../sequences/test_sequence.json", 'w+') as outfile:
             json.dump(sequence, outfile)
 
+    def test_json_generator_rng(self):
+        routes = ["route_{}".format(i) for i in range(1000)]
+        sequence = json_generator(800, routes=routes, patches=["a.png", "b.png"], rng=np.random.default_rng(5))
+        self.assertEqual(len(sequence), 800)
+        self.assertEqual(len(set(obj["route"] for obj in sequence)), 800)
+        self.assertEqual([obj["patch_label"] for obj in sequence], sorted(obj["patch_label"] for obj in sequence))
+        self.assertEqual(all(0.01 <= obj["patch_ratio"] <= 0.09 for obj in sequence), True)
+        self.assertEqual(json_generator(800, routes=routes, patches=["a.png", "b.png"], rng=np.random.default_rng(5)), sequence)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,108 @@
+import os
+import time
+import tempfile
+import unittest
+import numpy as np
+from src.MovementType import MovementType
+from src.simulator import simulate, Instruction
+from src.BackgroundIterator import BackgroundIterator
+from src.RenderCache import RenderCache, render_key, has_random_steps
+
+
+def make_instructions(label: int = 0):
+    patch = np.ones((5, 5, 3), dtype=np.uint8) * 200
+    return [Instruction(label, patch, 5, 5, [[50, 30, MovementType.urm, 1000]])]
+
+
+class TestRenderCache(unittest.TestCase):
+    def test_render_key(self):
+        key = render_key(make_instructions(), "0,0,0", 60, 40, 10, 1, {"image_format": "png", "num_threads": 4})
+        self.assertEqual(key, render_key(make_instructions(), "0,0,0", 60, 40, 10, 1, {"image_format": "png", "num_threads": 2}))
+        self.assertNotEqual(key, render_key(make_instructions(1), "0,0,0", 60, 40, 10, 1, {"image_format": "png"}))
+        self.assertNotEqual(key, render_key(make_instructions(), "0,0,0", 60, 40, 10, 2, {"image_format": "png"}))
+        self.assertNotEqual(key, render_key(make_instructions(), "0,0,0", 60, 40, 10, 1, {"image_format": "jpg"}))
+
+    def test_has_random_steps(self):
+        self.assertEqual(has_random_steps(make_instructions()), False)
+        instructions = make_instructions()
+        instructions[0].route.append([10, 10, MovementType.trap, 500])
+        self.assertEqual(has_random_steps(instructions), True)
+        # without key the sequence is rendered and not cached
+        with tempfile.TemporaryDirectory() as out_dir:
+            cache = RenderCache(os.path.join(out_dir, "cache"))
+            bg = BackgroundIterator([np.zeros((40, 60, 3), dtype=np.uint8)])
+            simulate(60, 40, bg, instructions, out_dir, None, 10, render_cache=cache)
+            self.assertEqual((cache.hits, cache.misses, cache.entries()), (0, 0, []))
+
+    def test_simulate_cached(self):
+        with tempfile.TemporaryDirectory() as out_dir:
+            cache = RenderCache(os.path.join(out_dir, "cache"))
+            for i in range(2):
+                bg = BackgroundIterator([np.zeros((40, 60, 3), dtype=np.uint8)])
+                simulate(60, 40, bg, make_instructions(), out_dir, None, 10, render_cache=cache, cache_key="k")
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+            self.assertEqual(sorted(os.listdir(os.path.join(out_dir, "seq0"))), sorted(os.listdir(os.path.join(out_dir, "seq1"))))
+            with open(os.path.join(out_dir, "seq1", "0000000003.txt")) as file:
+                self.assertEqual(file.read().startswith("0 "), True)
+
+            # the cached entry has no video
+            video = os.path.join(out_dir, "vid.mp4")
+            bg = BackgroundIterator([np.zeros((40, 60, 3), dtype=np.uint8)])
+            simulate(60, 40, bg, make_instructions(), out_dir, video, 10, render_cache=cache, cache_key="k")
+            self.assertEqual(cache.misses, 2)
+            os.remove(video)
+            self.assertEqual(cache.get("k", tempfile.mkdtemp(dir=out_dir), video), True)
+            self.assertEqual(os.path.exists(video), True)
+
+    def test_shared_video_out(self):
+        # entries linked to a video rendered again, or filled again by get, are not modified
+        with tempfile.TemporaryDirectory() as out_dir:
+            cache = RenderCache(os.path.join(out_dir, "cache"))
+            video = os.path.join(out_dir, "out.mp4")
+            videos = []
+            for key, label in [("a", 0), ("b", 1)]:
+                bg = BackgroundIterator([np.full((40, 60, 3), 50 * label, dtype=np.uint8)])
+                instructions = make_instructions(label)
+                instructions[0].route[0][0] += 20 * label
+                simulate(60, 40, bg, instructions, out_dir, video, 10, render_cache=cache, cache_key=key)
+                with open(video, 'rb') as file:
+                    videos.append(file.read())
+            self.assertNotEqual(videos[0], videos[1])
+            with open(os.path.join(cache.cache_dir, "a", "video.mp4"), 'rb') as file:
+                self.assertEqual(file.read(), videos[0])
+            self.assertEqual(cache.get("a", tempfile.mkdtemp(dir=out_dir), video), True)
+            self.assertEqual(cache.get("b", tempfile.mkdtemp(dir=out_dir), video), True)
+            with open(os.path.join(cache.cache_dir, "a", "video.mp4"), 'rb') as file:
+                self.assertEqual(file.read(), videos[0])
+            with open(video, 'rb') as file:
+                self.assertEqual(file.read(), videos[1])
+
+    def test_simulate_cached_video_format(self):
+        # the video is written in the seqN directory
+        with tempfile.TemporaryDirectory() as out_dir:
+            cache = RenderCache(os.path.join(out_dir, "cache"))
+            for i in range(2):
+                bg = BackgroundIterator([np.zeros((40, 60, 3), dtype=np.uint8)])
+                simulate(60, 40, bg, make_instructions(), out_dir, None, 10, writer_options={"output_format": "video"},
+                         render_cache=cache, cache_key="k")
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+            self.assertEqual(sorted(os.listdir(os.path.join(out_dir, "seq1"))), sorted(os.listdir(os.path.join(out_dir, "seq0"))))
+            self.assertEqual(os.path.getsize(os.path.join(out_dir, "seq1", "video.mp4")) > 0, True)
+
+    def test_evict(self):
+        with tempfile.TemporaryDirectory() as out_dir:
+            seq_dir = os.path.join(out_dir, "seq")
+            os.makedirs(seq_dir)
+            with open(os.path.join(seq_dir, "a.txt"), 'wb') as file:
+                file.write(b"0" * 100)
+            cache = RenderCache(os.path.join(out_dir, "cache"), max_bytes=250)
+            for key in ["k1", "k2", "k3"]:
+                cache.put(key, seq_dir)
+                # mtime resolution
+                time.sleep(0.01)
+            self.assertEqual(sorted(os.listdir(cache.cache_dir)), ["k2", "k3"])
+            self.assertEqual(cache.nbytes(), 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
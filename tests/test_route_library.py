@@ -0,0 +1,58 @@
+import os
+import json
+import tempfile
+import unittest
+import numpy as np
+from create_video import parse_instructions, parse_json
+from compile_routes import compile_routes
+from src.MovementType import MovementType
+from src.RouteLibrary import RouteLibrary, format_route
+
+
+class TestRouteLibrary(unittest.TestCase):
+    def test_compile(self):
+        library = compile_routes(['../routes'])
+        names = sorted(os.path.splitext(fn)[0] for fn in os.listdir('../routes') if fn.endswith('.txt'))
+        self.assertEqual(library.names.tolist(), names)
+        for name in names:
+            self.assertEqual(library.get(name), parse_instructions(os.path.join('../routes', name + '.txt')))
+        self.assertEqual('boxed' in library, True)
+        self.assertEqual('box' in library, False)
+        self.assertRaises(KeyError, library.get, 'zzz')
+
+    def test_save_load_export(self):
+        routes = {"b": (1, 2, [[10, 20, MovementType.urm, 1000], [30, 40, MovementType.trap, 500, 1.5, 90.0]]),
+                  "a": (3, 4, [[50, 60, MovementType.uarm, 200, 0.5]]),
+                  "c": (5, 6, [])}
+        library = RouteLibrary.from_routes(routes)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "library.npz")
+            library.save(path)
+            for mmap in [True, False]:
+                loaded = RouteLibrary.load(path, mmap=mmap)
+                self.assertEqual(loaded.names.tolist(), ["a", "b", "c"])
+                for name, route in routes.items():
+                    self.assertEqual(loaded.get(name), route)
+
+            paths = library.export_text(os.path.join(tmp_dir, "routes"))
+            self.assertEqual(len(paths), 3)
+            for name, route in routes.items():
+                self.assertEqual(parse_instructions(os.path.join(tmp_dir, "routes", name + ".txt")), route)
+        self.assertEqual(format_route(*routes["a"]), ["3,4\n", "50,60,acc,200,0.5\n"])
+
+    def test_sequence_route_library(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "library.npz")
+            compile_routes(['../routes/boxed.txt']).save(path)
+            sequence = os.path.join(tmp_dir, "sequence.json")
+            with open(sequence, 'w') as file:
+                json.dump([{"patch_label": 0, "route_library": path, "route": "boxed", "patch": "../patches/circle.png"},
+                           {"patch_label": 1, "route": "../routes/boxed.txt", "patch": "../patches/circle.png"}], file)
+            from_library, from_text = parse_json(sequence)
+        self.assertEqual((from_library.origin_x, from_library.origin_y), (from_text.origin_x, from_text.origin_y))
+        self.assertEqual(from_library.route, from_text.route)
+        self.assertEqual(np.array_equal(from_library.patch, from_text.patch), True)
+
+
+if __name__ == '__main__':
+    unittest.main()
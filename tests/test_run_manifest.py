@@ -0,0 +1,66 @@
+import os
+import tempfile
+import unittest
+from src.RunManifest import RunManifest, MANIFEST_FILE, DONE_LOG, DONE, PENDING
+
+
+class TestRunManifest(unittest.TestCase):
+    def test_save_load(self):
+        with tempfile.TemporaryDirectory() as dataset_dir:
+            route = os.path.join(dataset_dir, "route.txt")
+            open(route, 'w').close()
+            manifest = RunManifest(dataset_dir, 7, {"fps": 30}, [route], ["seq_a.json", "seq_b.json", "seq_c.json"], [])
+            manifest.save()
+            self.assertEqual(os.path.exists(os.path.join(dataset_dir, MANIFEST_FILE)), True)
+            self.assertEqual(manifest.pending(), [0, 1, 2])
+            manifest.mark_done(1)
+
+            loaded = RunManifest.load(dataset_dir)
+            self.assertEqual((loaded.seed, loaded.args, loaded.routes), (7, {"fps": 30}, [route]))
+            self.assertEqual(loaded.status, [PENDING, DONE, PENDING])
+            self.assertEqual(loaded.pending(), [0, 2])
+            self.assertEqual(loaded.missing_files(), ["seq_a.json", "seq_b.json", "seq_c.json"])
+
+    def test_generated_assets(self):
+        with tempfile.TemporaryDirectory() as dataset_dir:
+            sequences = [[{"patch_label": 0, "route": "route_a", "patch": "circle.png"}], "seq_b.json"]
+            manifest = RunManifest(dataset_dir, 7, {}, [], sequences, [], generated_routes={"route_a": "1,2\n3,4,const,100\n"})
+            manifest.save()
+            loaded = RunManifest.load(dataset_dir)
+            self.assertEqual(loaded.sequences, sequences)
+            self.assertEqual(loaded.generated_routes, {"route_a": "1,2\n3,4,const,100\n"})
+            self.assertEqual(loaded.pending(), [0, 1])
+            # sequences generated in memory are not files
+            self.assertEqual(loaded.missing_files(), ["seq_b.json"])
+
+    def test_done_log(self):
+        with tempfile.TemporaryDirectory() as dataset_dir:
+            manifest = RunManifest(dataset_dir, 7, {}, [], ["seq_a.json", "seq_b.json", "seq_c.json"], [])
+            manifest.save()
+            with open(manifest.path, 'rb') as file:
+                saved = file.read()
+            manifest.mark_done(2)
+            manifest.mark_done(0)
+            # completed sequences do not rewrite the manifest
+            with open(manifest.path, 'rb') as file:
+                self.assertEqual(file.read(), saved)
+            # an interrupted write of the log
+            with open(os.path.join(dataset_dir, DONE_LOG), 'a') as file:
+                file.write("1")
+            self.assertEqual(RunManifest.load(dataset_dir).pending(), [1])
+            # saving again includes the log
+            manifest.save()
+            self.assertEqual(os.path.exists(os.path.join(dataset_dir, DONE_LOG)), False)
+            self.assertEqual(RunManifest.load(dataset_dir).status, [DONE, PENDING, DONE])
+
+    def test_first_index(self):
+        with tempfile.TemporaryDirectory() as dataset_dir:
+            RunManifest(dataset_dir, 7, {}, [], ["seq_c.json", "seq_d.json"], [], first_index=2).save()
+            loaded = RunManifest.load(dataset_dir)
+            self.assertEqual(loaded.first_index, 2)
+            # indices in the sequences of the shard
+            self.assertEqual(loaded.pending(), [0, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
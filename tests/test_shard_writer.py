@@ -0,0 +1,45 @@
+import os
+import tarfile
+import tempfile
+import unittest
+import numpy as np
+from src.ShardWriter import ShardWriter, ShardReader, SHARDS_INDEX
+
+
+class TestShardWriter(unittest.TestCase):
+    def test_write_read(self):
+        frames = [np.random.randint(0, 255, (8, 10, 3), dtype=np.uint8) for _ in range(10)]
+        with tempfile.TemporaryDirectory() as out_dir:
+            with ShardWriter(out_dir, frames_per_shard=3, num_threads=2, max_pending=2) as writer:
+                for i, frame in enumerate(frames):
+                    writer.write(i, frame, "{} 0.5 0.5 0.1 0.1\n".format(i))
+            self.assertEqual(sorted(os.listdir(out_dir)), ["shard-000000.tar", "shard-000001.tar", "shard-000002.tar",
+                                                           "shard-000003.tar", SHARDS_INDEX])
+            with tarfile.open(os.path.join(out_dir, "shard-000001.tar")) as tar:
+                self.assertEqual(tar.getnames(), ["0000000003.png", "0000000003.txt", "0000000004.png",
+                                                  "0000000004.txt", "0000000005.png", "0000000005.txt"])
+
+            with ShardReader(out_dir) as reader:
+                self.assertEqual(len(reader), 10)
+                for i in [7, 0, 9, 3]:
+                    image, annotations = reader[i]
+                    self.assertEqual(np.array_equal(image, frames[i]), True)
+                    self.assertEqual(annotations, "{} 0.5 0.5 0.1 0.1\n".format(i))
+                self.assertEqual(len(list(reader)), 10)
+
+    def test_abort(self):
+        frame = np.zeros((8, 10, 3), dtype=np.uint8)
+        with tempfile.TemporaryDirectory() as out_dir:
+            with self.assertRaises(KeyboardInterrupt):
+                with ShardWriter(out_dir, frames_per_shard=3, num_threads=2, max_pending=2) as writer:
+                    for i in range(5):
+                        writer.write(i, frame, "")
+                    raise KeyboardInterrupt()
+            # a partial sequence has no index, nor temporary shards
+            files = os.listdir(out_dir)
+            self.assertEqual(SHARDS_INDEX in files, False)
+            self.assertEqual(any(fn.endswith(".tmp") for fn in files), False)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,28 +1,25 @@
 import os.path
+import tempfile
 from unittest import TestCase
 import numpy as np
-from src.simulator import aggregate_frames
+from src.MovementType import MovementType
+from src.simulator import aggregate_frames, simulate, Instruction, patch_mask, build_datasets_dir, Sprite, premultiply_alpha
 from src.simulator import render_video
+from src.evolver import Evolver
+from src.BackgroundIterator import BackgroundIterator
+from src.VideoDataset import VideoDataset
 
 
 class Test(TestCase):
     def test_aggregate_frames(self):
         h, w = 10, 10
-        bg = np.zeros((h, w, 3))
-
-        f1 = np.zeros((h, w, 3))
-        f1[1, 1, 2] = 255
-        f2 = np.zeros((h, w, 3))
-        f2[2, 2, 2] = 255
-        l1 = [f1, f2]
-
-        f3 = np.zeros((h, w, 3))
-        f3[9, 9, 2] = 255
-        f4 = np.zeros((h, w, 3))
-        f4[9, 8, 2] = 255
-        f5 = np.zeros((h, w, 3))
-        f5[9, 7, 2] = 255
-        l2 = [f3, f4, f5]
+        bg = BackgroundIterator([np.zeros((h, w, 3))])
+
+        patch = np.zeros((3, 3, 3))
+        patch[1, 1, 2] = 255
+        mask = patch_mask(patch)
+        l1 = (patch, mask, Evolver.compute_track(h, w, patch.shape, np.array([[1, 1], [2, 2]])))
+        l2 = (patch, mask, Evolver.compute_track(h, w, patch.shape, np.array([[9, 9], [9, 8], [9, 7]])))
 
         all_levels = [l1, l2]
 
@@ -32,6 +29,7 @@ class Test(TestCase):
         assert type(res[0]) is np.ndarray
 
         assert res[0][5, 5, 2] == 0
+        assert res[0][0, 0, 2] == 0
 
         assert res[0][9, 9, 2] == 255
         assert res[0][1, 1, 2] == 255
@@ -40,6 +38,7 @@ class Test(TestCase):
         assert res[1][9, 8, 2] == 255
 
         assert res[2][9, 7, 2] == 255
+        assert np.count_nonzero(res[2]) == 1
 
     def test_render_video(self):
         out_path = "out_test_video.mp4"
@@ -59,3 +58,107 @@ class Test(TestCase):
 
         render_video(out_path, frames, 3)
         assert os.path.exists(out_path)
+
+    def test_simulate(self):
+        h, w, fps = 40, 60, 10
+        patch = np.ones((5, 5, 3), dtype=np.uint8) * 200
+        route = [[50, 30, MovementType.urm, 1000], [10, 10, MovementType.uarm, 500]]
+        with tempfile.TemporaryDirectory() as out_dir:
+            bg = BackgroundIterator([np.zeros((h, w, 3), dtype=np.uint8)])
+            res = simulate(w, h, bg, [Instruction(0, patch, 5, 5, route)], out_dir, os.path.join(out_dir, "vid"), fps)
+            assert res is None
+            files = os.listdir(os.path.join(out_dir, "seq0"))
+            assert len(files) == 2 * 15 + 2
+            assert "annotations.npz" in files and "profile.json" in files
+            assert os.path.exists(os.path.join(out_dir, "vid.mp4"))
+
+            bg = BackgroundIterator([np.zeros((h, w, 3), dtype=np.uint8)])
+            res = simulate(w, h, bg, [Instruction(0, patch, 5, 5, route)], out_dir, None, fps, return_frames=True)
+            assert len(res) == 15
+            assert len(os.listdir(os.path.join(out_dir, "seq1"))) == 2 * 15 + 2
+            with open(os.path.join(out_dir, "seq1", "{:010d}.txt".format(0))) as file:
+                assert file.read().startswith("0 ")
+
+    def test_sprite_alpha_blend(self):
+        h, w = 6, 8
+        patch = np.zeros((3, 3, 4), dtype=np.uint8)
+        patch[1, 1] = [0, 0, 0, 255]  # opaque black is not transparent
+        patch[0, 1] = [200, 100, 50, 128]
+        patch[2, 2] = [255, 255, 255, 0]
+        patch = premultiply_alpha(patch)
+        self.assertEqual(patch[0, 1].tolist(), [100, 50, 25, 128])
+        self.assertEqual(patch[2, 2].tolist(), [0, 0, 0, 0])
+
+        sprite = Sprite(patch)
+        for center, origin in [([2, 3], (1, 2)), ([0, 0], (-1, -1))]:
+            frame = np.full((h, w, 3), 100, dtype=np.uint8)
+            sprite.paste(frame, Evolver.compute_track(h, w, patch.shape, np.array([center]))[0])
+            r, c = origin
+            self.assertEqual(frame[r + 1, c + 1].tolist(), [0, 0, 0])
+            if r >= 0:
+                # 100 + 100 * 127 / 255, 50 + 50, 25 + 50
+                self.assertEqual(frame[r, c + 1].tolist(), [150, 100, 75])
+                self.assertEqual(frame[r + 2, c + 2].tolist(), [100, 100, 100])
+            self.assertEqual(int(np.sum(np.any(frame != 100, axis=2))), 2 if r >= 0 else 1)
+
+    def test_iter_frames_transform(self):
+        h, w = 60, 80
+        patch = np.zeros((10, 20, 3), dtype=np.uint8)
+        patch[:, :, 1] = 255
+        route = [[40, 30, MovementType.urm, 1000, 2.5, 180], [40, 30, MovementType.urm, 1000, 0.5, 45]]
+        track, _ = Evolver(w, h, 40, 30, patch, 10).compute_evolutions(route)
+        bg = BackgroundIterator([np.zeros((h, w, 3), dtype=np.uint8)] * len(track))
+        frames = aggregate_frames([(patch, patch_mask(patch), track)], bg)
+        for frame, step in zip(frames, track):
+            rows, cols = np.nonzero(np.any(frame != 0, axis=2))
+            top, left, bottom, right = step['bbox']
+            self.assertEqual((rows.min() >= top, rows.max() <= bottom, cols.min() >= left, cols.max() <= right),
+                             (True, True, True, True))
+        # the second step starts from scale 2.5, upside down
+        self.assertEqual(np.count_nonzero(frames[10][:, :, 1]), 2.5 ** 2 * patch.shape[0] * patch.shape[1])
+
+    def test_build_datasets_dir(self):
+        with tempfile.TemporaryDirectory() as out_dir:
+            base_dir = os.path.join(out_dir, "dts")
+            assert build_datasets_dir(base_dir, 2) == os.path.join(base_dir, "seq2")
+            assert build_datasets_dir(base_dir) == os.path.join(base_dir, "seq0")
+            assert build_datasets_dir(base_dir) == os.path.join(base_dir, "seq1")
+            assert build_datasets_dir(base_dir) == os.path.join(base_dir, "seq3")
+            with self.assertRaises(FileExistsError):
+                build_datasets_dir(base_dir, 2)
+
+    def test_simulate_video_only(self):
+        h, w, fps = 40, 60, 10
+        patch = np.ones((5, 5, 3), dtype=np.uint8) * 200
+        route = [[50, 30, MovementType.urm, 1000], [10, 10, MovementType.uarm, 500]]
+        with tempfile.TemporaryDirectory() as out_dir:
+            bg = BackgroundIterator([np.zeros((h, w, 3), dtype=np.uint8)])
+            simulate(w, h, bg, [Instruction(0, patch, 5, 5, route)], out_dir, None, fps, writer_options={"output_format": "video"})
+            seq_dir = os.path.join(out_dir, "seq0")
+            assert sorted(os.listdir(seq_dir)) == ["annotations.npz", "profile.json", "video.mp4"]
+
+            dataset = VideoDataset(seq_dir)
+            assert len(dataset) == 15
+            pairs = list(dataset)
+            assert len(pairs) == 15
+            frame, boxes = pairs[3]
+            assert frame.shape == (h, w, 3)
+            assert len(boxes) == 1 and boxes['frame'][0] == 3
+            labels, yolo = dataset.yolo(3)
+            assert labels.tolist() == [0] and yolo.shape == (1, 4)
+            frame, boxes = dataset[14]
+            assert frame.shape == (h, w, 3) and boxes['frame'][0] == 14
+
+    def test_video_only_dropped_objects(self):
+        # objects the LabelBuffer drops have no yolo box, as in the files output format
+        h, w, fps = 40, 60, 10
+        patch = np.ones((10, 10, 3), dtype=np.uint8) * 200
+        route = [[30, 20, MovementType.urm, 500]]
+        with tempfile.TemporaryDirectory() as out_dir:
+            bg = BackgroundIterator([np.zeros((h, w, 3), dtype=np.uint8)])
+            instructions = [Instruction(0, patch, 30, 20, route), Instruction(1, patch, 30, 20, route)]
+            simulate(w, h, bg, instructions, out_dir, None, fps, writer_options={"output_format": "video", "min_visible": 0.5})
+            dataset = VideoDataset(os.path.join(out_dir, "seq0"))
+            assert len(dataset.boxes(2)) == 2 and len(dataset.boxes(2, visible_only=True)) == 1
+            labels, yolo = dataset.yolo(2)
+            assert labels.tolist() == [1] and np.all(yolo > 0)
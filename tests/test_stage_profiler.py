@@ -0,0 +1,69 @@
+import os
+import json
+import tempfile
+import unittest
+import tracemalloc
+import types
+from unittest import mock
+import numpy as np
+from src.MovementType import MovementType
+from src.simulator import simulate, Instruction
+from src.BackgroundIterator import BackgroundIterator
+from src.StageProfiler import StageProfiler, PROFILE_FILE, CPROFILE_FILE
+
+
+class TestStageProfiler(unittest.TestCase):
+    def test_stage(self):
+        profiler = StageProfiler(trace_memory=True)
+        for _ in range(3):
+            with profiler.stage("a", 2):
+                data = np.ones(2 ** 20, dtype=np.uint8)
+        with profiler.stage("b") as stage:
+            stage["frames"] += 5
+        del data
+        report = profiler.report()
+        self.assertEqual(list(report["stages"]), ["a", "b"])
+        a = report["stages"]["a"]
+        self.assertEqual((a["calls"], a["frames"]), (3, 6))
+        self.assertGreaterEqual(a["peak_mb"], 1.0)
+        self.assertGreater(a["fps"], 0)
+        self.assertEqual(report["stages"]["b"]["frames"], 5)
+        self.assertGreaterEqual(report["wall"], a["wall"])
+
+    def test_stage_without_reset_peak(self):
+        # python < 3.9 has no tracemalloc.reset_peak, the profiler restarts its own tracing instead
+        tracemalloc.stop()
+        self.addCleanup(tracemalloc.stop)
+        old_tracemalloc = types.SimpleNamespace(**{name: getattr(tracemalloc, name) for name in
+                                                   ["start", "stop", "is_tracing", "get_traced_memory"]})
+        with mock.patch("src.StageProfiler.tracemalloc", old_tracemalloc):
+            profiler = StageProfiler(trace_memory=True)
+            with profiler.stage("a"):
+                data = np.ones(2 ** 20, dtype=np.uint8)
+            with profiler.stage("b"):
+                pass
+        del data
+        stages = profiler.report()["stages"]
+        self.assertGreaterEqual(stages["a"]["peak_mb"], 1.0)
+        self.assertLess(stages["b"]["peak_mb"], 1.0)
+
+    def test_simulate_profile(self):
+        patch = np.ones((5, 5, 3), dtype=np.uint8) * 200
+        route = [[50, 30, MovementType.urm, 1000]]
+        with tempfile.TemporaryDirectory() as out_dir:
+            profiler = StageProfiler(trace_memory=True, cprofile=True)
+            with profiler.stage("assets"):
+                instructions = [Instruction(0, patch, 5, 5, route)]
+            bg = BackgroundIterator([np.zeros((40, 60, 3), dtype=np.uint8)])
+            simulate(60, 40, bg, instructions, out_dir, os.path.join(out_dir, "vid"), 10, profiler=profiler)
+            self.assertEqual(os.path.exists(os.path.join(out_dir, "seq0", CPROFILE_FILE)), True)
+            with open(os.path.join(out_dir, "seq0", PROFILE_FILE)) as file:
+                stages = json.load(file)["stages"]
+            self.assertEqual(sorted(stages), ["aggregate", "assets", "background", "evolve", "video", "write"])
+            for name in ["evolve", "aggregate", "background", "video", "write"]:
+                self.assertEqual(stages[name]["frames"], 10)
+            self.assertIsNotNone(stages["write"]["peak_mb"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+import numpy as np
+from src.TransformCache import TransformCache, quantize_transform, transform_patch, transformed_shape
+
+
+class TestTransformCache(unittest.TestCase):
+    def test_quantize(self):
+        scale, angle = quantize_transform([0.504, 0.0, 1.0], [-90.4, 359.7, 720])
+        self.assertEqual(np.allclose(scale, [0.5, 0.01, 1.0]), True)
+        self.assertEqual(angle.tolist(), [270.0, 0.0, 0.0])
+
+    def test_transform_shape(self):
+        patch = np.full((10, 20, 3), 255, dtype=np.uint8)
+        mask = np.ones((10, 20), dtype=bool)
+        for scale, angle in [(1, 0), (0.5, 0), (2, 0), (1, 90), (1.5, 45), (0.3, 270)]:
+            out, out_mask = transform_patch(patch, mask, scale, angle)
+            self.assertEqual(out.shape[:2], transformed_shape(patch.shape, scale, angle))
+            self.assertEqual(out_mask.shape, out.shape[:2])
+        self.assertEqual(transformed_shape(patch.shape, 1, 90), (20, 10))
+        self.assertEqual(transformed_shape(patch.shape, 2, 180), (20, 40))
+
+        # rotated corners are transparent
+        out, out_mask = transform_patch(patch, mask, 1, 45)
+        self.assertEqual(out_mask[0, 0], False)
+        self.assertEqual(out[0, 0].tolist(), [0, 0, 0])
+        self.assertEqual(out_mask[out.shape[0] // 2, out.shape[1] // 2], True)
+
+    def test_cache(self):
+        patch = np.full((10, 20, 4), 255, dtype=np.uint8)
+        mask = np.ones((10, 20), dtype=bool)
+        cache = TransformCache(patch, mask)
+        self.assertIs(cache.get(1.001, 0.2)[0], patch)
+        out, _ = cache.get(0.5, 90)
+        self.assertIs(cache.get(0.499, 90.3)[0], out)
+        self.assertEqual((cache.hits, cache.misses, len(cache)), (1, 1, 1))
+        self.assertEqual(cache.nbytes, out.nbytes + out.size // 4)
+
+        cache = TransformCache(patch, mask, max_bytes=2 * (20 * 10 * 5) - 1)
+        cache.get(1, 90)
+        cache.get(1, 180)
+        cache.get(1, 270)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.nbytes <= cache.max_bytes, True)
+
+
+if __name__ == '__main__':
+    unittest.main()